@@ -1,16 +1,16 @@
-import json
+import argparse
 from pathlib import Path
 from typing import Optional
 
-from bs4 import BeautifulSoup
 from pydantic import BaseModel
 from tqdm import tqdm
 
-from components.schema_flow import (
-    extract_data_with_schema,
-    generate_schema,
-    get_schema_class,
-)
+from components.evals import GENERATED, EvalDocument, run_eval
+from components.html import html_main_text, preprocess_html_files
+from components.logs import configure_logging
+from components.rules import XPATH, RuleReplay, html_domain, rules_path
+from components.schema_flow import backend_for, extract_data_with_schema
+from components.sink import ResultSink
 
 articles = list(Path("./data/article_html").glob("*.html"))
 articles = sorted(articles)
@@ -33,45 +33,56 @@ class Article(BaseModel):
     parsing_rules: ParsingRules
 
 
-def flow(pages, prebaked_schema):
-    generated_schema_str = generate_schema(pages)
-    print(generated_schema_str)
-    generated_schema, _ = get_schema_class(generated_schema_str)
-    extracted_data_gen = extract_data_with_schema(pages, generated_schema)
-    extracted_data = extract_data_with_schema(pages, prebaked_schema)
-    extracted_data_local = extract_data_with_schema(pages, prebaked_schema, local=True)
-
-    return (
-        extracted_data_gen,
-        extracted_data,
-        generated_schema_str,
-        extracted_data_local,
+def article_documents(paths):
+    # Parsed across processes, with the input-size reduction of every article
+    raw_tokens = tokens = 0
+    for article in preprocess_html_files(paths):
+        raw_tokens += article.raw_tokens
+        tokens += article.tokens
+        print(
+            f"{Path(article.path).stem}: {article.raw_tokens} -> {article.tokens} "
+            f"tokens, parsed in {article.parse_seconds * 1000:.0f}ms"
+        )
+        yield EvalDocument(id=Path(article.path).stem, text=article.text)
+    print(f"Total: {raw_tokens} -> {tokens} tokens")
+
+
+def extract_with_rules(paths, run_dir="data/eval_outputs/articles_rules"):
+    # Articles of a site with known parsing rules are extracted locally; the
+    # others are sent with their cleaned markup so the model's XPaths can be
+    # checked against the page and stored for the site
+    backend = backend_for()
+    replay = RuleReplay(Article, XPATH, rules_path(backend.name, backend.model))
+    with ResultSink(run_dir, Article) as sink:
+        for path in tqdm(paths):
+            with open(path, "r") as f:
+                html = f.read()
+            domain = html_domain(html)
+            data = replay.replay(domain, html)
+            if data is None:
+                markup = html_main_text(html, keep_markup=True).text
+                data = extract_data_with_schema([markup], Article, backend=backend.name)
+                replay.learn(domain, html, data)
+            sink.write(path.stem, data)
+    print(replay.stats)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rules",
+        action="store_true",
+        help="extract with learned per-site XPaths, calling the model on misses",
     )
+    args = parser.parse_args()
 
-
-for article_path in tqdm(articles):
-    with open(article_path, "r") as f:
-        html = f.read()
-
-    soup = BeautifulSoup(html, "html.parser")
-    body = soup.find("body")
-    if body is None:
-        body_text = html[:110_000]
+    if args.rules:
+        extract_with_rules(articles)
     else:
-        body_text = body.get_text()
-
-    article_data_gen, article_data, article_data_schema, article_data_local = flow(
-        [body_text], Article
-    )
-
-    with open(f"data/eval_outputs/{article_path.stem}.json", "w") as f:
-        json.dump(article_data, f, indent=2)
-
-    with open(f"data/eval_outputs/generated_{article_path.stem}.json", "w") as f:
-        json.dump(article_data_gen, f, indent=2)
-
-    with open(f"data/eval_outputs/generated_{article_path.stem}_schema.txt", "w") as f:
-        f.write(article_data_schema)
-
-    with open(f"data/eval_outputs/local_{article_path.stem}.json", "w") as f:
-        json.dump(article_data_local, f, indent=2)
+        run_eval(
+            article_documents(articles),
+            schemas=[GENERATED, Article],
+            backends=["openai", "local"],
+            run_dir="data/eval_outputs/articles",
+        )
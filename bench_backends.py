@@ -0,0 +1,129 @@
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+from components.backends import Backend, BackendConfig
+
+MODEL = "stand-in"
+COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": MODEL,
+    "choices": [
+        {
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": '{"subject": "Hello"}'},
+        }
+    ],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}
+MESSAGES = [{"role": "user", "content": "Subject: Hello"}]
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    A minimal OpenAI-compatible server answering every completion alike.
+
+    Like a local model server on one GPU, each instance generates one completion
+    at a time and takes `latency` seconds for it.
+    """
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    busy: threading.Lock
+
+    def _reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply({"object": "list", "data": [{"id": MODEL, "object": "model"}]})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        with self.busy:
+            time.sleep(self.latency)
+        self._reply(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stand_in(latency: float) -> str:
+    handler = type(
+        "Handler", (StandIn,), {"latency": latency, "busy": threading.Lock()}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def per_call_client(base_urls):
+    # What `extract_data_with_schema(local=True)` used to do for every request
+    def create(**kwargs):
+        client = OpenAI(base_url=base_urls[0], api_key="lm-studio", max_retries=0)
+        return client.chat.completions.create(**kwargs)
+
+    return create
+
+
+def run(create, requests: int, concurrency: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in pool.map(
+            lambda _: create(model=MODEL, messages=MESSAGES), range(requests)
+        ):
+            pass
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure extraction request throughput of the local backends."
+    )
+    parser.add_argument(
+        "--base-url",
+        action="append",
+        help="An endpoint to benchmark; starts stand-in servers if omitted",
+    )
+    parser.add_argument("--instances", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    base_urls = args.base_url or [
+        start_stand_in(args.latency) for _ in range(args.instances)
+    ]
+    backend = Backend(BackendConfig("bench", MODEL, base_urls, api_key="lm-studio"))
+    print("health:", backend.check_health())
+
+    candidates = [
+        ("per-call client", per_call_client(base_urls)),
+        (
+            "pooled, 1 endpoint",
+            Backend(
+                BackendConfig("one", MODEL, base_urls[:1], api_key="lm-studio")
+            ).create,
+        ),
+        (f"pooled, {len(base_urls)} endpoints", backend.create),
+    ]
+    for name, create in candidates:
+        throughput = run(create, args.requests, args.concurrency)
+        print(f"{name:>22}: {throughput:8.1f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
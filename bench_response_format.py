@@ -0,0 +1,54 @@
+import json
+import timeit
+
+from components.schema_registry import (
+    compile_schema,
+    response_format_for,
+    response_format_param,
+)
+
+N = 2_000
+
+with open("./schemas/survey.py", "r") as f:
+    survey = compile_schema(f.read()).schema_class
+
+response = json.dumps(
+    {
+        "survey_name": "Poll",
+        "survey_questions": [
+            {
+                "question_number": i,
+                "question_text": "Do you approve?",
+                "question_responses": [
+                    {
+                        "response_text": "Yes",
+                        "responses_count": 10,
+                        "responses_percentage": 0.5,
+                    },
+                    {
+                        "response_text": "No",
+                        "responses_count": 10,
+                        "responses_percentage": 0.5,
+                    },
+                ],
+            }
+            for i in range(20)
+        ],
+    }
+)
+
+
+def per_call_parse():
+    # What `llm.beta.chat.completions.parse` does around every request
+    response_format_param(survey)
+    survey.model_validate_json(response)
+
+
+def per_call_precompiled():
+    response_format = response_format_for(survey)
+    response_format.schema_class.model_validate(json.loads(response))
+
+
+for name, fn in [("parse", per_call_parse), ("precompiled", per_call_precompiled)]:
+    seconds = timeit.timeit(fn, number=N)
+    print(f"{name:>12}: {seconds / N * 1e6:8.1f} us/call")
@@ -1,20 +1,10 @@
-import json
 from enum import Enum
 from typing import List
 
 from pydantic import BaseModel
 
-from components.files import get_images
-from components.schema_flow import (
-    extract_data_with_schema,
-    generate_schema,
-    get_schema_class,
-)
-
-images = get_images("./data/campaign_finance.pdf")
-
-cover_sheet = images[0]
-individual_contributions = images[1:11]
+from components.evals import GENERATED, EvalDocument, run_eval
+from components.logs import configure_logging
 
 
 class ReportType(str, Enum):
@@ -88,57 +78,26 @@ class IndividualContributionTable(BaseModel):
     contributions: List[IndividualContribution]
 
 
-def flow(pages, prebaked_schema):
-    generated_schema_str = generate_schema(pages)
-    print(generated_schema_str)
-    generated_schema, _ = get_schema_class(generated_schema_str)
-    extracted_data_gen = extract_data_with_schema(pages, generated_schema)
-    extracted_data = extract_data_with_schema(pages, prebaked_schema)
-    extracted_data_local = extract_data_with_schema(pages, prebaked_schema, local=True)
-
-    return (
-        extracted_data_gen,
-        extracted_data,
-        generated_schema_str,
-        extracted_data_local,
+if __name__ == "__main__":
+    configure_logging()
+    campaign_finance = "./data/campaign_finance.pdf"
+    documents = [
+        EvalDocument(
+            id="cover_sheet",
+            path=campaign_finance,
+            pages=[0],
+            schemas=[GENERATED, CoverSheet],
+        ),
+        EvalDocument(
+            id="individual_contributions",
+            path=campaign_finance,
+            pages=list(range(1, 11)),
+            schemas=[GENERATED, IndividualContributionTable],
+        ),
+    ]
+    run_eval(
+        documents,
+        schemas=[GENERATED],
+        backends=["openai", "local"],
+        run_dir="data/eval_outputs/campaign_finance",
     )
-
-
-gen_data_cover_sheet, data_cover_sheet, schema_cover_sheet, local_data_cover_sheet = (
-    flow([cover_sheet], CoverSheet)
-)
-
-with open("data/eval_outputs/cover_sheet.json", "w") as f:
-    json.dump(data_cover_sheet, f, indent=2)
-
-with open("data/eval_outputs/generated_cover_sheet.json", "w") as f:
-    json.dump(gen_data_cover_sheet, f, indent=2)
-
-
-with open("data/eval_outputs/generated_cover_sheet_schema.txt", "w") as f:
-    f.write(schema_cover_sheet)
-
-with open("data/eval_outputs/local_cover_sheet.json", "w") as f:
-    json.dump(local_data_cover_sheet, f, indent=2)
-
-
-(
-    gen_data_individual_contributions,
-    data_individual_contributions,
-    schema_individual_contributions,
-    local_data_individual_contributions,
-) = flow(individual_contributions, IndividualContributionTable)
-
-
-with open("data/eval_outputs/individual_contributions.json", "w") as f:
-    json.dump(data_individual_contributions, f, indent=2)
-
-with open("data/eval_outputs/generated_individual_contributions.json", "w") as f:
-    json.dump(gen_data_individual_contributions, f, indent=2)
-
-
-with open("data/eval_outputs/generated_individual_contributions_schema.txt", "w") as f:
-    f.write(schema_individual_contributions)
-
-with open("data/eval_outputs/local_individual_contributions.json", "w") as f:
-    json.dump(local_data_individual_contributions, f, indent=2)
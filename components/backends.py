@@ -0,0 +1,310 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+# Optional JSON file of additional backends, keyed by name
+BACKENDS_PATH = Path(os.environ.get("LLM_BACKENDS_PATH", "backends.json"))
+# Comma-separated base URLs of the local server instances to balance across
+LOCAL_BASE_URLS = os.environ.get("LOCAL_BASE_URLS", "http://127.0.0.1:1234/v1")
+LOCAL_MODEL = os.environ.get("LOCAL_MODEL", "qwen2-v1-7b-instruct@4bit")
+
+# Pooled connections per endpoint
+MAX_CONNECTIONS = 16
+HEALTH_CHECK_TIMEOUT = 2.0
+# Seconds an endpoint is skipped after a failed request or health check
+UNHEALTHY_COOLDOWN = 30.0
+
+# Errors after which an endpoint is taken out of rotation
+ENDPOINT_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+
+
+@dataclass
+class BackendConfig:
+    name: str
+    model: str
+    # None stands for the client default (api.openai.com or OPENAI_BASE_URL)
+    base_urls: List[Optional[str]] = field(default_factory=lambda: [None])
+    api_key: Optional[str] = None
+    max_connections: int = MAX_CONNECTIONS
+    timeout: float = 600.0
+
+
+class _Endpoint:
+    """
+    One server instance of a backend, with its lazily created pooled clients.
+    """
+
+    def __init__(self, config: BackendConfig, base_url: Optional[str]):
+        self.config = config
+        self.base_url = base_url
+        self.in_flight = 0
+        self.unhealthy_until = 0.0
+        self._client: Optional[OpenAI] = None
+        self._aclient: Optional[AsyncOpenAI] = None
+        self._aclient_loop = None
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.config.max_connections,
+            max_keepalive_connections=self.config.max_connections,
+        )
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            self._client = OpenAI(
+                base_url=self.base_url,
+                api_key=self.config.api_key,
+                max_retries=0,
+                timeout=self.config.timeout,
+                http_client=httpx.Client(limits=self._limits()),
+            )
+        return self._client
+
+    @property
+    def aclient(self) -> AsyncOpenAI:
+        # Async connection pools cannot outlive their event loop, so each
+        # `asyncio.run` gets a fresh client that is kept for the loop's lifetime
+        # and closed by `aclose` before the loop ends
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient_loop = loop
+            self._aclient = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.config.api_key,
+                max_retries=0,
+                timeout=self.config.timeout,
+                http_client=httpx.AsyncClient(limits=self._limits()),
+            )
+        return self._aclient
+
+    async def aclose(self):
+        if self._aclient is not None and (
+            self._aclient_loop is asyncio.get_running_loop()
+        ):
+            await self._aclient.close()
+            self._aclient = None
+            self._aclient_loop = None
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        # An async client can only be closed from its event loop, see `aclose`
+        self._aclient = None
+        self._aclient_loop = None
+
+
+class Backend:
+    """
+    An OpenAI-compatible model served by one or more endpoints.
+
+    Requests go to the healthy endpoint with the fewest requests in flight, so
+    several instances of a local server share the load. An endpoint that fails
+    to connect or answers with a server error is skipped for
+    `UNHEALTHY_COOLDOWN` seconds, which lets the scheduler's retry land on
+    another instance; once the cooldown has passed it is tried again.
+
+    Pass `create` or `acreate` to the request scheduler in place of a client
+    method, together with `model=backend.model`.
+    """
+
+    def __init__(self, config: BackendConfig):
+        self.config = config
+        self.endpoints = [_Endpoint(config, url) for url in config.base_urls]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    @property
+    def model(self) -> str:
+        return self.config.model
+
+    def _acquire(self) -> _Endpoint:
+        with self._lock:
+            now = time.monotonic()
+            healthy = [e for e in self.endpoints if e.unhealthy_until <= now]
+            if not healthy:
+                # Everything is down; try the one that has been out the longest
+                endpoint = min(self.endpoints, key=lambda e: e.unhealthy_until)
+            else:
+                # Least in flight, rotating the start so ties are spread evenly
+                self._next = (self._next + 1) % len(self.endpoints)
+                order = self.endpoints[self._next :] + self.endpoints[: self._next]
+                endpoint = min(
+                    (e for e in order if e in healthy), key=lambda e: e.in_flight
+                )
+            endpoint.in_flight += 1
+            return endpoint
+
+    def _release(self, endpoint: _Endpoint, error: Optional[Exception] = None):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if isinstance(error, ENDPOINT_ERRORS):
+                endpoint.unhealthy_until = time.monotonic() + UNHEALTHY_COOLDOWN
+        if isinstance(error, ENDPOINT_ERRORS):
+            logger.warning(
+                "%s endpoint %s failed (%r), skipping it for %.0fs",
+                self.name,
+                endpoint.base_url or "default",
+                error,
+                UNHEALTHY_COOLDOWN,
+            )
+
+    def create(self, **kwargs):
+        """
+        Send a chat completion request to the least busy healthy endpoint.
+        """
+        endpoint = self._acquire()
+        try:
+            response = endpoint.client.chat.completions.create(**kwargs)
+        except Exception as e:
+            self._release(endpoint, e)
+            raise
+        self._release(endpoint)
+        return response
+
+    async def acreate(self, **kwargs):
+        """
+        Asynchronous counterpart of `create`.
+        """
+        endpoint = self._acquire()
+        try:
+            response = await endpoint.aclient.chat.completions.create(**kwargs)
+        except BaseException as e:
+            self._release(endpoint, e)
+            raise
+        self._release(endpoint)
+        return response
+
+    def check_health(self) -> Dict[str, bool]:
+        """
+        Probe every endpoint's model listing and update its health.
+
+        Returns:
+            Dict[str, bool]: Whether each endpoint answered, by base URL.
+        """
+        status = {}
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.with_options(timeout=HEALTH_CHECK_TIMEOUT).models.list()
+                healthy = True
+            except openai.APIError:
+                healthy = False
+            with self._lock:
+                endpoint.unhealthy_until = (
+                    0.0 if healthy else time.monotonic() + UNHEALTHY_COOLDOWN
+                )
+            status[endpoint.base_url or "default"] = healthy
+        return status
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            await endpoint.aclose()
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.close()
+
+
+class BackendRegistry:
+    """
+    Named backends with long-lived clients, shared by every extraction call.
+    """
+
+    def __init__(self, configs: Iterable[BackendConfig] = ()):
+        self._backends: Dict[str, Backend] = {}
+        for config in configs:
+            self.register(config)
+
+    def register(self, config: BackendConfig) -> Backend:
+        previous = self._backends.get(config.name)
+        if previous is not None:
+            previous.close()
+        backend = self._backends[config.name] = Backend(config)
+        return backend
+
+    def get(self, name: str) -> Backend:
+        try:
+            return self._backends[name]
+        except KeyError:
+            raise ValueError(
+                f"Unknown backend {name!r}, expected one of {self.names()}"
+            ) from None
+
+    def names(self) -> List[str]:
+        return list(self._backends)
+
+    def check_health(self) -> Dict[str, Dict[str, bool]]:
+        return {
+            name: backend.check_health() for name, backend in self._backends.items()
+        }
+
+    async def aclose(self):
+        """
+        Close the async clients opened in the running event loop.
+        """
+        for backend in self._backends.values():
+            await backend.aclose()
+
+    def run(self, coro):
+        """
+        Run a coroutine with `asyncio.run`, closing the async clients it opened
+        before its event loop ends so no connection pool is left behind.
+        """
+
+        async def main():
+            try:
+                return await coro
+            finally:
+                await self.aclose()
+
+        return asyncio.run(main())
+
+    def close(self):
+        for backend in self._backends.values():
+            backend.close()
+
+
+def local_backend_config() -> BackendConfig:
+    """
+    The local model server(s) from LOCAL_BASE_URLS and LOCAL_MODEL.
+    """
+    return BackendConfig(
+        name="local",
+        model=LOCAL_MODEL,
+        base_urls=[url.strip() for url in LOCAL_BASE_URLS.split(",") if url.strip()],
+        api_key="lm-studio",
+    )
+
+
+def load_backend_configs(path: "str | Path" = BACKENDS_PATH) -> List[BackendConfig]:
+    """
+    Read backend definitions from a JSON file, if it exists.
+
+    The file maps backend names to `BackendConfig` fields, e.g.
+    `{"qwen": {"model": "qwen2-vl-7b", "base_urls": ["http://gpu1:1234/v1"]}}`.
+    """
+    path = Path(path)
+    if not path.exists():
+        return []
+    with open(path, "r") as f:
+        definitions = json.load(f)
+    return [
+        BackendConfig(name=name, **options) for name, options in definitions.items()
+    ]
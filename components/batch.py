@@ -0,0 +1,285 @@
+import json
+import time
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, Iterator, List, Tuple
+
+from openai import ContentFilterFinishReasonError, LengthFinishReasonError, OpenAI
+from openai.types.chat import ChatCompletion
+
+from components.extraction import ExtractionResult
+from components.schema_flow import build_extraction_messages, llm
+from components.schema_registry import response_format_for
+
+# Provider limits are 50,000 requests and 200 MB per batch input file
+BATCH_MAX_REQUESTS = 50_000
+BATCH_MAX_BYTES = 190 * 1024**2
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Submissions of a request before it is reported as failed
+BATCH_MAX_ATTEMPTS = 3
+# Per-request status codes worth submitting again
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class BatchRun:
+    """
+    Bulk extraction through the provider's asynchronous batch endpoint.
+
+    Jobs are serialized into JSONL request shards under `run_dir`, uploaded and
+    submitted as batches. Progress is recorded in `run_dir/state.json` after
+    every step, so a restarted run skips jobs that were already submitted and
+    resumes polling the batches in flight.
+
+    Requests of a batch that failed or expired without an answer, or that were
+    rate limited or hit a server error, are written to a new shard and
+    submitted again, up to `BATCH_MAX_ATTEMPTS` times.
+    """
+
+    def __init__(
+        self,
+        run_dir: "str | Path",
+        schema,
+        model: str = "gpt-4o-mini",
+        client: OpenAI = llm,
+    ):
+        self.run_dir = Path(run_dir)
+        self.schema = schema
+        self.model = model
+        self.client = client
+        self.state_path = self.run_dir / "state.json"
+        if self.state_path.exists():
+            with open(self.state_path, "r") as f:
+                self.state = json.load(f)
+        else:
+            self.state = {"shards": []}
+
+    def _save(self):
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        tmp_path.replace(self.state_path)
+
+    def _submitted_ids(self) -> set:
+        job_ids = set()
+        for shard in self.state["shards"]:
+            with open(self.run_dir / shard["file"], "r") as f:
+                job_ids.update(json.loads(line)["custom_id"] for line in f)
+        return job_ids
+
+    def _request(self, job_id: str, pages, response_format) -> str:
+        return json.dumps(
+            {
+                "custom_id": job_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": build_extraction_messages(pages),
+                    "response_format": response_format,
+                },
+            }
+        )
+
+    def _write_shards(self, jobs: Iterable[Tuple[Hashable, list]]):
+        submitted = self._submitted_ids()
+        response_format = response_format_for(self.schema).param
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+
+        lines: List[str] = []
+        size = 0
+        for job_id, pages in jobs:
+            job_id = str(job_id)
+            if job_id in submitted:
+                continue
+            line = self._request(job_id, pages, response_format) + "\n"
+            if lines and (
+                len(lines) == BATCH_MAX_REQUESTS or size + len(line) > BATCH_MAX_BYTES
+            ):
+                self._add_shard(lines)
+                lines, size = [], 0
+            lines.append(line)
+            size += len(line)
+
+        if lines:
+            self._add_shard(lines)
+
+    def _add_shard(self, lines: List[str], attempt: int = 1):
+        file_name = f"requests_{len(self.state['shards']):04d}.jsonl"
+        with open(self.run_dir / file_name, "w") as f:
+            f.writelines(lines)
+        self.state["shards"].append(
+            {"file": file_name, "status": "pending", "attempt": attempt}
+        )
+        self._save()
+
+    def submit(self, jobs: Iterable[Tuple[Hashable, list]]):
+        """
+        Serialize and submit extraction jobs that have not been submitted yet.
+
+        Args:
+            jobs (Iterable[Tuple[Hashable, list]]): `(job_id, pages)` pairs. Job ids
+                are stringified and must be unique within the run.
+        """
+        self._write_shards(jobs)
+
+        for shard in self.state["shards"]:
+            if "input_file_id" not in shard:
+                with open(self.run_dir / shard["file"], "rb") as f:
+                    uploaded = self.client.files.create(file=f, purpose="batch")
+                shard["input_file_id"] = uploaded.id
+                self._save()
+
+            if "batch_id" not in shard:
+                batch = self.client.batches.create(
+                    input_file_id=shard["input_file_id"],
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h",
+                )
+                shard["batch_id"] = batch.id
+                shard["status"] = batch.status
+                self._save()
+
+    def poll(self) -> Dict[str, int]:
+        """
+        Refresh the status of every batch in flight.
+
+        Returns:
+            Dict[str, int]: The number of shards in each status.
+        """
+        counts: Dict[str, int] = {}
+        for shard in self.state["shards"]:
+            if "batch_id" in shard and shard["status"] not in TERMINAL_STATUSES:
+                batch = self.client.batches.retrieve(shard["batch_id"])
+                shard["status"] = batch.status
+                shard["output_file_id"] = batch.output_file_id
+                shard["error_file_id"] = batch.error_file_id
+                self._save()
+            counts[shard["status"]] = counts.get(shard["status"], 0) + 1
+        return counts
+
+    def wait(self, poll_interval: float = 60):
+        """
+        Block until every submitted batch has reached a terminal status and its
+        failed requests have been retried.
+        """
+        while True:
+            counts = self.poll()
+            if all(status in TERMINAL_STATUSES for status in counts):
+                if not self.requeue_failed():
+                    return counts
+                self.submit([])
+                continue
+            time.sleep(poll_interval)
+
+    def _answered_ids(self, shard: Dict) -> set:
+        # Requests of a shard that got an answer not worth retrying
+        answered = set()
+        for record in self._records(shard):
+            response = record.get("response") or {}
+            if not record.get("error") and (
+                response.get("status_code") not in RETRYABLE_STATUS_CODES
+            ):
+                answered.add(record["custom_id"])
+        return answered
+
+    def requeue_failed(self) -> int:
+        """
+        Write the unanswered requests of finished batches to new shards.
+
+        Returns:
+            int: The number of requests queued again; they are sent by the next
+                `submit`.
+        """
+        requeued = 0
+        for shard in list(self.state["shards"]):
+            if (
+                shard["status"] not in TERMINAL_STATUSES
+                or shard.get("requeued")
+                or shard.get("attempt", 1) >= BATCH_MAX_ATTEMPTS
+            ):
+                continue
+            answered = self._answered_ids(shard)
+            with open(self.run_dir / shard["file"], "r") as f:
+                lines = [
+                    line for line in f if json.loads(line)["custom_id"] not in answered
+                ]
+            if lines:
+                self._add_shard(lines, attempt=shard.get("attempt", 1) + 1)
+                requeued += len(lines)
+            shard["requeued"] = True
+            self._save()
+        return requeued
+
+    def _download(self, file_id: str, file_name: str) -> Path:
+        path = self.run_dir / file_name
+        if not path.exists():
+            content = self.client.files.content(file_id).text
+            with open(path.with_suffix(".tmp"), "w") as f:
+                f.write(content)
+            path.with_suffix(".tmp").replace(path)
+        return path
+
+    def _parse(self, record: Dict) -> ExtractionResult:
+        job_id = record["custom_id"]
+        if record.get("error"):
+            return ExtractionResult(job_id, error=RuntimeError(record["error"]))
+
+        response = record["response"]
+        if response["status_code"] != 200:
+            return ExtractionResult(job_id, error=RuntimeError(response["body"]))
+
+        # Checked like a synchronous response, so truncated, filtered and
+        # refused answers are reported as such rather than as parse errors
+        try:
+            completion = ChatCompletion.model_validate(response["body"])
+            data = response_format_for(self.schema).parse(completion)
+        except (
+            LengthFinishReasonError,
+            ContentFilterFinishReasonError,
+            ValueError,
+        ) as e:
+            return ExtractionResult(job_id, error=e)
+        return ExtractionResult(job_id, data)
+
+    def _records(self, shard: Dict) -> Iterator[Dict]:
+        stem = Path(shard["file"]).stem.replace("requests", "")
+        for key in ("output_file_id", "error_file_id"):
+            if not shard.get(key):
+                continue
+            kind = key.split("_")[0]
+            path = self._download(shard[key], f"{kind}{stem}.jsonl")
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def results(self) -> Iterator[ExtractionResult]:
+        """
+        Yield the validated result of every job in the finished batches.
+
+        Output files are downloaded once into `run_dir` and read from there on
+        later calls. Requests that were queued again are reported by their
+        latest attempt, and requests that never got an answer are reported as
+        failed with the status of their batch.
+        """
+        for shard in self.state["shards"]:
+            if shard["status"] not in TERMINAL_STATUSES:
+                continue
+            answered = self._answered_ids(shard)
+            reported = set()
+            for record in self._records(shard):
+                if shard.get("requeued") and record["custom_id"] not in answered:
+                    continue
+                reported.add(record["custom_id"])
+                yield self._parse(record)
+            if shard.get("requeued"):
+                continue
+            with open(self.run_dir / shard["file"], "r") as f:
+                for line in f:
+                    job_id = json.loads(line)["custom_id"]
+                    if job_id not in reported:
+                        yield ExtractionResult(
+                            job_id,
+                            error=RuntimeError(f"Batch {shard['status']}: no response"),
+                        )
@@ -2,7 +2,35 @@ import json
 
 import streamlit as st
 
-from components.schema_flow import extract_data_with_schema, get_schema_class
+from components.extraction import extract_data_chunked, page_windows
+from components.files import route_pages
+from components.fingerprints import fingerprint_index
+from components.schema_flow import get_schema_class
+from components.streaming import stream_extraction
+
+
+def stream_rows(pages, schema_class):
+    """
+    Extract a document in one streamed call, showing each list field's rows as
+    they arrive, and return the extracted data.
+    """
+    metrics = {}
+    tables, rows = {}, {}
+    stream = stream_extraction(pages, schema_class, metrics=metrics)
+    while True:
+        try:
+            streamed = next(stream)
+        except StopIteration as stop:
+            data = stop.value
+            break
+        if streamed.field not in tables:
+            st.write(f"**{streamed.field}**")
+            tables[streamed.field] = st.empty()
+            rows[streamed.field] = []
+        rows[streamed.field].append(streamed.item)
+        tables[streamed.field].dataframe(rows[streamed.field])
+    st.session_state.extraction_metrics = metrics
+    return data
 
 
 def extract_data(n_selected):
@@ -15,13 +43,31 @@ def extract_data(n_selected):
         if schema_code is not None:
             with st.spinner("Extracting data..."):
                 schema_class, _ = get_schema_class(schema_code)
-                # Extract data
-                selected_pages = [
-                    st.session_state.pages[i] for i in st.session_state.selected_pages
-                ]
-                data = extract_data_with_schema(selected_pages, schema_class)
+                # Pages with a usable text layer are sent as markdown, the
+                # rest as images
+                selected_pages, routing = route_pages(
+                    st.session_state.pages, st.session_state.selected_pages
+                )
+                if len(page_windows(selected_pages)) == 1:
+                    # Short selections stream their rows in as they are extracted
+                    data = stream_rows(selected_pages, schema_class)
+                else:
+                    # Long selections are extracted in windows and merged
+                    st.session_state.extraction_metrics = None
+                    data = extract_data_chunked(selected_pages, schema_class)
                 st.session_state.extracted_data = data
+                # Remember the schema that was finally used for this document
+                # type, fingerprinted from the routed pages schema generation
+                # sees, so text pages are never rasterized
+                fingerprint_index.add(selected_pages, schema_code)
                 st.success("Data extracted successfully.")
+                st.caption(str(routing))
+                metrics = st.session_state.extraction_metrics
+                if metrics and "time_to_first_row" in metrics:
+                    st.caption(
+                        f"First row after {metrics['time_to_first_row']:.1f}s, "
+                        f"all data after {metrics['total']:.1f}s"
+                    )
         else:
             st.error("Please generate or provide a schema first.")
 
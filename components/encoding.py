@@ -0,0 +1,130 @@
+import base64
+import threading
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+from typing import NamedTuple
+
+import PIL.Image
+
+# Default encoding of images sent to the model. The API downsizes anything
+# larger than 2048px on its longest side, so larger renditions only cost time.
+IMAGE_FORMAT = "JPEG"
+IMAGE_QUALITY = 85
+IMAGE_MAX_DIMENSION = 2048
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+_ENCODE_CACHE_SIZE = 64
+_encode_cache: "OrderedDict[tuple, EncodedImage]" = OrderedDict()
+_encode_lock = threading.Lock()
+# Stable identities of rendered pages, by object id; see `register_page`
+_page_keys: "dict[int, tuple]" = {}
+
+
+class EncodedImage(NamedTuple):
+    mime_type: str
+    data: str
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.data}"
+
+
+def register_page(image: "PIL.Image.Image", page_key: tuple):
+    """
+    Give a rendered page an identity that survives re-rendering, e.g. its PDF
+    hash, page number and DPI, so its encodings are shared across renditions.
+
+    The identity is kept for this image object only. Unlike `image.info`, which
+    PIL copies to the results of `copy`, `crop` or `convert`, it never makes an
+    image derived from the page look like the page itself.
+    """
+    with _encode_lock:
+        _page_keys[id(image)] = tuple(page_key)
+    weakref.finalize(image, _page_keys.pop, id(image), None)
+
+
+def _image_key(image: "PIL.Image.Image") -> tuple:
+    # Registered pages are keyed by their stable identity; other images by
+    # object identity while they live
+    with _encode_lock:
+        page_key = _page_keys.get(id(image))
+    if page_key is not None:
+        return ("page",) + page_key
+
+    key = ("id", id(image))
+    with _encode_lock:
+        if not any(cached[:2] == key for cached in _encode_cache):
+            weakref.finalize(image, _forget, key)
+    return key
+
+
+def _forget(key: tuple):
+    with _encode_lock:
+        for cached in [cached for cached in _encode_cache if cached[:2] == key]:
+            del _encode_cache[cached]
+
+
+def _encode(
+    image: "PIL.Image.Image", format: str, quality: int, max_dimension: "int | None"
+) -> str:
+    if max_dimension is not None and max(image.size) > max_dimension:
+        image = image.copy()
+        image.thumbnail((max_dimension, max_dimension), PIL.Image.LANCZOS)
+
+    if format in ("JPEG", "WEBP") and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffered = BytesIO()
+    if format == "PNG":
+        image.save(buffered, format=format, compress_level=1)
+    else:
+        image.save(buffered, format=format, quality=quality)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def encode_image(
+    image: "PIL.Image.Image",
+    format: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+    max_dimension: "int | None" = IMAGE_MAX_DIMENSION,
+) -> EncodedImage:
+    """
+    Encode a PIL Image object for an API request, memoizing the result.
+
+    Repeated calls for the same image and settings return the cached payload,
+    so a page is encoded once however many requests include it.
+
+    Args:
+        image (PIL.Image.Image): The image to encode.
+        format (str): One of "JPEG", "WEBP" or "PNG".
+        quality (int): The lossy compression quality, ignored for PNG.
+        max_dimension (int | None): Downscale the image so its longest side is at
+            most this many pixels, or None to keep the original size.
+
+    Returns:
+        EncodedImage: The MIME type and base64 encoded data of the image.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    format = format.upper()
+    if format not in MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {format}")
+
+    key = _image_key(image) + (format, quality, max_dimension)
+    with _encode_lock:
+        if key in _encode_cache:
+            _encode_cache.move_to_end(key)
+            return _encode_cache[key]
+
+    encoded = EncodedImage(
+        MIME_TYPES[format], _encode(image, format, quality, max_dimension)
+    )
+
+    with _encode_lock:
+        _encode_cache[key] = encoded
+        if len(_encode_cache) > _ENCODE_CACHE_SIZE:
+            _encode_cache.popitem(last=False)
+    return encoded
@@ -0,0 +1,406 @@
+import asyncio
+import importlib
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import duckdb
+
+from components import schema_flow
+from components.files import PdfPages, get_images, routing_report
+from components.html import html_main_text
+from components.racing import BackendStats, extract_first_valid, extract_timed
+from components.schema_flow import backend_for, generate_schema, get_schema_class
+from components.schema_registry import compile_schema
+
+# The schema generated for each document by `generate_schema`
+GENERATED = "generated"
+# The cells that race every backend and keep the first valid answer
+RACE = "race"
+
+# USD per million prompt and completion tokens; other models are free
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+}
+
+RESULT_COLUMNS = {
+    "doc_id": "VARCHAR",
+    "schema": "VARCHAR",
+    "backend": "VARCHAR",
+    "model": "VARCHAR",
+    "ok": "BOOLEAN",
+    "error": "VARCHAR",
+    "latency": "DOUBLE",
+    "prompt_tokens": "BIGINT",
+    "completion_tokens": "BIGINT",
+    "cost": "DOUBLE",
+    "data": "VARCHAR",
+    "schema_source": "VARCHAR",
+    "attempt": "INTEGER",
+    "winner": "VARCHAR",
+}
+
+SchemaSpec = Union[str, type]
+
+
+@dataclass
+class EvalDocument:
+    """
+    One document of an eval dataset, as listed in a manifest.
+
+    A document is either inline `text` or a file at `path`: PDFs are rendered to
+    page images (optionally only the `pages` at the given indices), HTML files
+    are reduced to their main text and anything else is read as text.
+    `schemas` overrides the schemas the document is evaluated with.
+    """
+
+    id: str
+    path: Optional[str] = None
+    text: Optional[str] = None
+    pages: Optional[List[int]] = None
+    schemas: Optional[List[SchemaSpec]] = None
+
+    def load(self) -> Sequence:
+        if self.text is not None:
+            return [self.text]
+
+        path = Path(self.path)
+        if path.suffix.lower() == ".pdf":
+            # Pages stay lazy; only those without a usable text layer are
+            # rendered, in parallel and into the page cache
+            start = time.perf_counter()
+            pages = get_images(path).extraction_inputs(self.pages)
+            pages.prefetch()
+            routing = routing_report(pages)
+            routing.seconds = time.perf_counter() - start
+            print(f"{self.id}: {routing}")
+            return pages
+
+        with open(path, "r") as f:
+            text = f.read()
+        if path.suffix.lower() in (".html", ".htm"):
+            text = html_main_text(text, path=str(path)).text
+        return [text]
+
+
+def read_manifest(path: "str | Path") -> List[EvalDocument]:
+    """
+    Read a JSONL manifest with one `EvalDocument` per line, e.g.
+    `{"id": "cover_sheet", "path": "data/report.pdf", "pages": [0]}`.
+    """
+    with open(path, "r") as f:
+        return [EvalDocument(**json.loads(line)) for line in f if line.strip()]
+
+
+def schema_name(spec: SchemaSpec) -> str:
+    return spec if isinstance(spec, str) else spec.__name__
+
+
+def resolve_schema(spec: SchemaSpec) -> type:
+    """
+    Resolve a schema given as a class, a `module:Class` reference or the path of
+    a schema definition file.
+    """
+    if not isinstance(spec, str):
+        return spec
+    if spec.endswith(".py"):
+        with open(spec, "r") as f:
+            return compile_schema(f.read()).schema_class
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def cost_of(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+class EvalRun:
+    """
+    The documents x schemas x backends matrix of an eval, checkpointed to a
+    directory.
+
+    Every finished cell is appended to `results.jsonl` and generated schemas to
+    `generated.jsonl`, so re-running with the same directory only runs the
+    cells that are missing or failed. `write_parquet` collects the latest
+    attempt of every cell into one `results.parquet` file.
+
+    Extractions go through `components.racing`, which records per-backend
+    latency histograms and validation failures in `stats`. With `race`, every
+    document and schema also gets a `RACE` cell that sends the extraction to
+    all backends and keeps the first valid answer; its tokens are not counted,
+    as the cancelled requests report no usage.
+    """
+
+    def __init__(
+        self,
+        run_dir: "str | Path",
+        schemas: Sequence[SchemaSpec],
+        backends: Sequence[str],
+        concurrency: int = 8,
+        race: bool = False,
+    ):
+        self.run_dir = Path(run_dir)
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self.schemas = list(schemas)
+        self.backends = list(backends)
+        self.concurrency = concurrency
+        self.race = race
+        self.stats = BackendStats()
+        self._done = set()
+        # Failed attempts per cell; failed cells are run again
+        self._attempts: Dict[Tuple[str, str, str], int] = {}
+        for record in self._read("results.jsonl"):
+            cell = (record["doc_id"], record["schema"], record["backend"])
+            self._attempts[cell] = self._attempts.get(cell, 0) + 1
+            if record["error"] is None:
+                self._done.add(cell)
+        self._generated = {
+            record["doc_id"]: record["schema_source"]
+            for record in self._read("generated.jsonl")
+        }
+        self._resolved: Dict[str, type] = {}
+        self._generating: Dict[str, asyncio.Task] = {}
+        self._con = duckdb.connect(database=":memory:")
+        # Fail on unknown backends before any request is sent
+        self.models = {
+            backend: backend_for(backend=backend).model for backend in backends
+        }
+
+    @property
+    def results_path(self) -> Path:
+        return self.run_dir / "results.jsonl"
+
+    @property
+    def parquet_path(self) -> Path:
+        return self.run_dir / "results.parquet"
+
+    def _read(self, name: str) -> List[Dict]:
+        path = self.run_dir / name
+        if not path.exists():
+            return []
+        with open(path, "r") as f:
+            # A crash can leave a truncated last line behind
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+            return records
+
+    def _append(self, name: str, record: Dict):
+        with open(self.run_dir / name, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _cells(self, document: EvalDocument) -> List[Tuple[SchemaSpec, str]]:
+        schemas = document.schemas if document.schemas is not None else self.schemas
+        backends = self.backends + [RACE] if self.race else self.backends
+        return [
+            (schema, backend)
+            for schema in schemas
+            for backend in backends
+            if (document.id, schema_name(schema), backend) not in self._done
+        ]
+
+    async def _generate(self, document: EvalDocument, pages):
+        timings, tokens = {}, {}
+        source = await asyncio.to_thread(
+            generate_schema, pages, timings=timings, tokens=tokens
+        )
+        self._generated[document.id] = source
+        self._append(
+            "generated.jsonl",
+            {
+                "doc_id": document.id,
+                "schema_source": source,
+                "timings": timings,
+                "prompt_tokens": tokens,
+            },
+        )
+
+    async def _schema_for(self, document: EvalDocument, spec: SchemaSpec, pages):
+        if spec != GENERATED:
+            name = schema_name(spec)
+            if name not in self._resolved:
+                self._resolved[name] = resolve_schema(spec)
+            return self._resolved[name], None
+
+        if document.id not in self._generated:
+            # Cells of the same document share one generation
+            if document.id not in self._generating:
+                self._generating[document.id] = asyncio.ensure_future(
+                    self._generate(document, pages)
+                )
+            await asyncio.shield(self._generating[document.id])
+        source = self._generated[document.id]
+        return get_schema_class(source)[0], source
+
+    async def _run_cell(
+        self, document: EvalDocument, pages, spec: SchemaSpec, backend: str
+    ) -> Dict:
+        cell = (document.id, schema_name(spec), backend)
+        record = {
+            "doc_id": document.id,
+            "schema": schema_name(spec),
+            "backend": backend,
+            "model": self.models.get(backend),
+            "ok": False,
+            "error": None,
+            "latency": None,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost": 0.0,
+            "data": None,
+            "schema_source": None,
+            "attempt": self._attempts.get(cell, 0) + 1,
+            "winner": None,
+        }
+        usage = {}
+        start = time.perf_counter()
+        try:
+            schema, record["schema_source"] = await self._schema_for(
+                document, spec, pages
+            )
+            start = time.perf_counter()
+            if backend == RACE:
+                result = await extract_first_valid(
+                    pages, schema, self.backends, self.stats
+                )
+                record["winner"] = result.backend
+                record["model"] = self.models[result.backend]
+            else:
+                result = await extract_timed(pages, schema, backend, usage)
+                self.stats.record(result)
+                if not result.ok:
+                    raise result.error
+            record["ok"] = True
+            record["data"] = json.dumps(result.data)
+        except Exception as e:
+            record["error"] = repr(e)
+        record["latency"] = time.perf_counter() - start
+        record.update(usage)
+        record["cost"] = cost_of(
+            record["model"], record["prompt_tokens"], record["completion_tokens"]
+        )
+
+        self._append("results.jsonl", record)
+        self._attempts[cell] = record["attempt"]
+        if record["error"] is None:
+            self._done.add(cell)
+        return record
+
+    async def _run_document(self, document: EvalDocument, limit: asyncio.Semaphore):
+        cells = self._cells(document)
+        if not cells:
+            return []
+        pages = await asyncio.to_thread(document.load)
+
+        async def run(spec, backend):
+            async with limit:
+                return await self._run_cell(document, pages, spec, backend)
+
+        try:
+            return await asyncio.gather(
+                *(run(spec, backend) for spec, backend in cells)
+            )
+        finally:
+            if isinstance(pages, PdfPages):
+                pages.close()
+
+    async def run(self, documents: Iterable[EvalDocument]) -> int:
+        """
+        Run every missing cell of the matrix, at most `concurrency` at a time.
+
+        Returns:
+            int: The number of cells run.
+        """
+        limit = asyncio.Semaphore(self.concurrency)
+        # Bound the documents loaded at once as well as the requests in flight
+        pending = set()
+        n_cells = 0
+        for document in documents:
+            pending.add(asyncio.ensure_future(self._run_document(document, limit)))
+            if len(pending) >= self.concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                n_cells += sum(len(task.result()) for task in done)
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            n_cells += sum(len(task.result()) for task in done)
+        return n_cells
+
+    def write_parquet(self) -> Path:
+        """
+        Write the latest attempt of every checkpointed cell to
+        `results.parquet`.
+        """
+        self._con.execute(
+            f"""
+            COPY (
+                SELECT * FROM read_json(?, format = 'newline_delimited',
+                    columns = {RESULT_COLUMNS!r}, ignore_errors = true)
+                QUALIFY row_number() OVER (
+                    PARTITION BY doc_id, schema, backend
+                    ORDER BY coalesce(attempt, 1) DESC
+                ) = 1
+            ) TO '{self.parquet_path}' (FORMAT parquet)
+            """,
+            [str(self.results_path)],
+        )
+        return self.parquet_path
+
+    def summary(self) -> duckdb.DuckDBPyRelation:
+        """
+        Per schema and backend: the number of cells and successes, latency
+        percentiles, tokens and cost, from `results.parquet`.
+        """
+        return self._con.sql(
+            f"""
+            SELECT
+                schema,
+                backend,
+                count(*) AS cells,
+                count(*) FILTER (WHERE ok) AS ok,
+                round(quantile_cont(latency, 0.5), 2) AS p50_s,
+                round(quantile_cont(latency, 0.9), 2) AS p90_s,
+                round(quantile_cont(latency, 0.99), 2) AS p99_s,
+                sum(prompt_tokens + completion_tokens) AS tokens,
+                round(sum(cost), 4) AS cost_usd
+            FROM read_parquet('{self.parquet_path}')
+            GROUP BY ALL
+            ORDER BY ALL
+            """
+        )
+
+
+def run_eval(
+    documents: Iterable[EvalDocument],
+    schemas: Sequence[SchemaSpec],
+    backends: Sequence[str],
+    run_dir: "str | Path",
+    concurrency: int = 8,
+    race: bool = False,
+) -> Path:
+    """
+    Run an eval matrix, resuming from `run_dir`, and print a summary and the
+    latency histogram and validation failures of each backend.
+
+    Returns:
+        Path: The Parquet file with every result of the run directory.
+    """
+    run = EvalRun(run_dir, schemas, backends, concurrency, race)
+    start = time.perf_counter()
+    n_cells = schema_flow.backends.run(run.run(documents))
+    elapsed = time.perf_counter() - start
+
+    path = run.write_parquet()
+    run.summary().show()
+    for backend, stats in run.stats.summary().items():
+        print(f"{backend}: {json.dumps(stats)}")
+    print(f"{n_cells} cells in {elapsed:.1f}s ({n_cells / elapsed:.2f} cells/s)")
+    return path
@@ -0,0 +1,242 @@
+import asyncio
+from dataclasses import dataclass
+from typing import (
+    AsyncIterator,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+from components.scheduler import estimate_page_tokens
+from components.schema_flow import (
+    backend_for,
+    backends,
+    build_extraction_messages,
+    scheduler,
+)
+from components.schema_registry import response_format_for
+
+# Estimated input tokens of one extraction window
+WINDOW_TOKENS = 8_000
+
+
+class ExtractionJob(NamedTuple):
+    pages: list
+    schema: type
+    job_id: Optional[Hashable] = None
+
+
+@dataclass
+class ExtractionResult:
+    job_id: Hashable
+    data: Optional[Dict] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def extract_data_with_schema_async(
+    pages, schema, local=False, backend=None, usage: Optional[Dict[str, int]] = None
+) -> Dict:
+    """
+    Asynchronous counterpart of `extract_data_with_schema`.
+
+    If `usage` is given, it is filled with the prompt and completion tokens
+    reported for the request.
+    """
+    response_format = response_format_for(schema)
+    messages = build_extraction_messages(pages)
+
+    target = backend_for(local, backend)
+    resp = await scheduler.acall(
+        target.acreate,
+        model=target.model,
+        messages=messages,
+        response_format=response_format.param,
+    )
+    if usage is not None and resp.usage is not None:
+        usage["prompt_tokens"] = resp.usage.prompt_tokens
+        usage["completion_tokens"] = resp.usage.completion_tokens
+    return response_format.parse(resp)
+
+
+async def _run_job(
+    index: int, job, local: bool, backend: Optional[str]
+) -> ExtractionResult:
+    job = ExtractionJob(*job)
+    job_id = index if job.job_id is None else job.job_id
+    try:
+        data = await extract_data_with_schema_async(
+            job.pages, job.schema, local=local, backend=backend
+        )
+    except Exception as e:
+        return ExtractionResult(job_id, error=e)
+    return ExtractionResult(job_id, data)
+
+
+async def extract_many(
+    jobs: Iterable,
+    concurrency: int = 8,
+    local: bool = False,
+    backend: Optional[str] = None,
+) -> AsyncIterator[ExtractionResult]:
+    """
+    Run many extraction jobs concurrently, yielding results as they complete.
+
+    Jobs are pulled from `jobs` lazily, so at most `concurrency` requests are in
+    flight and the iterable may be arbitrarily long. A failing job is reported
+    through `ExtractionResult.error` instead of aborting the run.
+
+    Args:
+        jobs (Iterable): `(pages, schema)` or `(pages, schema, job_id)` tuples.
+            Jobs without an id are identified by their position.
+        concurrency (int): The maximum number of requests in flight.
+        local (bool): Whether to send the jobs to the local model.
+        backend (Optional[str]): The name of a registered backend to use
+            instead, see `components.backends`.
+
+    Yields:
+        ExtractionResult: The result of each job, in completion order.
+    """
+    pending = set()
+    try:
+        for index, job in enumerate(jobs):
+            pending.add(asyncio.ensure_future(_run_job(index, job, local, backend)))
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def page_windows(
+    pages, token_budget: int = WINDOW_TOKENS, overlap: int = 0
+) -> List[range]:
+    """
+    Split pages into consecutive windows that fit an estimated token budget.
+
+    Every window holds at least one page, and consecutive windows share their
+    last and first `overlap` pages so that records straddling a page break are
+    seen whole at least once.
+
+    Args:
+        pages: The pages of the document, as text or images.
+        token_budget (int): The estimated input tokens allowed per window.
+        overlap (int): The number of pages repeated between consecutive windows.
+
+    Returns:
+        List[range]: The page indices of each window.
+    """
+    costs = [estimate_page_tokens(page) for page in pages]
+    windows = []
+    start = 0
+    while start < len(costs):
+        end = start + 1
+        tokens = costs[start]
+        while end < len(costs) and tokens + costs[end] <= token_budget:
+            tokens += costs[end]
+            end += 1
+        windows.append(range(start, end))
+        if end == len(costs):
+            break
+        start = max(start + 1, end - overlap)
+    return windows
+
+
+def _merge_values(merged, value, overlapping: bool = False):
+    if isinstance(merged, dict) and isinstance(value, dict):
+        return {
+            key: _merge_values(merged.get(key), value.get(key), overlapping)
+            for key in {**merged, **value}
+        }
+
+    if isinstance(merged, list) and isinstance(value, list):
+        if overlapping:
+            # Drop the longest run of leading items of the next window that
+            # repeats the tail of the previous one, read from the shared pages
+            for k in range(min(len(merged), len(value)), 0, -1):
+                if merged[-k:] == value[:k]:
+                    return merged + value[k:]
+        return merged + value
+
+    if merged is None or merged == "" or merged == []:
+        return value
+    return merged
+
+
+def merge_extractions(parts: List[Dict], windows: Optional[List[range]] = None) -> Dict:
+    """
+    Merge the extractions of consecutive page windows into one result.
+
+    Lists are concatenated and other fields keep the first non-empty value,
+    recursing into nested objects. Where `windows` show that two consecutive
+    windows share pages, the items read twice from those pages are dropped:
+    the longest tail of the first list that the second one starts with.
+    """
+    merged = parts[0]
+    for i, part in enumerate(parts[1:], start=1):
+        overlapping = windows is not None and windows[i].start < windows[i - 1].stop
+        merged = _merge_values(merged, part, overlapping)
+    return merged
+
+
+async def extract_data_chunked_async(
+    pages,
+    schema,
+    token_budget: int = WINDOW_TOKENS,
+    overlap: int = 0,
+    concurrency: int = 4,
+    local: bool = False,
+) -> Dict:
+    """
+    Extract data from a long document window by window and merge the results.
+
+    Windows are sized by `page_windows` and extracted concurrently.
+
+    Raises:
+        Exception: The error of the first window that failed.
+    """
+    windows = page_windows(pages, token_budget, overlap)
+    jobs = (([pages[i] for i in window], schema) for window in windows)
+
+    parts: List[Optional[Dict]] = [None] * len(windows)
+    async for result in extract_many(jobs, concurrency=concurrency, local=local):
+        if not result.ok:
+            raise result.error
+        parts[result.job_id] = result.data
+
+    return merge_extractions(parts, windows)
+
+
+def extract_data_chunked(
+    pages,
+    schema,
+    token_budget: int = WINDOW_TOKENS,
+    overlap: int = 0,
+    concurrency: int = 4,
+    local: bool = False,
+) -> Dict:
+    """
+    Synchronous wrapper of `extract_data_chunked_async`.
+    """
+    return backends.run(
+        extract_data_chunked_async(
+            pages, schema, token_budget, overlap, concurrency, local
+        )
+    )
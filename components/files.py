@@ -1,43 +1,511 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import fitz  # PyMuPDF
 import PIL.Image
 import streamlit as st
 
+from components.encoding import register_page
+from components.page_cache import PageCache, hash_pdf, page_cache
+from components.scheduler import IMAGE_TOKENS, estimate_page_tokens
 
-def get_images(pdf_path: str) -> List["PIL.Image.Image"]:
+# Resolution of the renditions sent to the model
+EXTRACTION_DPI = 300
+# Resolution of the renditions shown in the page selection grid
+THUMBNAIL_DPI = 48
+# Number of processes used to rasterize pages that are iterated over
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+# Held while a render pool runs, so that concurrent prefetches, e.g. of several
+# eval documents, don't each start RENDER_WORKERS processes
+_prefetch_lock = threading.Lock()
+
+# A page is sent to the model as text when its text layer has enough words...
+MIN_TEXT_WORDS = 20
+# ...spread over the page at enough characters per square inch...
+MIN_CHAR_DENSITY = 1.0
+# ...made of real characters rather than glyphs without a Unicode mapping...
+MIN_PRINTABLE_RATIO = 0.95
+# ...and no image covers most of the page, as on a scan with an OCR layer
+MAX_IMAGE_COVERAGE = 0.5
+
+
+@dataclass
+class TextLayer:
+    """
+    The quality of a page's text layer, and the page as markdown if it is good.
     """
-    Convert a PDF file to a list of PIL Image objects using PyMuPDF.
 
-    Args:
-        pdf_path (str): The file path to the PDF.
+    words: int
+    # Non-whitespace characters per square inch
+    char_density: float
+    printable_ratio: float
+    # Share of the page area covered by images
+    image_coverage: float
+    tables: int = 0
+    markdown: Optional[str] = None
+
+    @property
+    def usable(self) -> bool:
+        return (
+            self.words >= MIN_TEXT_WORDS
+            and self.char_density >= MIN_CHAR_DENSITY
+            and self.printable_ratio >= MIN_PRINTABLE_RATIO
+            and self.image_coverage <= MAX_IMAGE_COVERAGE
+        )
+
+
+def _image_coverage(page: "fitz.Page") -> float:
+    area = page.rect.get_area()
+    covered = sum(
+        (fitz.Rect(info["bbox"]) & page.rect).get_area()
+        for info in page.get_image_info()
+    )
+    return min(covered / area, 1.0) if area else 0.0
+
+
+def page_markdown(page: "fitz.Page") -> Tuple[str, int]:
+    """
+    Render the text layer of a page as markdown.
+
+    Text blocks are kept in reading order and tables found by PyMuPDF replace
+    the blocks they overlap with markdown tables, so rows and columns survive.
+    Table detection looks for ruling lines, so pages without vector drawings
+    skip it.
 
     Returns:
-        List[PIL.Image.Image]: A list of PIL Image objects, each representing a page of the PDF.
+        Tuple[str, int]: The markdown and the number of tables found.
+    """
+    tables = page.find_tables().tables if page.get_drawings() else []
+    boxes = [fitz.Rect(table.bbox) for table in tables]
+    items = [(table.bbox[1], table.bbox[0], table.to_markdown()) for table in tables]
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks", sort=True):
+        # Image blocks carry no text
+        if block_type != 0:
+            continue
+        if any(fitz.Rect(x0, y0, x1, y1).intersects(box) for box in boxes):
+            continue
+        items.append((y0, x0, text))
+    items.sort(key=lambda item: item[:2])
+    return "\n\n".join(text.strip() for _, _, text in items if text.strip()), len(
+        tables
+    )
+
+
+def assess_text_layer(page: "fitz.Page") -> TextLayer:
+    """
+    Check whether the text layer of a page can stand in for its image.
+
+    Born-digital pages have a dense text layer of printable characters and are
+    converted to markdown. Scanned pages have no text layer, one made of
+    unmapped glyphs, or an OCR layer under a page-sized image, and are left to
+    be rasterized.
+    """
+    text = page.get_text()
+    characters = [ch for ch in text if not ch.isspace()]
+    square_inches = page.rect.get_area() / 72**2
+    printable = sum(ch.isprintable() and ch != "\ufffd" for ch in characters)
+    layer = TextLayer(
+        words=len(text.split()),
+        char_density=len(characters) / square_inches if square_inches else 0.0,
+        printable_ratio=printable / len(characters) if characters else 0.0,
+        image_coverage=_image_coverage(page),
+    )
+    if layer.usable:
+        layer.markdown, layer.tables = page_markdown(page)
+    return layer
+
+
+class PdfPages(Sequence):
+    """
+    A lazily rendered, read-only sequence of PDF pages.
+
+    Pages are rasterized on first access and kept in a bounded LRU so that only
+    the pages actually looked at are ever rendered. Slicing returns another
+    lazy view over the same open document and page caches.
+
+    Each page has two renditions: indexing returns the full `dpi` image meant
+    for the model, while `thumbnail` returns a small JPEG for display. Both are
+    read through `page_cache`, when given, before anything is rendered.
+
+    Iterating over the sequence first renders any uncached pages across
+    `workers` processes, straight into the page cache.
+
+    `extraction_inputs` returns a view whose items are the pages as they are
+    sent to the model: markdown for pages with a usable text layer, images for
+    the rest, which are the only ones it renders.
     """
+
+    def __init__(
+        self,
+        document: "fitz.Document",
+        pdf_bytes: bytes,
+        pdf_hash: str,
+        page_cache: Optional[PageCache] = None,
+        workers: int = 1,
+        dpi: int = EXTRACTION_DPI,
+        cache_size: int = 8,
+        thumbnail_dpi: int = THUMBNAIL_DPI,
+        thumbnail_cache_size: int = 1024,
+    ):
+        self._document = document
+        self._pdf_bytes = pdf_bytes
+        self._pdf_hash = pdf_hash
+        self._page_cache = page_cache
+        self._workers = workers
+        self._dpi = dpi
+        self._thumbnail_dpi = thumbnail_dpi
+        self._indices: Sequence[int] = range(document.page_count)
+        self._cache: "OrderedDict[int, PIL.Image.Image]" = OrderedDict()
+        self._cache_size = cache_size
+        self._thumbnails: "OrderedDict[int, bytes]" = OrderedDict()
+        self._thumbnail_cache_size = thumbnail_cache_size
+        self._text_layers: Dict[int, TextLayer] = {}
+        self._routed = False
+        # Shared by views; the document and LRUs are used from several threads
+        self._lock = threading.RLock()
+
+    def _view(self, indices: Sequence[int]) -> "PdfPages":
+        view = object.__new__(PdfPages)
+        view.__dict__.update(self.__dict__)
+        view._indices = indices
+        return view
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self._view(self._indices[idx])
+        page_num = self._indices[idx]
+        with self._lock:
+            if self._routed and self._text_layer(page_num).usable:
+                return self._text_layer(page_num).markdown
+            return _lru_get(self._cache, page_num, self._load, self._cache_size)
+
+    def __iter__(self):
+        self.prefetch()
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def prefetch(self, workers: Optional[int] = None):
+        """
+        Render every uncached page of this sequence into the page cache in parallel.
+
+        Page ranges are split across a process pool where each worker opens its
+        own copy of the document, so rendered images never cross process
+        boundaries. This is a no-op without a page cache or a fork-capable platform.
+        Only one sequence is prefetched at a time per process; other callers
+        wait, and then find the pages they share already cached.
+
+        Args:
+            workers (Optional[int]): The number of processes, defaulting to the
+                `workers` the sequence was opened with.
+        """
+        workers = self._workers if workers is None else workers
+        if (
+            self._page_cache is None
+            or "fork" not in multiprocessing.get_all_start_methods()
+        ):
+            return
+
+        with _prefetch_lock:
+            self._prefetch(workers)
+
+    def _prefetch(self, workers: int):
+        missing = [
+            page_num
+            for page_num in self._indices
+            if page_num not in self._cache
+            and not (self._routed and self._text_layer(page_num).usable)
+            and not self._page_cache.contains(self._pdf_hash, page_num, self._dpi)
+        ]
+        workers = min(workers, len(missing))
+        if workers < 2:
+            return
+
+        chunk_size = -(-len(missing) // workers)
+        chunks = [
+            missing[i : i + chunk_size] for i in range(0, len(missing), chunk_size)
+        ]
+        # Fork rather than spawn: the batch scripts run at import time
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _render_to_cache,
+                    self._pdf_bytes,
+                    self._pdf_hash,
+                    chunk,
+                    self._dpi,
+                    self._page_cache.directory,
+                    self._page_cache.max_bytes,
+                )
+                for chunk in chunks
+            ]
+            for future in futures:
+                future.result()
+
+    def thumbnail(self, idx: int) -> bytes:
+        """
+        Return a low-resolution JPEG rendition of a page for display.
+
+        Args:
+            idx (int): The page index within this sequence.
+
+        Returns:
+            bytes: The JPEG-encoded thumbnail.
+        """
+        with self._lock:
+            return _lru_get(
+                self._thumbnails,
+                self._indices[idx],
+                self._render_thumbnail,
+                self._thumbnail_cache_size,
+            )
+
+    def text_layer(self, idx: int) -> TextLayer:
+        """
+        Return the text-layer assessment of a page, computed once per page.
+        """
+        return self._text_layer(self._indices[idx])
+
+    def _text_layer(self, page_num: int) -> TextLayer:
+        with self._lock:
+            if page_num not in self._text_layers:
+                self._text_layers[page_num] = assess_text_layer(
+                    self._document[page_num]
+                )
+            return self._text_layers[page_num]
+
+    def extraction_input(self, idx: int) -> "str | PIL.Image.Image":
+        """
+        Return a page the way it is sent to the model: its markdown if the text
+        layer is usable, otherwise its image.
+        """
+        layer = self.text_layer(idx)
+        return layer.markdown if layer.usable else self[idx]
+
+    def extraction_inputs(self, indices: Optional[Sequence[int]] = None) -> "PdfPages":
+        """
+        Return a lazy view of pages as they are sent to the model.
+
+        Args:
+            indices (Optional[Sequence[int]]): The pages of the view, all by
+                default.
+        """
+        if indices is None:
+            indices = range(len(self))
+        view = self._view([self._indices[idx] for idx in indices])
+        view._routed = True
+        return view
+
+    def _load(self, page_num: int) -> "PIL.Image.Image":
+        img = self._render(page_num, self._dpi)
+        # The text layer lets schema selection match the page without the model
+        img.info["text"] = self._document[page_num].get_text()
+        return img
+
+    def _render(self, page_num: int, dpi: int) -> "PIL.Image.Image":
+        if self._page_cache is not None:
+            img = self._page_cache.get(self._pdf_hash, page_num, dpi)
+            if img is not None:
+                register_page(img, (self._pdf_hash, page_num, dpi))
+                return img
+
+        try:
+            page = self._document[page_num]
+            pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+        except Exception as e:
+            raise Exception(f"Error processing PDF: {str(e)}")
+
+        if self._page_cache is not None:
+            self._page_cache.put(
+                self._pdf_hash, page_num, dpi, pix.width, pix.height, pix.samples
+            )
+        # Convert to PIL Image
+        img = PIL.Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        # Stable identity for memoizing encodings across re-renders
+        register_page(img, (self._pdf_hash, page_num, dpi))
+        return img
+
+    def _render_thumbnail(self, page_num: int) -> bytes:
+        buffered = BytesIO()
+        self._render(page_num, self._thumbnail_dpi).save(
+            buffered, format="JPEG", quality=75
+        )
+        return buffered.getvalue()
+
+    def close(self):
+        with self._lock:
+            self._cache.clear()
+            self._thumbnails.clear()
+            self._text_layers.clear()
+            self._document.close()
+
+    def __enter__(self) -> "PdfPages":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _render_to_cache(
+    pdf_bytes: bytes,
+    pdf_hash: str,
+    page_nums: List[int],
+    dpi: int,
+    cache_dir: Path,
+    cache_max_bytes: int,
+):
+    document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    cache = PageCache(cache_dir, cache_max_bytes)
     try:
-        pdf_document = fitz.open(pdf_path)
-        images = []
+        for page_num in page_nums:
+            pix = document[page_num].get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+            cache.put(pdf_hash, page_num, dpi, pix.width, pix.height, pix.samples)
+    finally:
+        document.close()
+
+
+def _lru_get(cache: OrderedDict, key, load, max_size: int):
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
 
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            pix = page.get_pixmap(matrix=fitz.Matrix(300 / 72, 300 / 72))  # 300 DPI
+    value = load(key)
+    cache[key] = value
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+    return value
 
-            # Convert to PIL Image
-            img = PIL.Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            images.append(img)
 
-        pdf_document.close()
-        return images
+def get_images(
+    pdf: "str | Path | bytes",
+    dpi: int = EXTRACTION_DPI,
+    cache_size: int = 8,
+    page_cache: Optional[PageCache] = page_cache,
+    workers: int = RENDER_WORKERS,
+) -> PdfPages:
+    """
+    Open a PDF file as a lazy sequence of PIL Image objects using PyMuPDF.
+
+    Pages are only rendered when they are accessed, so opening a long document
+    is cheap and memory use is bounded by `cache_size` rendered pages.
 
+    Args:
+        pdf (str | Path | bytes): The file path to the PDF, or its raw bytes.
+        dpi (int): The resolution pages are rendered at for extraction.
+        cache_size (int): The number of rendered pages to keep in memory.
+        page_cache (Optional[PageCache]): The persistent cache rendered pages are
+            read from and written to, or None to always render.
+        workers (int): The number of processes used to render pages when the
+            sequence is iterated over.
+
+    Returns:
+        PdfPages: A sequence of PIL Image objects, each representing a page of the PDF.
+    """
+    try:
+        if not isinstance(pdf, bytes):
+            with open(pdf, "rb") as f:
+                pdf = f.read()
+        pdf_document = fitz.open(stream=pdf, filetype="pdf")
     except Exception as e:
         raise Exception(f"Error processing PDF: {str(e)}")
 
+    return PdfPages(
+        pdf_document,
+        pdf,
+        hash_pdf(pdf),
+        page_cache=page_cache,
+        workers=workers,
+        dpi=dpi,
+        cache_size=cache_size,
+    )
+
 
-@st.cache_data
-def get_images_cached(pdf_path):
-    return get_images(pdf_path)
+@dataclass
+class PageRouting:
+    text_pages: int = 0
+    image_pages: int = 0
+    text_tokens: int = 0
+    seconds: float = 0.0
+
+    @property
+    def image_tokens_saved(self) -> int:
+        return self.text_pages * IMAGE_TOKENS
+
+    def __str__(self) -> str:
+        return (
+            f"{self.text_pages} pages sent as text (~{self.text_tokens} tokens) "
+            f"in place of ~{self.image_tokens_saved} image tokens, "
+            f"{self.image_pages} as images, prepared in {self.seconds:.2f}s"
+        )
+
+
+def route_pages(
+    pages: PdfPages, indices: Optional[Sequence] = None
+) -> Tuple[list, PageRouting]:
+    """
+    Prepare pages for extraction, rasterizing only those without a usable text
+    layer.
+
+    Args:
+        pages (PdfPages): The document.
+        indices (Optional[Sequence]): The pages to prepare, all by default.
+
+    Returns:
+        Tuple[list, PageRouting]: The markdown strings and images to send, in
+            page order, and what the routing saved.
+    """
+    start = time.perf_counter()
+    indices = range(len(pages)) if indices is None else indices
+    routing = PageRouting()
+    inputs = []
+    for idx in indices:
+        page = pages.extraction_input(idx)
+        if isinstance(page, str):
+            routing.text_pages += 1
+            routing.text_tokens += estimate_page_tokens(page)
+        else:
+            routing.image_pages += 1
+        inputs.append(page)
+    routing.seconds = time.perf_counter() - start
+    return inputs, routing
+
+
+def routing_report(pages: PdfPages, indices: Optional[Sequence] = None) -> PageRouting:
+    """
+    Report how pages are routed from their text layers alone, rendering none.
+
+    Args:
+        pages (PdfPages): The document.
+        indices (Optional[Sequence]): The pages to report on, all by default.
+
+    Returns:
+        PageRouting: The number of pages sent as text and as images.
+    """
+    start = time.perf_counter()
+    indices = range(len(pages)) if indices is None else indices
+    routing = PageRouting()
+    for idx in indices:
+        layer = pages.text_layer(idx)
+        if layer.usable:
+            routing.text_pages += 1
+            routing.text_tokens += estimate_page_tokens(layer.markdown)
+        else:
+            routing.image_pages += 1
+    routing.seconds = time.perf_counter() - start
+    return routing
 
 
 def toggle_page(idx):
@@ -52,21 +520,10 @@ def file_uploader():
 
     if uploaded_file is not None and st.session_state.uploaded_file != uploaded_file:
         st.session_state.uploaded_file = uploaded_file
-        # Save the uploaded file to a temporary location
-        tmp_path = Path("tmp") / uploaded_file.name
-        tmp_path.parent.mkdir(exist_ok=True)
-        with open(tmp_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        pages = get_images_cached(tmp_path)
-        # unlink the temporary file
-        tmp_path.unlink()
-
-        # Limit pages to first 10
-        if len(pages) > 10:
-            st.warning(
-                f"Document has {len(pages)} pages. Only the first 10 pages will be processed."
-            )
-            pages = pages[:10]
+        # Open the document from memory; pages are rendered as they are viewed
+        if st.session_state.pages is not None:
+            st.session_state.pages.close()
+        pages = get_images(uploaded_file.getvalue(), workers=1)
 
         st.session_state.pages = pages
         st.session_state.extracted_data = None  # Reset extracted data
@@ -88,9 +545,14 @@ def page_selector():
     with col1:
         # Create a grid layout for page selection
         cols = st.columns(4)
-        for idx, page in enumerate(st.session_state.pages):
+        pages = st.session_state.pages
+        for idx in range(len(pages)):
             with cols[idx % 4]:
-                st.image(page, caption=f"Page {idx + 1}", use_container_width=True)
+                st.image(
+                    pages.thumbnail(idx),
+                    caption=f"Page {idx + 1}",
+                    use_container_width=True,
+                )
                 if st.checkbox(
                     f"Include page {idx + 1}",
                     value=idx in st.session_state.selected_pages,
@@ -0,0 +1,159 @@
+import json
+import math
+import os
+import threading
+import zlib
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import PIL.Image
+
+from components.schema_catalog import document_text, tokenize
+
+FINGERPRINT_INDEX_PATH = Path(
+    os.environ.get("FINGERPRINT_INDEX_PATH", ".cache/fingerprints.jsonl")
+)
+# Cosine similarity above which a document reuses the schema of its neighbour
+MATCH_THRESHOLD = 0.92
+# Entries this similar with the same schema are not stored again
+DUPLICATE_THRESHOLD = 0.99
+
+TEXT_DIMENSIONS = 512
+IMAGE_SIDE = 16
+TEXT_WEIGHT = 0.7
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+
+def _text_features(text: str) -> List[float]:
+    # Signed feature hashing of the words of the text layer
+    vector = [0.0] * TEXT_DIMENSIONS
+    for word in tokenize(text):
+        digest = zlib.crc32(word.encode("utf-8"))
+        sign = 1.0 if digest & 1 else -1.0
+        vector[(digest >> 1) % TEXT_DIMENSIONS] += sign
+    return _normalize(vector)
+
+
+def _image_features(image: "PIL.Image.Image") -> List[float]:
+    # A mean-centred 16x16 grayscale thumbnail captures the page layout
+    pixels = list(
+        image.convert("L")
+        .resize((IMAGE_SIDE, IMAGE_SIDE), PIL.Image.BILINEAR)
+        .getdata()
+    )
+    mean = sum(pixels) / len(pixels)
+    return _normalize([pixel - mean for pixel in pixels])
+
+
+def local_embedding(pages) -> List[float]:
+    """
+    Embed a document offline from its text layer and first page image.
+
+    Returns:
+        List[float]: A unit vector of hashed word features followed by the
+            layout features of the first image page; either part is zero when
+            the document has no text or no images.
+    """
+    text = _text_features(document_text(pages))
+    image = next((page for page in pages if isinstance(page, PIL.Image.Image)), None)
+    layout = _image_features(image) if image is not None else [0.0] * IMAGE_SIDE**2
+
+    text_weight = TEXT_WEIGHT if any(layout) else 1.0
+    image_weight = 1 - TEXT_WEIGHT if any(text) else 1.0
+    return _normalize(
+        [x * text_weight for x in text] + [x * image_weight for x in layout]
+    )
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+class FingerprintIndex:
+    """
+    A persistent nearest-neighbour index from document fingerprints to schemas.
+
+    Entries are appended to a JSONL file as they are added and loaded lazily on
+    first use. `embed` can be swapped for any function mapping pages to a unit
+    vector; the default runs locally without any model.
+    """
+
+    def __init__(
+        self,
+        path: "str | Path" = FINGERPRINT_INDEX_PATH,
+        embed: Callable[[list], List[float]] = local_embedding,
+        threshold: float = MATCH_THRESHOLD,
+    ):
+        self.path = Path(path)
+        self.embed = embed
+        self.threshold = threshold
+        self._entries: Optional[List[Tuple[List[float], str]]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> List[Tuple[List[float], str]]:
+        if self._entries is None:
+            self._entries = []
+            if self.path.exists():
+                with open(self.path, "r") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        self._entries.append((record["vector"], record["schema"]))
+        return self._entries
+
+    def _nearest(self, vector: List[float]) -> Tuple[float, Optional[str]]:
+        best, schema = -1.0, None
+        for entry_vector, entry_schema in self._load():
+            similarity = _cosine(vector, entry_vector)
+            if similarity > best:
+                best, schema = similarity, entry_schema
+        return best, schema
+
+    def lookup(self, pages) -> Optional[Tuple[str, float]]:
+        """
+        Find the schema of the most similar known document.
+
+        Returns:
+            Optional[Tuple[str, float]]: The schema source and its similarity, or
+                None if no document is above the threshold.
+        """
+        vector = self.embed(pages)
+        with self._lock:
+            similarity, schema = self._nearest(vector)
+        if schema is None or similarity < self.threshold:
+            return None
+        return schema, similarity
+
+    def neighbours(self, pages, k: int) -> List[Tuple[str, float]]:
+        """
+        Find the schemas of the `k` most similar known documents, whatever
+        their similarity, most similar first.
+        """
+        vector = self.embed(pages)
+        best = {}
+        with self._lock:
+            for entry_vector, entry_schema in self._load():
+                similarity = _cosine(vector, entry_vector)
+                best[entry_schema] = max(similarity, best.get(entry_schema, -1.0))
+        return sorted(best.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def add(self, pages, schema_str: str):
+        """
+        Record the schema used for a document, skipping near-duplicate entries.
+        """
+        vector = [round(x, 5) for x in self.embed(pages)]
+        with self._lock:
+            similarity, schema = self._nearest(vector)
+            if schema == schema_str and similarity >= DUPLICATE_THRESHOLD:
+                return
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"vector": vector, "schema": schema_str}) + "\n")
+            self._entries.append((vector, schema_str))
+
+
+fingerprint_index = FingerprintIndex()
@@ -0,0 +1,68 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from components.scheduler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+OMITTED_IMAGES_NOTE = (
+    "[{count} page image(s) omitted here; the document was described in full "
+    "earlier in this conversation]"
+)
+
+
+def compact_history(messages: List[Dict]) -> List[Dict]:
+    """
+    Replace the page images of a conversation with a short text reference.
+
+    Meant for follow-up calls once the model has described the pages in text,
+    so the images are not uploaded again with every turn. Messages are copied,
+    the input list is left untouched.
+
+    Args:
+        messages (List[Dict]): The conversation so far.
+
+    Returns:
+        List[Dict]: The conversation with every image part swapped for a note.
+    """
+    compacted = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            compacted.append(message)
+            continue
+
+        parts = [part for part in content if part["type"] != "image_url"]
+        n_images = len(content) - len(parts)
+        if n_images:
+            parts.append(
+                {"type": "text", "text": OMITTED_IMAGES_NOTE.format(count=n_images)}
+            )
+        compacted.append(dict(message, content=parts))
+    return compacted
+
+
+def log_compaction(
+    stage: str,
+    original: List[Dict],
+    compacted: List[Dict],
+    tokens: Optional[Dict[str, Tuple[int, int]]] = None,
+):
+    """
+    Log the estimated prompt tokens of a call before and after compaction.
+
+    Args:
+        tokens (Optional[Dict[str, Tuple[int, int]]]): If given, filled with the
+            tokens of `stage` before and after compaction, for display.
+    """
+    before = estimate_tokens(original, max_tokens=0)
+    after = estimate_tokens(compacted, max_tokens=0)
+    if tokens is not None:
+        tokens[stage] = (before, after)
+    logger.info(
+        "%s: %d prompt tokens after compaction (%d before, %d saved)",
+        stage,
+        after,
+        before,
+        before - after,
+    )
@@ -0,0 +1,209 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import lxml.etree
+import lxml.html
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Input tokens an article is cut to before it is sent to the model
+HTML_MAX_TOKENS = 8_000
+# Processes used to parse HTML files
+HTML_WORKERS = int(os.environ.get("HTML_WORKERS", os.cpu_count() or 1))
+
+# Elements that never hold article content
+BOILERPLATE_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "iframe",
+    "svg",
+    "form",
+    "nav",
+    "footer",
+    "aside",
+]
+BOILERPLATE_ROLES = ["navigation", "contentinfo", "complementary", "banner"]
+# Attributes kept when markup is preserved, enough to anchor XPaths
+MARKUP_ATTRIBUTES = {"id", "class", "itemprop", "property", "rel", "datetime"}
+# Elements whose text is kept on lines of its own
+BLOCK_TAGS = {
+    "p",
+    "div",
+    "br",
+    "li",
+    "tr",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "header",
+    "section",
+    "article",
+    "main",
+    "blockquote",
+    "pre",
+    "figcaption",
+    "time",
+    "dt",
+    "dd",
+}
+
+_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+# lxml refuses str input that declares an encoding
+_XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>", re.IGNORECASE)
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of `text` with the gpt-4o tokenizer if tiktoken is
+    installed, or estimate them at four characters per token.
+    """
+    if tiktoken is None:
+        return len(text) // 4
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if tiktoken is None:
+        return text[: max_tokens * 4]
+    encoding = _get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def _normalize_whitespace(text: str) -> str:
+    text = _WHITESPACE.sub(" ", text)
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def parse_html(html: str) -> Optional[lxml.html.HtmlElement]:
+    """
+    Parse an HTML document with lxml.
+
+    Returns:
+        Optional[lxml.html.HtmlElement]: The root element, or None if the
+            document is empty.
+    """
+    html = _XML_DECLARATION.sub("", html, count=1)
+    if not html.strip():
+        return None
+    try:
+        return lxml.html.document_fromstring(html)
+    except lxml.etree.ParserError:
+        # Documents with nothing but comments or whitespace
+        return None
+
+
+@dataclass
+class HtmlText:
+    path: Optional[str]
+    text: str
+    # Tokens of the whole body text before boilerplate removal and truncation
+    raw_tokens: int
+    tokens: int
+    parse_seconds: float
+
+
+def html_main_text(
+    html: str,
+    max_tokens: int = HTML_MAX_TOKENS,
+    path: Optional[str] = None,
+    keep_markup: bool = False,
+) -> HtmlText:
+    """
+    Reduce an HTML page to the text of its body without boilerplate.
+
+    The page is parsed with lxml, scripts, styles, navigation, footers, asides
+    and forms are dropped, whitespace is collapsed and the result is cut to
+    `max_tokens`. With `keep_markup` the cleaned body is returned as HTML with
+    only its identifying attributes, for prompts that ask for XPaths.
+
+    Returns:
+        HtmlText: The text with its token counts and parse time; the text is
+            empty for an empty document.
+    """
+    start = time.perf_counter()
+    root = parse_html(html)
+    if root is None:
+        return HtmlText(path, "", 0, 0, time.perf_counter() - start)
+    body = root.find("body")
+    if body is None:
+        body = root
+    raw_tokens = count_tokens(body.text_content())
+
+    role_selector = " or ".join(f"@role='{role}'" for role in BOILERPLATE_ROLES)
+    boilerplate = body.xpath(f".//*[{role_selector}]") + list(
+        body.iter(*BOILERPLATE_TAGS)
+    )
+    for element in boilerplate:
+        element.drop_tree()
+    if keep_markup:
+        for element in body.iter(lxml.etree.Element):
+            for attribute in set(element.attrib) - MARKUP_ATTRIBUTES:
+                del element.attrib[attribute]
+        text = lxml.html.tostring(body, encoding="unicode")
+    else:
+        for element in body.iter(*BLOCK_TAGS):
+            element.tail = "\n" + (element.tail or "")
+        text = body.text_content()
+    text = truncate_tokens(_normalize_whitespace(text), max_tokens)
+
+    return HtmlText(
+        path=path,
+        text=text,
+        raw_tokens=raw_tokens,
+        tokens=count_tokens(text),
+        parse_seconds=time.perf_counter() - start,
+    )
+
+
+def _read_main_text(path: str, max_tokens: int) -> HtmlText:
+    with open(path, "r") as f:
+        return html_main_text(f.read(), max_tokens, path)
+
+
+def preprocess_html_files(
+    paths: Iterable["str | Path"],
+    max_tokens: int = HTML_MAX_TOKENS,
+    workers: int = HTML_WORKERS,
+) -> Iterator[HtmlText]:
+    """
+    Extract the main text of many HTML files across a process pool.
+
+    Yields:
+        HtmlText: The result of each file, in the order of `paths`.
+    """
+    paths = [str(path) for path in paths]
+    if workers <= 1:
+        for path in paths:
+            yield _read_main_text(path, max_tokens)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(
+            _read_main_text, paths, [max_tokens] * len(paths), chunksize=8
+        )
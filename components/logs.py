@@ -0,0 +1,13 @@
+import logging
+
+
+def configure_logging(level: int = logging.INFO):
+    """
+    Print what the components log, such as prompt token savings, page routing
+    and retried requests, to stderr. Other libraries only print warnings, so
+    httpx does not log every request.
+    """
+    logging.basicConfig(
+        level=logging.WARNING, format="%(asctime)s %(name)s: %(message)s"
+    )
+    logging.getLogger("components").setLevel(level)
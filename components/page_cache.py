@@ -0,0 +1,129 @@
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Optional
+
+import PIL.Image
+
+PAGE_CACHE_DIR = Path(os.environ.get("PAGE_CACHE_DIR", ".cache/pages"))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 2 * 1024**3))
+
+# magic, width, height
+_HEADER = struct.Struct("<4sII")
+_MAGIC = b"PGZ1"
+
+
+def hash_pdf(pdf_bytes: bytes) -> str:
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+class PageCache:
+    """
+    A persistent, content-addressed cache of rendered PDF pages.
+
+    Entries are keyed by the SHA-256 of the PDF bytes, the page index and the
+    DPI, so identical documents share entries regardless of their file name.
+    Rasters are stored as zlib-compressed RGB buffers, and the least recently
+    used entries are evicted once the directory grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: "str | Path" = PAGE_CACHE_DIR,
+        max_bytes: int = PAGE_CACHE_MAX_BYTES,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+
+    def _path(self, pdf_hash: str, page_num: int, dpi: int) -> Path:
+        return self.directory / f"{pdf_hash}_{page_num}_{dpi}.pgz"
+
+    def contains(self, pdf_hash: str, page_num: int, dpi: int) -> bool:
+        return self._path(pdf_hash, page_num, dpi).exists()
+
+    def get(
+        self, pdf_hash: str, page_num: int, dpi: int
+    ) -> Optional["PIL.Image.Image"]:
+        """
+        Load a cached page, or return None if it has not been rendered yet.
+        """
+        path = self._path(pdf_hash, page_num, dpi)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Touch the entry so eviction is least-recently-used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        magic, width, height = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            return None
+        samples = zlib.decompress(data[_HEADER.size :])
+        return PIL.Image.frombytes("RGB", (width, height), samples)
+
+    def put(
+        self, pdf_hash: str, page_num: int, dpi: int, width: int, height: int, samples
+    ):
+        """
+        Store the raw RGB samples of a rendered page.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        data = _HEADER.pack(_MAGIC, width, height) + zlib.compress(samples, 1)
+
+        # Write atomically so concurrent readers never see a partial entry
+        path = self._path(pdf_hash, page_num, dpi)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # A replaced entry no longer counts towards the total
+        try:
+            replaced_size = path.stat().st_size
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += len(data) - replaced_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _scan_size(self) -> int:
+        return sum(stat.st_size for _, stat in self._entries(suffix=""))
+
+    def _entries(self, suffix: str = ".pgz"):
+        # Entries may be removed by a concurrent put or evict while scanning
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(suffix):
+                continue
+            try:
+                yield entry.path, entry.stat()
+            except FileNotFoundError:
+                continue
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in `max_bytes`.
+        """
+        entries = sorted(
+            (stat.st_mtime, stat.st_size, path) for path, stat in self._entries()
+        )
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+
+page_cache = PageCache()
@@ -0,0 +1,204 @@
+import asyncio
+import bisect
+import json
+import math
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import pydantic
+
+from components.extraction import extract_data_with_schema_async
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+
+@dataclass
+class BackendResult:
+    backend: str
+    data: Optional[Dict] = None
+    error: Optional[BaseException] = None
+    # Seconds until the backend answered, None if it was cancelled
+    latency: Optional[float] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.latency is not None
+
+
+@dataclass
+class _BackendCounts:
+    requests: int = 0
+    wins: int = 0
+    cancelled: int = 0
+    errors: int = 0
+    latencies: List[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    # Validation failures by the schema field that failed
+    validation_failures: Counter = field(default_factory=Counter)
+
+
+def _field_path(loc) -> str:
+    # List indices are folded so failures count per field, not per item
+    path = ""
+    for part in loc:
+        path += "[]" if isinstance(part, int) else f".{part}" if path else str(part)
+    return path or "root"
+
+
+def _failure_keys(error: BaseException) -> List[str]:
+    if isinstance(error, pydantic.ValidationError):
+        return sorted({_field_path(e["loc"]) for e in error.errors()})
+    if isinstance(error, json.JSONDecodeError):
+        return ["invalid_json"]
+    return []
+
+
+class BackendStats:
+    """
+    Per-backend latency histograms and validation failure counts of extractions
+    dispatched to several backends.
+    """
+
+    def __init__(self):
+        self._counts: Dict[str, _BackendCounts] = {}
+        self._lock = threading.Lock()
+
+    def record(self, result: BackendResult, won: bool = False):
+        with self._lock:
+            counts = self._counts.setdefault(result.backend, _BackendCounts())
+            counts.requests += 1
+            counts.wins += won
+            if result.latency is None:
+                counts.cancelled += 1
+                return
+            counts.latencies[bisect.bisect_left(LATENCY_BUCKETS, result.latency)] += 1
+            if result.error is not None:
+                keys = _failure_keys(result.error)
+                counts.validation_failures.update(keys)
+                counts.errors += not keys
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Returns:
+            Dict[str, Dict]: For every backend, its request, win, cancellation
+                and error counts, the latency histogram keyed by bucket upper
+                bound, and the validation failures by field.
+        """
+        with self._lock:
+            return {
+                backend: {
+                    "requests": counts.requests,
+                    "wins": counts.wins,
+                    "cancelled": counts.cancelled,
+                    "errors": counts.errors,
+                    "latency": {
+                        f"<={bound:g}s" if bound < math.inf else "longer": n
+                        for bound, n in zip(LATENCY_BUCKETS, counts.latencies)
+                    },
+                    "validation_failures": dict(counts.validation_failures),
+                }
+                for backend, counts in self._counts.items()
+            }
+
+
+backend_stats = BackendStats()
+
+
+def _check_backends(backends: Sequence[str]):
+    if not backends:
+        raise ValueError("At least one backend is needed to dispatch an extraction")
+
+
+async def extract_timed(
+    pages, schema, backend: str, usage: Optional[Dict[str, int]] = None
+) -> BackendResult:
+    """
+    Extract with one backend, capturing its latency and any error in the result.
+    """
+    start = time.perf_counter()
+    try:
+        data = await extract_data_with_schema_async(
+            pages, schema, backend=backend, usage=usage
+        )
+    except Exception as e:
+        return BackendResult(backend, error=e, latency=time.perf_counter() - start)
+    return BackendResult(backend, data, latency=time.perf_counter() - start)
+
+
+async def extract_first_valid(
+    pages, schema, backends: Sequence[str], stats: BackendStats = backend_stats
+) -> BackendResult:
+    """
+    Send the same extraction to several backends and keep the first response
+    that validates against the schema.
+
+    Requests still in flight when a valid response arrives are cancelled.
+
+    Args:
+        pages: The pages of the document, as text or images.
+        schema: A schema class or its `ResponseFormat`.
+        backends (Sequence[str]): The names of the backends to race.
+        stats (BackendStats): Where the latency and failures are recorded.
+
+    Returns:
+        BackendResult: The winning backend's result.
+
+    Raises:
+        ValueError: If no backends are given.
+        Exception: The error of the first backend that failed, if all did.
+    """
+    _check_backends(backends)
+    pending = {
+        asyncio.ensure_future(extract_timed(pages, schema, name)): name
+        for name in backends
+    }
+    failures = []
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda task: task.result().latency):
+                del pending[task]
+                result = task.result()
+                if result.ok:
+                    stats.record(result, won=True)
+                    return result
+                stats.record(result)
+                failures.append(result)
+    finally:
+        for task, name in pending.items():
+            if task.done() and not task.cancelled():
+                # Finished alongside the winner
+                stats.record(task.result())
+            else:
+                task.cancel()
+                stats.record(BackendResult(name))
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    raise failures[0].error
+
+
+async def extract_all_backends(
+    pages, schema, backends: Sequence[str], stats: BackendStats = backend_stats
+) -> Dict[str, BackendResult]:
+    """
+    Send the same extraction to several backends at once and wait for all of
+    them, e.g. to compare models in an eval.
+
+    Returns:
+        Dict[str, BackendResult]: The result of each backend, failed ones with
+            their error.
+
+    Raises:
+        ValueError: If no backends are given.
+    """
+    _check_backends(backends)
+    results = await asyncio.gather(
+        *(extract_timed(pages, schema, name) for name in backends)
+    )
+    for result in results:
+        stats.record(result)
+    return {result.backend: result for result in results}
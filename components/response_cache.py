@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+
+LLM_CACHE_PATH = Path(os.environ.get("LLM_CACHE_PATH", ".cache/llm_responses.sqlite"))
+# One of "readwrite", "replay" (serve hits, fail on misses) or "off"
+LLM_CACHE_MODE = os.environ.get("LLM_CACHE_MODE", "readwrite")
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 30 * 24 * 60 * 60))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 100_000))
+
+# Expired and excess entries are purged once every this many writes
+_EVICT_EVERY = 100
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode for a request that is not in the cache."""
+
+
+def _normalize_content(content):
+    if isinstance(content, str):
+        return content
+    parts = []
+    for part in content:
+        if part.get("type") == "image_url":
+            # Hash image payloads rather than keying on megabytes of base64
+            url = part["image_url"]["url"].encode("utf-8")
+            part = {"type": "image_url", "image_url": {"url": _sha256(url)}}
+        parts.append(part)
+    return parts
+
+
+def _normalize_response_format(response_format):
+    if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+        return {
+            "name": response_format.__name__,
+            "schema": response_format.model_json_schema(),
+        }
+    return response_format
+
+
+def _sha256(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def request_key(request: Dict) -> str:
+    """
+    A stable hash of a chat completion request.
+
+    The key covers every request argument, with image payloads replaced by their
+    hashes and Pydantic response formats by their JSON schema.
+    """
+    normalized = dict(request)
+    normalized["messages"] = [
+        dict(message, content=_normalize_content(message["content"]))
+        for message in request["messages"]
+    ]
+    if "response_format" in normalized:
+        normalized["response_format"] = _normalize_response_format(
+            normalized["response_format"]
+        )
+    payload = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    A persistent SQLite cache of chat completion responses.
+
+    Entries expire after `ttl` seconds and the least recently used entries are
+    dropped past `max_entries`. In "replay" mode the cache is read-only and
+    `get` raises `CacheMiss` for unknown requests, so eval runs can be replayed
+    without touching the network. Hits and misses are counted on the instance.
+    """
+
+    def __init__(
+        self,
+        path: "str | Path" = LLM_CACHE_PATH,
+        mode: str = LLM_CACHE_MODE,
+        ttl: float = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+    ):
+        if mode not in ("readwrite", "replay", "off"):
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT, created REAL, accessed REAL)"
+            )
+        return self._connection
+
+    def get(self, key: str) -> Optional[ChatCompletion]:
+        """
+        Look up a cached response by `request_key`.
+
+        Raises:
+            CacheMiss: If the request is not cached and the cache is in replay mode.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if self.mode == "readwrite":
+                    connection.execute(
+                        "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+                    )
+
+        if row is None:
+            if self.mode == "replay":
+                raise CacheMiss(key)
+            return None
+
+        return ChatCompletion.model_validate_json(row[0])
+
+    def put(self, key: str, response: ChatCompletion):
+        if self.mode != "readwrite":
+            return
+
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, response.model_dump_json(), now, now),
+            )
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict(connection, now)
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        connection.execute(
+            "DELETE FROM responses WHERE created <= ?", (now - self.ttl,)
+        )
+        connection.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
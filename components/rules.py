@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    get_args,
+    get_origin,
+)
+from urllib.parse import urlparse
+
+import lxml.etree
+from pydantic import BaseModel, ValidationError
+
+from components.html import parse_html
+
+PARSING_RULES_DIR = Path(os.environ.get("PARSING_RULES_DIR", ".cache/parsing_rules"))
+
+XPATH = "xpath"
+REGEX = "regex"
+
+_CANONICAL_URL = re.compile(
+    r"<(?:link[^>]+rel=[\"']canonical[\"'][^>]+href"
+    r"|meta[^>]+property=[\"']og:url[\"'][^>]+content)=[\"']([^\"']+)",
+    re.IGNORECASE,
+)
+_HEADER_NAME = re.compile(r"^([A-Za-z][A-Za-z0-9-]*):", re.MULTILINE)
+_SPACES = re.compile(r"\s+")
+_UNSAFE_FILE_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def rules_path(backend: str, model: str) -> Path:
+    """
+    The rules file of one backend and model. Rules are only replayed for the
+    model that produced them, so runs against different models never reuse
+    or overwrite each other's rules.
+    """
+    name = _UNSAFE_FILE_CHARS.sub("_", f"{backend}-{model}")
+    return PARSING_RULES_DIR / f"{name}.jsonl"
+
+
+def html_domain(html: str) -> Optional[str]:
+    """
+    The site of an HTML page, from its canonical or Open Graph URL.
+    """
+    match = _CANONICAL_URL.search(html)
+    if match is None:
+        return None
+    return urlparse(match.group(1)).netloc.lower().removeprefix("www.") or None
+
+
+def header_layout(text: str) -> str:
+    """
+    A key for the header layout of an email: the hash of its ordered field names.
+    """
+    header = text.split("\n\n", 1)[0]
+    names = "|".join(name.lower() for name in _HEADER_NAME.findall(header))
+    return hashlib.sha256(names.encode("utf-8")).hexdigest()[:16]
+
+
+def _field_shape(annotation) -> Tuple[bool, bool]:
+    # Whether a field holds a list and whether it accepts None
+    nullable = False
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        nullable = len(args) < len(get_args(annotation))
+        annotation = args[0] if len(args) == 1 else annotation
+    return get_origin(annotation) is list, nullable
+
+
+def _normalize(value):
+    if isinstance(value, list):
+        return sorted(_normalize(item) for item in value)
+    if isinstance(value, str):
+        return _SPACES.sub(" ", value).strip().lower()
+    return value
+
+
+@dataclass
+class ReplayStats:
+    hits: int = 0
+    misses: int = 0
+    learned: int = 0
+    rejected: int = 0
+    replay_seconds: float = 0.0
+
+    def __str__(self) -> str:
+        tried = self.hits + self.misses
+        per_replay = self.replay_seconds / tried * 1e6 if tried else 0.0
+        return (
+            f"{self.hits} replayed, {self.misses} sent to the model, "
+            f"{self.learned} rule sets learned, {self.rejected} rejected, "
+            f"{per_replay:.0f}us per replay"
+        )
+
+
+class RuleReplay:
+    """
+    A cache of the parsing rules a model returned, replayed locally.
+
+    Schemas like `Article` and `Email` ask the model for the XPaths or regexes
+    that locate each field alongside the data. Once such rules reproduce the
+    model's answer on a document, they are stored under a template key (the
+    site of an article, the header layout of an email) and later documents of
+    the same template are extracted by applying the rules with lxml or `re`.
+    A replay counts only if the result validates against the schema and every
+    required field was found; otherwise the document goes to the model.
+
+    Rule fields are mapped to data fields by name, e.g. `byline_xpath` fills
+    `byline`. Fields no rule covers are filled by `derive`, which receives the
+    replayed fields and the source text.
+
+    Args:
+        schema_class (Type[BaseModel]): The schema, with a field of rules.
+        kind (str): `XPATH` for HTML sources or `REGEX` for text.
+        path (str | Path): The JSONL file rules are persisted to, one per
+            model, see `rules_path`.
+        rules_field (str): The name of the schema field holding the rules.
+        derive (Optional[Callable]): Computes the fields no rule covers.
+    """
+
+    def __init__(
+        self,
+        schema_class: Type[BaseModel],
+        kind: str,
+        path: "str | Path",
+        rules_field: str = "parsing_rules",
+        derive: Optional[Callable[[Dict, str], Dict]] = None,
+    ):
+        self.schema_class = schema_class
+        self.kind = kind
+        self.rules_field = rules_field
+        self.derive = derive
+        self.path = Path(path)
+        self.stats = ReplayStats()
+        self._rules: Optional[Dict[str, Dict]] = None
+        self._compiled: Dict[str, object] = {}
+        self._shapes = {
+            name: _field_shape(field.annotation)
+            for name, field in schema_class.model_fields.items()
+        }
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._rules is None:
+            self._rules = {}
+            if self.path.exists():
+                with open(self.path, "r") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if record["schema"] == self.schema_class.__name__:
+                            # Later rules for a template replace earlier ones
+                            self._rules[record["key"]] = record["rules"]
+        return self._rules
+
+    def _field_name(self, rule_name: str) -> str:
+        return rule_name.removesuffix(f"_{self.kind}")
+
+    def _compile(self, rule: str):
+        compiled = self._compiled.get(rule)
+        if compiled is None:
+            if self.kind == XPATH:
+                compiled = lxml.etree.XPath(rule)
+            else:
+                compiled = re.compile(rule, re.MULTILINE)
+            self._compiled[rule] = compiled
+        return compiled
+
+    def _match(self, compiled, document) -> Optional[str]:
+        if self.kind == XPATH:
+            result = compiled(document)
+            if isinstance(result, list):
+                values = [
+                    item.text_content() if hasattr(item, "text_content") else str(item)
+                    for item in result
+                ]
+                result = next((value for value in values if value.strip()), None)
+        else:
+            match = compiled.search(document)
+            result = None
+            if match is not None:
+                result = match.group(1) if compiled.groups else match.group(0)
+        if result is None or not str(result).strip():
+            return None
+        return _SPACES.sub(" ", str(result)).strip()
+
+    def apply(self, source: str, rules: Dict) -> Optional[Dict]:
+        """
+        Extract a document with a set of rules.
+
+        Returns:
+            Optional[Dict]: The data if it validates against the schema, else
+                None.
+        """
+        try:
+            if self.kind == XPATH:
+                document = parse_html(source)
+                if document is None:
+                    return None
+            else:
+                document = source
+
+            data = {}
+            for rule_name, rule in rules.items():
+                field = self._field_name(rule_name)
+                if field not in self._shapes:
+                    continue
+                is_list, nullable = self._shapes[field]
+                value = None
+                if rule is not None:
+                    value = self._match(self._compile(rule), document)
+                if value is None and not nullable:
+                    # Optional fields may be absent, required ones must be found
+                    return None
+                if value is not None and is_list:
+                    value = [item.strip() for item in value.split(",") if item.strip()]
+                data[field] = value
+        except (lxml.etree.XPathError, re.error, ValueError):
+            return None
+
+        if self.derive is not None:
+            data.update(self.derive(data, source))
+        data[self.rules_field] = rules
+        try:
+            self.schema_class.model_validate(data)
+        except ValidationError:
+            return None
+        return data
+
+    def replay(self, key: Optional[str], source: str) -> Optional[Dict]:
+        """
+        Extract a document with the rules of its template, if any are known.
+        """
+        start = time.perf_counter()
+        rules = self._load().get(key) if key is not None else None
+        data = self.apply(source, rules) if rules is not None else None
+        with self._lock:
+            self.stats.replay_seconds += time.perf_counter() - start
+            if data is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return data
+
+    def learn(self, key: Optional[str], source: str, data: Dict) -> bool:
+        """
+        Store the rules of a model extraction for its template if replaying
+        them reproduces the model's data.
+
+        Returns:
+            bool: Whether the rules were stored.
+        """
+        rules = data.get(self.rules_field)
+        if key is None or not rules:
+            return False
+        replayed = self.apply(source, rules)
+        agrees = replayed is not None and all(
+            _normalize(replayed[field]) == _normalize(data.get(field))
+            for field in self._covered_fields(rules)
+        )
+        with self._lock:
+            if not agrees:
+                self.stats.rejected += 1
+                return False
+            self._load()[key] = rules
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                record = {
+                    "schema": self.schema_class.__name__,
+                    "key": key,
+                    "rules": rules,
+                }
+                f.write(json.dumps(record) + "\n")
+            self.stats.learned += 1
+        return True
+
+    def _covered_fields(self, rules: Dict) -> List[str]:
+        return [
+            self._field_name(rule_name)
+            for rule_name, rule in rules.items()
+            if rule is not None and self._field_name(rule_name) in self._shapes
+        ]
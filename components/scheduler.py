@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+
+import openai
+import PIL.Image
+
+from components.response_cache import ResponseCache, request_key
+
+logger = logging.getLogger(__name__)
+
+# Rough cost of one high-detail page image; pages are downscaled to 2048px and
+# then to 768px on the short side, which is 4 tiles of 170 tokens plus 85.
+IMAGE_TOKENS = 765
+# Completion allowance reserved for requests without max_tokens
+COMPLETION_TOKENS = 1_000
+
+
+@dataclass
+class RateLimit:
+    requests_per_minute: int
+    tokens_per_minute: int
+
+
+MODEL_LIMITS = {
+    "gpt-4o-2024-08-06": RateLimit(requests_per_minute=500, tokens_per_minute=30_000),
+    "gpt-4o-mini": RateLimit(requests_per_minute=500, tokens_per_minute=200_000),
+}
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def estimate_page_tokens(page: "str | PIL.Image.Image") -> int:
+    """
+    Estimate the input tokens of one page, given as text or an image.
+    """
+    if isinstance(page, str):
+        return len(page) // 4
+    return IMAGE_TOKENS
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: Optional[int] = None) -> int:
+    """
+    Estimate the tokens a chat completion request will consume.
+
+    Text is counted at four characters per token and every image at
+    `IMAGE_TOKENS`, plus the completion allowance.
+    """
+    tokens = COMPLETION_TOKENS if max_tokens is None else max_tokens
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content:
+            if part["type"] == "text":
+                tokens += len(part["text"]) // 4
+            else:
+                tokens += IMAGE_TOKENS
+    return tokens
+
+
+class _Budget:
+    """
+    Token buckets for the requests and tokens per minute of one model.
+    """
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.requests = float(limit.requests_per_minute)
+        self.tokens = float(limit.tokens_per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Take one request and `tokens` from the buckets, or return the seconds to
+        wait before trying again.
+        """
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(
+            self.limit.requests_per_minute,
+            self.requests + elapsed * self.limit.requests_per_minute / 60,
+        )
+        self.tokens = min(
+            self.limit.tokens_per_minute,
+            self.tokens + elapsed * self.limit.tokens_per_minute / 60,
+        )
+
+        # A single request larger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.limit.tokens_per_minute)
+        if self.requests >= 1 and self.tokens >= tokens:
+            self.requests -= 1
+            self.tokens -= tokens
+            return 0.0
+
+        request_wait = (1 - self.requests) * 60 / self.limit.requests_per_minute
+        token_wait = (tokens - self.tokens) * 60 / self.limit.tokens_per_minute
+        return max(request_wait, token_wait, 0.0)
+
+
+class RequestScheduler:
+    """
+    Shared rate limiting and retry policy for chat completion calls.
+
+    Every call reserves a request and an estimated token count against the
+    per-model budgets in `limits` before it is sent, and the estimate is
+    corrected with the reported usage afterwards. Rate limit, connection and
+    server errors are retried with jittered exponential backoff, honoring the
+    Retry-After headers of the response. Models without limits are only retried.
+
+    With a `cache`, identical non-streaming requests are answered from the
+    response cache before any budget is spent.
+
+    The scheduler is agnostic of the endpoint, so it can be exercised against a
+    local OpenAI-compatible server by pointing the client's base URL at it
+    (e.g. with the OPENAI_BASE_URL environment variable).
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, RateLimit] = MODEL_LIMITS,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cache = cache if cache is not None and cache.enabled else None
+        self._budgets = {model: _Budget(limit) for model, limit in limits.items()}
+        self._lock = threading.Lock()
+
+    def _reserve(self, model: str, tokens: int) -> float:
+        budget = self._budgets.get(model)
+        if budget is None:
+            return 0.0
+        with self._lock:
+            return budget.reserve(tokens)
+
+    def _settle(self, model: str, estimate: int, response):
+        budget = self._budgets.get(model)
+        usage = getattr(response, "usage", None)
+        if budget is None or usage is None:
+            return
+        with self._lock:
+            budget.tokens -= usage.total_tokens - estimate
+
+    def _cache_key(self, kwargs) -> Optional[str]:
+        if self.cache is None or kwargs.get("stream"):
+            return None
+        return request_key(kwargs)
+
+    def _store(self, key: Optional[str], response):
+        if key is not None:
+            self.cache.put(key, response)
+
+    def _backoff(self, model: str, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay)
+
+        # Hold back every other request to the model, not just this one
+        budget = self._budgets.get(model)
+        if budget is not None and isinstance(error, openai.RateLimitError):
+            with self._lock:
+                budget.blocked_until = max(
+                    budget.blocked_until, time.monotonic() + delay
+                )
+
+        logger.warning(
+            "%s request failed (%r), retrying in %.1fs (attempt %d/%d)",
+            model,
+            error,
+            delay,
+            attempt + 1,
+            self.max_retries,
+        )
+        return delay
+
+    def call(self, fn, **kwargs):
+        """
+        Call a chat completion method, e.g. `llm.chat.completions.create`.
+
+        Args:
+            fn: The client method to call.
+            **kwargs: The request arguments, including `model` and `messages`.
+
+        Returns:
+            The response of `fn`.
+        """
+        key = self._cache_key(kwargs)
+        if key is not None and (response := self.cache.get(key)) is not None:
+            return response
+
+        model = kwargs["model"]
+        estimate = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+
+        for attempt in range(self.max_retries + 1):
+            while (wait := self._reserve(model, estimate)) > 0:
+                time.sleep(wait)
+            try:
+                response = fn(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(model, attempt, e))
+                continue
+            self._settle(model, estimate, response)
+            self._store(key, response)
+            return response
+
+    async def acall(self, fn, **kwargs):
+        """
+        Asynchronous counterpart of `call`, for `AsyncOpenAI` client methods.
+        """
+        key = self._cache_key(kwargs)
+        if key is not None and (response := self.cache.get(key)) is not None:
+            return response
+
+        model = kwargs["model"]
+        estimate = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+
+        for attempt in range(self.max_retries + 1):
+            while (wait := self._reserve(model, estimate)) > 0:
+                await asyncio.sleep(wait)
+            try:
+                response = await fn(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(model, attempt, e))
+                continue
+            self._settle(model, estimate, response)
+            self._store(key, response)
+            return response
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = response.headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,184 @@
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from components.schema_registry import compile_schema
+
+# Number of candidate schemas offered to the selection call
+SELECTION_TOP_K = 3
+
+_WORD = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])")
+
+
+def tokenize(text: str) -> set:
+    """
+    Split text or identifiers (snake_case or CamelCase) into normalized words.
+    """
+    words = set()
+    for word in _WORD.findall(text):
+        word = word.lower()
+        if len(word) < 3:
+            continue
+        # Crude plural folding so "questions" matches "question"
+        if len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+@dataclass
+class SchemaEntry:
+    name: str
+    source: str
+    model_name: Optional[str] = None
+    # Dotted field paths and their JSON schema types, nested models included
+    fields: List[Tuple[str, str]] = field(default_factory=list)
+    tokens: set = field(default_factory=set)
+
+
+def _type_name(schema: Dict) -> str:
+    if "anyOf" in schema:
+        return "|".join(_type_name(variant) for variant in schema["anyOf"])
+    if "$ref" in schema:
+        return schema["$ref"].split("/")[-1]
+    return schema.get("type", "object")
+
+
+def _schema_fields(json_schema: Dict) -> List[Tuple[str, str]]:
+    definitions = json_schema.get("$defs", {})
+    fields = []
+
+    def visit(schema: Dict, prefix: str, seen: frozenset):
+        for variant in schema.get("anyOf", []):
+            visit(variant, prefix, seen)
+        if "$ref" in schema:
+            ref = schema["$ref"].split("/")[-1]
+            if ref not in seen:
+                visit(definitions[ref], prefix, seen | {ref})
+            return
+        if schema.get("type") == "array":
+            visit(schema.get("items", {}), prefix + "[]", seen)
+            return
+        for name, prop in schema.get("properties", {}).items():
+            path = f"{prefix}.{name}" if prefix else name
+            fields.append((path, _type_name(prop)))
+            visit(prop, path, seen)
+
+    visit(json_schema, "", frozenset())
+    return fields
+
+
+def _load_entry(path: Path) -> SchemaEntry:
+    with open(path, "r") as schema_file:
+        source = schema_file.read()
+    entry = SchemaEntry(name=path.stem, source=source)
+
+    try:
+        compiled = compile_schema(source)
+    except Exception:
+        # Still offer schemas that fail to compile, matched on their source text
+        entry.tokens = tokenize(source)
+        return entry
+
+    entry.model_name = compiled.name
+    entry.fields = _schema_fields(compiled.json_schema)
+    entry.tokens = tokenize(compiled.name)
+    for field_path, _ in entry.fields:
+        entry.tokens |= tokenize(field_path.replace(".", " ").replace("[]", " "))
+    return entry
+
+
+class SchemaCatalog:
+    """
+    An in-memory index of the schema definitions in a directory.
+
+    Files are parsed once into `SchemaEntry` metadata and reloaded only when the
+    directory listing or a file's modification time or size changes.
+    """
+
+    def __init__(self, directory: "str | Path" = "./schemas"):
+        self.directory = Path(directory)
+        self._signature = None
+        self._entries: Dict[str, SchemaEntry] = {}
+        self._lock = threading.Lock()
+
+    def _scan(self) -> Tuple:
+        return tuple(
+            sorted(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(".py")
+            )
+        )
+
+    def entries(self) -> List[SchemaEntry]:
+        with self._lock:
+            signature = self._scan()
+            if signature != self._signature:
+                # Only reparse files that are new or changed
+                unchanged = set(self._signature or ())
+                entries = {}
+                for name, mtime, size in signature:
+                    stem = Path(name).stem
+                    if (name, mtime, size) in unchanged and stem in self._entries:
+                        entries[stem] = self._entries[stem]
+                    else:
+                        entries[stem] = _load_entry(self.directory / name)
+                self._entries = entries
+                self._signature = signature
+            return list(self._entries.values())
+
+    def get(self, name: str) -> Optional[SchemaEntry]:
+        self.entries()
+        return self._entries.get(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+            self._entries = {}
+
+    def rank(self, text: str, k: int = SELECTION_TOP_K) -> List[SchemaEntry]:
+        """
+        Rank schemas by the share of their field and model names found in `text`.
+
+        Args:
+            text (str): The text of the document.
+            k (int): The number of schemas to return.
+
+        Returns:
+            List[SchemaEntry]: Up to `k` schemas sharing at least one word with
+                the document, best first; none if the document has no text to
+                compare against, e.g. a scan without a text layer.
+        """
+        document_tokens = tokenize(text)
+        if not document_tokens:
+            return []
+
+        def score(entry: SchemaEntry) -> float:
+            if not entry.tokens:
+                return 0.0
+            return len(entry.tokens & document_tokens) / len(entry.tokens)
+
+        scored = [(score(entry), entry) for entry in self.entries()]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [entry for entry_score, entry in scored[:k] if entry_score > 0]
+
+
+def document_text(pages) -> str:
+    """
+    Collect the text of a document's pages: text pages as they are, and the
+    text layer that `components.files` attaches to rendered page images.
+    """
+    texts = []
+    for page in pages:
+        if isinstance(page, str):
+            texts.append(page)
+        else:
+            texts.append(getattr(page, "info", {}).get("text", ""))
+    return "\n".join(texts)
+
+
+schema_catalog = SchemaCatalog()
@@ -1,9 +1,9 @@
-import base64
-import json
 import re
-from io import BytesIO
-from pathlib import Path
-from typing import Dict, Tuple, Type
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Type
 
 import PIL.Image
 from dotenv import load_dotenv
@@ -11,9 +11,50 @@ from openai import OpenAI
 from pydantic import BaseModel
 from streamlit import secrets
 
+from components.backends import (
+    Backend,
+    BackendConfig,
+    BackendRegistry,
+    load_backend_configs,
+    local_backend_config,
+)
+from components.encoding import (
+    IMAGE_FORMAT,
+    IMAGE_MAX_DIMENSION,
+    IMAGE_QUALITY,
+    encode_image,
+)
+from components.fingerprints import fingerprint_index
+from components.history import compact_history, log_compaction
+from components.response_cache import ResponseCache
+from components.scheduler import RequestScheduler
+from components.schema_catalog import (
+    SELECTION_TOP_K,
+    SchemaEntry,
+    document_text,
+    schema_catalog,
+)
+from components.schema_registry import compile_schema, response_format_for
+
 load_dotenv()
 
-llm = OpenAI(api_key=secrets["OPENAI_API_KEY"])
+# Retries are owned by the scheduler, which also enforces the rate limits
+llm = OpenAI(api_key=secrets["OPENAI_API_KEY"], max_retries=0)
+response_cache = ResponseCache()
+scheduler = RequestScheduler(cache=response_cache)
+
+# Extraction targets with pooled clients, selected by name
+backends = BackendRegistry(
+    [
+        BackendConfig(
+            name="openai", model="gpt-4o-mini", api_key=secrets["OPENAI_API_KEY"]
+        ),
+        local_backend_config(),
+        *load_backend_configs(),
+    ]
+)
+
+PROMPT_EXTRACT = """Based on the provided schema, please extract data from the input."""
 
 
 class SchemaSelection(BaseModel):
@@ -21,19 +62,25 @@ class SchemaSelection(BaseModel):
     chosen_schema: str
 
 
-def base64_encode_image(image: "PIL.Image.Image") -> str:
+def base64_encode_image(
+    image: "PIL.Image.Image",
+    format: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+    max_dimension: "int | None" = IMAGE_MAX_DIMENSION,
+) -> str:
     """
     Encode a PIL Image object to a base64 string.
 
     Args:
         image (PIL.Image.Image): The image to encode.
+        format (str): One of "JPEG", "WEBP" or "PNG".
+        quality (int): The lossy compression quality, ignored for PNG.
+        max_dimension (int | None): The maximum length of the longest side.
 
     Returns:
         str: The base64 encoded string representation of the image.
     """
-    buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    return encode_image(image, format, quality, max_dimension).data
 
 
 def format_input_message(input: "str | PIL.Image.Image") -> Dict:
@@ -44,7 +91,7 @@ def format_input_message(input: "str | PIL.Image.Image") -> Dict:
     formatted for use in API requests. For text inputs, it returns a dictionary with
     'type' set to 'text' and 'text' containing the input string. For image inputs,
     it returns a dictionary with 'type' set to 'image_url' and 'image_url' containing
-    the base64-encoded image data.
+    the base64-encoded image data, labelled with the MIME type of its encoding.
 
     Args:
         input (str|PIL.Image.Image): The input to be formatted, either a string or a PIL.Image.Image object.
@@ -60,24 +107,14 @@ def format_input_message(input: "str | PIL.Image.Image") -> Dict:
     elif isinstance(input, PIL.Image.Image):
         return {
             "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_encode_image(input)}"
-            },
+            "image_url": {"url": encode_image(input).data_url},
         }
     else:
         raise TypeError("Input must be a string or an image object.")
 
 
-def build_schema_prompt():
-    schema_paths = Path("./schemas").glob("*.py")
-
-    schema_blocks = []
-    # load in each file to a string
-    for schema_path in schema_paths:
-        with open(schema_path, "r") as schema_file:
-            schema_block = schema_file.read()
-        schema_block = schema_path.stem + ":\n" + schema_block
-        schema_blocks.append(schema_block)
+def build_schema_prompt(candidates: List[SchemaEntry]) -> str:
+    schema_blocks = [f"{entry.name}:\n{entry.source}" for entry in candidates]
 
     seed_schemas = "\n".join(schema_blocks)
     schema_prompt = f"Do either of the schemas below align with this document?\n\nAVAILABLE SCHEMAS:\n\n{seed_schemas}"
@@ -85,40 +122,122 @@ def build_schema_prompt():
     return schema_prompt
 
 
-def get_schema_selection(pages):
-    schema_path = Path("./schemas")
+def candidate_schemas(pages) -> List[SchemaEntry]:
+    """
+    Pick the catalog schemas worth offering to the selection call.
+
+    Schemas are ranked by the words they share with the text of the document.
+    Scans without a text layer fall back to the schemas of the documents with
+    the most similar layout in the fingerprint index, and documents without
+    either signal to the first `SELECTION_TOP_K` schemas of the catalog.
+    """
+    candidates = schema_catalog.rank(document_text(pages))
+    if candidates:
+        return candidates
+
+    entries = {entry.source: entry for entry in schema_catalog.entries()}
+    candidates = [
+        entries[schema]
+        for schema, _ in fingerprint_index.neighbours(pages, SELECTION_TOP_K)
+        if schema in entries
+    ]
+    return candidates or list(entries.values())[:SELECTION_TOP_K]
+
+
+def build_selection_messages(
+    pages, candidates: Optional[List[SchemaEntry]] = None
+) -> List[Dict]:
     with open("./prompts/schema_selection.txt", "r") as f:
         system_prompt = f.read()
 
-    prompt = build_schema_prompt()
+    # Only the best matching schemas go into the prompt
+    if candidates is None:
+        candidates = candidate_schemas(pages)
+    prompt = build_schema_prompt(candidates)
 
     inputs_formatted = [format_input_message(prompt)] + [
         format_input_message(page) for page in pages
     ]
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": inputs_formatted},
     ]
 
-    resp = llm.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06", messages=messages, response_format=SchemaSelection
+
+def get_schema_selection(pages):
+    candidates = candidate_schemas(pages)
+    messages = build_selection_messages(pages, candidates)
+    if not candidates:
+        # Nothing to choose from, a new schema is generated
+        return None, messages
+
+    resp = scheduler.call(
+        llm.chat.completions.create,
+        model="gpt-4o-2024-08-06",
+        messages=messages,
+        response_format=response_format_for(SchemaSelection).param,
     )
 
-    response_text = json.loads(resp.choices[0].message.content)
+    response_text = response_format_for(SchemaSelection).parse(resp)
 
     messages.append({"role": "assistant", "content": str(response_text)})
 
-    if response_text["chosen_schema"] == "None":
+    chosen = schema_catalog.get(response_text["chosen_schema"])
+    if chosen is None:
         return None, messages
     else:
-        schema_path = schema_path / f"{response_text['chosen_schema']}.py"
-        with open(schema_path, "r") as schema_file:
-            schema_definition = schema_file.read()
+        return chosen.source, messages
+
 
-        return schema_definition, messages
+class StageCancelled(Exception):
+    """Raised inside a speculative stage whose result is no longer needed."""
+
+
+def complete(
+    stream: bool = False,
+    cancel: Optional[threading.Event] = None,
+    stop_after_code_block: bool = False,
+    **kwargs,
+) -> str:
+    """
+    Run a chat completion through the scheduler and return its text.
 
+    No request is sent once `cancel` is set. When streaming, the completion is
+    consumed as it arrives: it is abandoned as soon as `cancel` is set, and
+    with `stop_after_code_block` it is closed once the first fenced code block
+    is complete, so the next stage can start without waiting for the model's
+    closing remarks.
 
-def generate_custom_schema(history):
+    Raises:
+        StageCancelled: If `cancel` was set before or while the request ran.
+    """
+    if cancel is not None and cancel.is_set():
+        raise StageCancelled()
+    if not stream:
+        resp = scheduler.call(llm.chat.completions.create, **kwargs)
+        return resp.choices[0].message.content
+
+    completion = scheduler.call(llm.chat.completions.create, stream=True, **kwargs)
+    content = ""
+    try:
+        for chunk in completion:
+            if cancel is not None and cancel.is_set():
+                raise StageCancelled()
+            if chunk.choices and chunk.choices[0].delta.content:
+                content += chunk.choices[0].delta.content
+                if stop_after_code_block and content.count("```") >= 2:
+                    break
+    finally:
+        completion.close()
+    return content
+
+
+def generate_custom_schema(
+    history,
+    stream: bool = False,
+    cancel: Optional[threading.Event] = None,
+    tokens: Optional[Dict[str, Tuple[int, int]]] = None,
+):
     with open("./prompts/schema_data_identification.txt", "r") as f:
         prompt_schema = f.read()
 
@@ -130,59 +249,67 @@ def generate_custom_schema(history):
 
     messages = history + [{"role": "user", "content": prompt_schema}]
 
-    resp = llm.chat.completions.create(
-        model="gpt-4o-2024-08-06",
-        messages=messages,
-    )
+    resp_str = complete(stream, cancel, model="gpt-4o-2024-08-06", messages=messages)
 
-    messages.append({"role": "assistant", "content": resp.choices[0].message.content})
+    messages.append({"role": "assistant", "content": resp_str})
 
     messages.append({"role": "user", "content": prompt_generate})
 
-    resp = llm.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-    )
+    # The fields are now described in text, so the pages need not be resent
+    compacted = compact_history(messages)
+    log_compaction("schema_pydantic_generation", messages, compacted, tokens)
+    resp_str = complete(stream, cancel, model="gpt-4o-mini", messages=compacted)
 
-    messages.append({"role": "assistant", "content": resp.choices[0].message.content})
+    messages.append({"role": "assistant", "content": resp_str})
 
     messages.append({"role": "user", "content": prompt_refine})
 
-    resp = llm.chat.completions.create(
-        model="gpt-4o-mini", messages=messages, temperature=0.3
+    compacted = compact_history(messages)
+    log_compaction("schema_pydantic_refine", messages, compacted, tokens)
+    resp_str = complete(
+        stream,
+        cancel,
+        stop_after_code_block=True,
+        model="gpt-4o-mini",
+        messages=compacted,
+        temperature=0.3,
     )
-    resp_str = resp.choices[0].message.content
 
     messages.append({"role": "assistant", "content": resp_str})
 
     schema_str = re.split(r"```.*", resp_str)[1].strip()
 
-    return schema_str, messages
+    return schema_str, compact_history(messages)
 
 
-def extract_data_with_schema(pages, schema, local=False):
-    prompt_extract = (
-        """Based on the provided schema, please extract data from the input."""
-    )
-
+def build_extraction_messages(pages) -> List[Dict]:
     inputs_formatted = [format_input_message(page) for page in pages]
-    messages = [
-        {"role": "system", "content": prompt_extract},
+    return [
+        {"role": "system", "content": PROMPT_EXTRACT},
         {"role": "user", "content": inputs_formatted},
     ]
 
-    if not local:
-        resp = llm.beta.chat.completions.parse(
-            model="gpt-4o-mini", messages=messages, response_format=schema
-        )
 
-    else:
-        client = OpenAI(base_url="http://127.0.0.1:1234/v1", api_key="lm-studio")
-        resp = client.beta.chat.completions.parse(
-            model="qwen2-v1-7b-instruct@4bit", messages=messages, response_format=schema
-        )
+def backend_for(local: bool = False, backend: Optional[str] = None) -> Backend:
+    """
+    Resolve the backend of an extraction call: `backend` by name if given,
+    otherwise the local model or the OpenAI model depending on `local`.
+    """
+    return backends.get(backend or ("local" if local else "openai"))
 
-    return json.loads(resp.choices[0].message.content)
+
+def extract_data_with_schema(pages, schema, local=False, backend=None):
+    # Accepts a schema class or its prebuilt ResponseFormat
+    response_format = response_format_for(schema)
+    target = backend_for(local, backend)
+
+    resp = scheduler.call(
+        target.create,
+        model=target.model,
+        messages=build_extraction_messages(pages),
+        response_format=response_format.param,
+    )
+    return response_format.parse(resp)
 
 
 def get_schema_class(schema_str: str) -> Tuple[Type[BaseModel], str]:
@@ -198,23 +325,21 @@ def get_schema_class(schema_str: str) -> Tuple[Type[BaseModel], str]:
             - The name of the schema class as a string.
 
     Raises:
-        NameError: If the schema class name is not found in the local namespace after execution.
+        NameError: If the schema definition contains no Pydantic model.
         SyntaxError: If there's a syntax error in the schema definition.
+        UnsafeSchemaError: If the schema uses anything besides allow-listed
+            imports, class definitions, annotations and literal settings.
 
     Note:
-        This function uses `exec()` to dynamically create the schema class,
-        which can be a security risk if `schema_str` comes from an untrusted source.
+        Schemas are compiled once per distinct source by
+        `components.schema_registry.compile_schema`, which validates the source
+        with `ast` before executing it.
     """
-    schema_name = schema_str.split("(")[0].split("class")[1].strip()
-
-    namespace = {}
-    exec(schema_str, namespace)
-    schema_class = namespace[schema_name]
+    compiled = compile_schema(schema_str)
+    return compiled.schema_class, compiled.name
 
-    return schema_class, schema_name
 
-
-def update_table_schema(extracted_data):
+def update_table_schema(extracted_data, stream: bool = False):
     table_data = extracted_data["table_columns"]
 
     prompt = f"""Translate the column names and data types from this data into a Pydantic model:
@@ -234,38 +359,127 @@ def update_table_schema(extracted_data):
         {"role": "user", "content": prompt},
     ]
 
-    resp = llm.chat.completions.create(model="gpt-4o-2024-08-06", messages=messages)
-
-    resp_str = resp.choices[0].message.content
+    resp_str = complete(stream, model="gpt-4o-2024-08-06", messages=messages)
 
     messages.append({"role": "assistant", "content": resp_str})
 
     messages.append({"role": "user", "content": prompt_pydantic})
 
-    resp = llm.chat.completions.create(model="gpt-4o-2024-08-06", messages=messages)
-
-    resp_str = resp.choices[0].message.content
+    resp_str = complete(
+        stream,
+        stop_after_code_block=True,
+        model="gpt-4o-2024-08-06",
+        messages=messages,
+    )
     model_class = re.split(r"```.*", resp_str)[1].strip()
 
     return model_class
 
 
 def persist_schema_definition(schema_str, schema_name):
-    schema_path = Path("./schemas") / f"{schema_name}.py"
+    schema_path = schema_catalog.directory / f"{schema_name}.py"
     with open(schema_path, "w") as schema_file:
         schema_file.write(schema_str)
+    schema_catalog.invalidate()
+
+
+@contextmanager
+def _timed(timings: Optional[Dict[str, float]], stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = time.perf_counter() - start
+
+
+def _select_and_generate_pipelined(pages, timings, tokens):
+    # Custom generation starts alongside selection on the selection prompt, and
+    # is cancelled if selection finds an existing schema
+    cancel = threading.Event()
+
+    def select():
+        with _timed(timings, "selection"):
+            return get_schema_selection(pages)
+
+    def generate():
+        with _timed(timings, "custom_generation"):
+            return generate_custom_schema(
+                build_selection_messages(pages),
+                stream=True,
+                cancel=cancel,
+                tokens=tokens,
+            )
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    generated = False
+    try:
+        selection = executor.submit(select)
+        generation = executor.submit(generate)
+
+        schema, history = selection.result()
+        if schema is not None:
+            return schema, history
+        result = generation.result()
+        generated = True
+        return result
+    finally:
+        # Unless its result is used, e.g. because selection found a schema or
+        # raised, the speculative generation is cancelled
+        if not generated:
+            cancel.set()
+        # Don't wait for a cancelled generation to notice and wind down
+        executor.shutdown(wait=False)
+
+
+def generate_schema(
+    pages,
+    pipelined: bool = False,
+    timings: Optional[Dict[str, float]] = None,
+    tokens: Optional[Dict[str, Tuple[int, int]]] = None,
+):
+    """
+    Find or generate a schema for a document.
 
+    Args:
+        pages: The pages of the document, as text or images.
+        pipelined (bool): Run custom generation speculatively alongside schema
+            selection and stream intermediate completions, trading some tokens
+            for fewer sequential round trips.
+        timings (Optional[Dict[str, float]]): If given, filled with the
+            wall-clock seconds spent in each stage.
+        tokens (Optional[Dict[str, Tuple[int, int]]]): If given, filled with the
+            estimated prompt tokens of each follow-up call before and after its
+            page images were dropped.
 
-def generate_schema(pages):
-    schema, history = get_schema_selection(pages)
-
-    if schema is None:
-        schema, history = generate_custom_schema(history)
-
-    schema_class, schema_name = get_schema_class(schema)
-
-    if schema_name == "Table":
-        test_data = extract_data_with_schema([pages[0]], schema_class)
-        schema = update_table_schema(test_data)
-
-    return schema
+    Returns:
+        str: The source of the schema.
+    """
+    with _timed(timings, "total"):
+        with _timed(timings, "fingerprint_lookup"):
+            # Repeat document types reuse the schema of their nearest neighbour
+            match = fingerprint_index.lookup(pages)
+        if match is not None:
+            return match[0]
+
+        if pipelined:
+            schema, history = _select_and_generate_pipelined(pages, timings, tokens)
+        else:
+            with _timed(timings, "selection"):
+                schema, history = get_schema_selection(pages)
+
+            if schema is None:
+                with _timed(timings, "custom_generation"):
+                    schema, history = generate_custom_schema(history, tokens=tokens)
+
+        with _timed(timings, "compile"):
+            schema_class, schema_name = get_schema_class(schema)
+
+        if schema_name == "Table":
+            with _timed(timings, "table_test_extraction"):
+                test_data = extract_data_with_schema([pages[0]], schema_class)
+            with _timed(timings, "table_schema_update"):
+                schema = update_table_schema(test_data, stream=pipelined)
+
+        fingerprint_index.add(pages, schema)
+        return schema
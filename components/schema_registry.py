@@ -0,0 +1,520 @@
+import ast
+import builtins
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Type
+
+from openai import ContentFilterFinishReasonError, LengthFinishReasonError
+from pydantic import BaseModel
+
+# Names a schema may import, by module; nothing else is importable
+ALLOWED_IMPORTS = {
+    "__future__": {"annotations"},
+    "datetime": {"date", "datetime", "time", "timedelta"},
+    "decimal": {"Decimal"},
+    "enum": {"Enum", "IntEnum"},
+    "pydantic": {"BaseModel", "ConfigDict", "Field"},
+    "typing": {
+        "Annotated",
+        "Any",
+        "Dict",
+        "List",
+        "Literal",
+        "Optional",
+        "Set",
+        "Tuple",
+        "Union",
+    },
+}
+# Callables a schema may invoke, e.g. in `Field(description=...)` defaults
+ALLOWED_CALLS = {"ConfigDict", "Field"}
+# Builtins a schema may refer to, as field types and e.g. `default_factory`
+ALLOWED_BUILTINS = {
+    "bool",
+    "bytes",
+    "dict",
+    "float",
+    "frozenset",
+    "int",
+    "list",
+    "object",
+    "set",
+    "str",
+    "tuple",
+}
+ALLOWED_NODES = (
+    ast.Module,
+    ast.Expression,
+    ast.ImportFrom,
+    ast.alias,
+    ast.ClassDef,
+    ast.AnnAssign,
+    ast.Assign,
+    ast.Expr,
+    ast.Pass,
+    ast.Name,
+    ast.Attribute,
+    ast.Subscript,
+    ast.Constant,
+    ast.Tuple,
+    ast.List,
+    ast.Dict,
+    ast.Load,
+    ast.Store,
+    ast.Call,
+    ast.keyword,
+    ast.BinOp,
+    ast.BitOr,
+    ast.UnaryOp,
+    ast.USub,
+)
+
+
+class UnsafeSchemaError(ValueError):
+    """Raised for schema source that is not a plain Pydantic model definition."""
+
+
+@dataclass(frozen=True)
+class CompiledSchema:
+    schema_class: Type[BaseModel]
+    name: str
+    json_schema: Dict
+
+
+@dataclass(frozen=True)
+class ResponseFormat:
+    """
+    A schema class paired with its precomputed strict `response_format` param.
+    """
+
+    schema_class: Type[BaseModel]
+    param: Dict
+
+    def parse(self, response) -> Dict:
+        """
+        Validate a chat completion against the schema and return its JSON data.
+
+        Raises:
+            LengthFinishReasonError: If the response was cut off.
+            ContentFilterFinishReasonError: If the response was filtered.
+            ValueError: If the model refused to answer.
+            pydantic.ValidationError: If the response does not match the schema.
+        """
+        choice = response.choices[0]
+        if choice.finish_reason == "length":
+            raise LengthFinishReasonError(completion=response)
+        if choice.finish_reason == "content_filter":
+            raise ContentFilterFinishReasonError()
+        if getattr(choice.message, "refusal", None):
+            raise ValueError(f"The model refused the request: {choice.message.refusal}")
+
+        return self.parse_content(choice.message.content)
+
+    def parse_content(self, content: str) -> Dict:
+        """
+        Validate the JSON text of a response, e.g. a fully streamed one.
+
+        Raises:
+            pydantic.ValidationError: If the content does not match the schema.
+        """
+        data = json.loads(content)
+        self.schema_class.model_validate(data)
+        return data
+
+
+_registry: Dict[str, CompiledSchema] = {}
+_response_formats: Dict[type, ResponseFormat] = {}
+_registry_lock = threading.Lock()
+
+
+def _class_members(tree: ast.Module) -> Dict[str, set]:
+    # The attributes of each class a schema defines, keyed by its dotted path,
+    # e.g. {"Survey": {"Response", "survey_name"}, "Survey.Response": {...}}
+    members: Dict[str, set] = {}
+
+    def visit(body, prefix):
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                path = prefix + node.name
+                members[path] = set()
+                for child in node.body:
+                    if isinstance(child, ast.ClassDef):
+                        members[path].add(child.name)
+                    elif isinstance(child, ast.AnnAssign):
+                        members[path].add(getattr(child.target, "id", None))
+                    elif isinstance(child, ast.Assign):
+                        members[path] |= {
+                            getattr(target, "id", None) for target in child.targets
+                        }
+                visit(node.body, path + ".")
+
+    visit(tree.body, "")
+    return members
+
+
+def _is_class_attribute(node: ast.Attribute, members: Dict[str, set]) -> bool:
+    # Only references into the schema's own classes, such as `Survey.Response`
+    # or an enum member `Status.open`, can be looked up
+    chain = []
+    while isinstance(node, ast.Attribute):
+        chain.insert(0, node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name) or node.id not in members:
+        return False
+    path = node.id
+    for i, attr in enumerate(chain):
+        if f"{path}.{attr}" in members:
+            path = f"{path}.{attr}"
+        elif attr not in members[path] or i != len(chain) - 1:
+            return False
+    return True
+
+
+def _is_setting(node: ast.AST, members: Dict[str, set]) -> bool:
+    # Values pydantic may call, such as `alias_generator`, `default_factory` or
+    # `json_schema_extra`, can only be literals or builtin types
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.operand, ast.Constant)
+    if isinstance(node, (ast.Tuple, ast.List)):
+        return all(_is_setting(elt, members) for elt in node.elts)
+    if isinstance(node, ast.Dict):
+        return all(
+            key is not None
+            and _is_setting(key, members)
+            and _is_setting(value, members)
+            for key, value in zip(node.keys, node.values)
+        )
+    if isinstance(node, ast.Name):
+        return node.id in ALLOWED_BUILTINS
+    if isinstance(node, ast.Attribute):
+        return _is_class_attribute(node, members)
+    return False
+
+
+def _forward_refs(node: ast.AST) -> List[ast.Constant]:
+    # Strings pydantic evaluates as types: string annotations and the string
+    # arguments of generics, except `Literal` values and `Annotated` metadata
+    if isinstance(node, ast.AnnAssign):
+        slices = [node.annotation]
+    elif isinstance(node, ast.Subscript):
+        name = getattr(node.value, "id", None)
+        slices = node.slice.elts if isinstance(node.slice, ast.Tuple) else [node.slice]
+        slices = (
+            [] if name == "Literal" else slices[:1] if name == "Annotated" else slices
+        )
+    else:
+        slices = []
+    return [
+        ref
+        for ref in slices
+        if isinstance(ref, ast.Constant) and isinstance(ref.value, str)
+    ]
+
+
+def _check_node(node: ast.AST, protected: set, members: Dict[str, set]):
+    if not isinstance(node, ALLOWED_NODES):
+        raise UnsafeSchemaError(
+            f"Line {getattr(node, 'lineno', '?')}: "
+            f"{type(node).__name__} is not allowed in a schema"
+        )
+    if isinstance(node, ast.ImportFrom):
+        if node.level != 0 or node.module not in ALLOWED_IMPORTS:
+            raise UnsafeSchemaError(f"Importing from {node.module} is not allowed")
+        for alias in node.names:
+            if alias.name not in ALLOWED_IMPORTS[node.module] or alias.asname:
+                raise UnsafeSchemaError(
+                    f"Line {node.lineno}: importing {alias.name} from "
+                    f"{node.module} is not allowed"
+                )
+    if isinstance(node, ast.Call):
+        if not (isinstance(node.func, ast.Name) and node.func.id in ALLOWED_CALLS):
+            raise UnsafeSchemaError(f"Line {node.lineno}: calls are not allowed")
+        values = list(node.args) + [keyword.value for keyword in node.keywords]
+        if any(keyword.arg is None for keyword in node.keywords) or not all(
+            _is_setting(value, members) for value in values
+        ):
+            raise UnsafeSchemaError(
+                f"Line {node.lineno}: {node.func.id} only takes literal values"
+            )
+    if isinstance(node, ast.ClassDef):
+        if node.decorator_list:
+            raise UnsafeSchemaError(f"Line {node.lineno}: decorators are not allowed")
+        if not all(_is_setting(keyword.value, members) for keyword in node.keywords):
+            raise UnsafeSchemaError(
+                f"Line {node.lineno}: class arguments must be literal values"
+            )
+        # Settings of a legacy `class Config`
+        if node.name == "Config" and not all(
+            _is_setting(child.value, members)
+            for child in node.body
+            if isinstance(child, (ast.Assign, ast.AnnAssign)) and child.value
+        ):
+            raise UnsafeSchemaError(
+                f"Line {node.lineno}: Config settings must be literal values"
+            )
+    if isinstance(node, (ast.Assign, ast.AnnAssign)) and node.value is not None:
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        if any(getattr(target, "id", None) == "model_config" for target in targets):
+            value = node.value
+            if not (isinstance(value, ast.Call) or _is_setting(value, members)):
+                raise UnsafeSchemaError(
+                    f"Line {node.lineno}: model_config must be a ConfigDict "
+                    "of literal values"
+                )
+    if isinstance(node, ast.Attribute) and not _is_class_attribute(node, members):
+        raise UnsafeSchemaError(
+            f"Line {node.lineno}: only the schema's own classes can be referred "
+            "to with attributes"
+        )
+    if isinstance(node, ast.Subscript) and not isinstance(
+        node.value, (ast.Name, ast.Attribute)
+    ):
+        raise UnsafeSchemaError(f"Line {node.lineno}: only types can be subscripted")
+
+    name = node.attr if isinstance(node, ast.Attribute) else None
+    name = node.id if isinstance(node, ast.Name) else name
+    if name is not None and name.startswith("__"):
+        raise UnsafeSchemaError(f"Line {node.lineno}: {name} is not allowed")
+    bound = node.id if isinstance(node, ast.Name) else None
+    bound = node.name if isinstance(node, ast.ClassDef) else bound
+    if bound in protected and not (
+        isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+    ):
+        raise UnsafeSchemaError(
+            f"Line {node.lineno}: {bound} can't be assigned in a schema"
+        )
+    if (
+        isinstance(node, ast.Name)
+        and isinstance(node.ctx, ast.Load)
+        and node.id not in protected
+        and hasattr(builtins, node.id)
+        and node.id not in ALLOWED_BUILTINS
+    ):
+        raise UnsafeSchemaError(f"Line {node.lineno}: {node.id} is not allowed")
+
+    for ref in _forward_refs(node):
+        try:
+            expression = ast.parse(ref.value.strip(), mode="eval")
+        except SyntaxError:
+            raise UnsafeSchemaError(
+                f"Line {ref.lineno}: {ref.value!r} is not a type"
+            ) from None
+        _check_tree(expression, protected, members)
+
+
+def _check_tree(tree: ast.AST, protected: set, members: Dict[str, set]):
+    for node in ast.walk(tree):
+        _check_node(node, protected, members)
+
+
+def validate_schema_source(tree: ast.Module):
+    """
+    Check that a parsed schema only declares models, imports and annotations.
+
+    Only the names in `ALLOWED_IMPORTS` can be imported, and neither they nor
+    the builtin types in `ALLOWED_BUILTINS` can be rebound (e.g. `Field = exec`)
+    or have their attributes looked up; attributes are only allowed on the
+    schema's own classes. Arguments of `Field` and `ConfigDict` must be
+    literals or builtin types, since pydantic calls e.g. `alias_generator`, and
+    string forward references are checked like the rest of the source, since
+    pydantic evaluates them.
+
+    Raises:
+        UnsafeSchemaError: If the source uses any other construct.
+    """
+    protected = set(ALLOWED_CALLS)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom):
+            protected |= {alias.asname or alias.name for alias in node.names}
+    _check_tree(tree, protected, _class_members(tree))
+
+
+def _import(name, globals=None, locals=None, fromlist=(), level=0):
+    # The only import a schema can perform, on top of the source validation
+    allowed = ALLOWED_IMPORTS.get(name, set()) if level == 0 else set()
+    if not fromlist or not set(fromlist) <= allowed:
+        raise ImportError(f"Importing {name} is not allowed")
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+def _schema_namespace(schema_name: str) -> Dict:
+    # Executed without the default builtins, so nothing the validation missed
+    # can reach exec, open or eval
+    schema_builtins = {name: getattr(builtins, name) for name in ALLOWED_BUILTINS}
+    schema_builtins.update(__build_class__=builtins.__build_class__, __import__=_import)
+    return {"__builtins__": schema_builtins, "__name__": f"schema_{schema_name}"}
+
+
+def _referenced_names(node: ast.ClassDef) -> set:
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            names.add(child.id)
+        elif isinstance(child, ast.Constant) and isinstance(child.value, str):
+            # Forward references such as "Survey.Response"
+            names.add(child.value.split(".")[0].split("[")[0].strip())
+    return names
+
+
+def find_root_model(tree: ast.Module) -> str:
+    """
+    Find the outermost model of a schema: the top-level BaseModel subclass that
+    no other top-level model refers to, preferring the last one defined.
+
+    Raises:
+        NameError: If the source defines no BaseModel subclass.
+    """
+    models: List[ast.ClassDef] = []
+    model_names = {"BaseModel"}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and any(
+            isinstance(base, ast.Name) and base.id in model_names for base in node.bases
+        ):
+            models.append(node)
+            model_names.add(node.name)
+
+    if not models:
+        raise NameError("No Pydantic model found in the schema definition")
+
+    referenced = set()
+    for model in models:
+        referenced |= _referenced_names(model) - {model.name}
+    roots = [model for model in models if model.name not in referenced]
+    return (roots or models)[-1].name
+
+
+def compile_schema(schema_str: str) -> CompiledSchema:
+    """
+    Build a Pydantic model from its source, once per distinct source.
+
+    The source is parsed with `ast`, validated against an allow-list of node
+    types, imported names and setting values, and executed in a fresh namespace. The resulting class
+    and its JSON schema are cached by the SHA-256 of the source.
+
+    Args:
+        schema_str (str): A string containing the Pydantic schema definition.
+
+    Returns:
+        CompiledSchema: The model class, its name and its JSON schema.
+
+    Raises:
+        SyntaxError: If there's a syntax error in the schema definition.
+        UnsafeSchemaError: If the schema uses constructs outside the allow-list.
+        NameError: If the schema defines no Pydantic model.
+    """
+    key = hashlib.sha256(schema_str.encode("utf-8")).hexdigest()
+    with _registry_lock:
+        if key in _registry:
+            return _registry[key]
+
+    tree = ast.parse(schema_str)
+    validate_schema_source(tree)
+    schema_name = find_root_model(tree)
+
+    namespace = _schema_namespace(schema_name)
+    exec(compile(tree, f"<schema {schema_name}>", "exec"), namespace)
+    schema_class = namespace[schema_name]
+    schema_class.model_rebuild(_types_namespace=namespace)
+
+    compiled = CompiledSchema(
+        schema_class, schema_name, schema_class.model_json_schema()
+    )
+    with _registry_lock:
+        _registry[key] = compiled
+    return compiled
+
+
+def _make_strict(json_schema: Dict, root: Dict) -> Dict:
+    # The conversion the OpenAI SDK applies in `parse`, done here rather than
+    # through its private helpers: every object closed and every property
+    # required, `None` defaults dropped, and `$ref`s with siblings inlined
+    for key in ("$defs", "definitions"):
+        for definition in json_schema.get(key, {}).values():
+            _make_strict(definition, root)
+
+    if json_schema.get("type") == "object":
+        json_schema.setdefault("additionalProperties", False)
+    properties = json_schema.get("properties")
+    if isinstance(properties, dict):
+        json_schema["required"] = list(properties)
+        for prop in properties.values():
+            _make_strict(prop, root)
+    if isinstance(json_schema.get("items"), dict):
+        _make_strict(json_schema["items"], root)
+    for variant in json_schema.get("anyOf", []):
+        _make_strict(variant, root)
+
+    all_of = json_schema.get("allOf")
+    if isinstance(all_of, list):
+        for entry in all_of:
+            _make_strict(entry, root)
+        if len(all_of) == 1:
+            json_schema.update(json_schema.pop("allOf")[0])
+
+    if "default" in json_schema and json_schema["default"] is None:
+        del json_schema["default"]
+
+    ref = json_schema.get("$ref")
+    if ref and len(json_schema) > 1:
+        resolved = root
+        for key in ref.removeprefix("#/").split("/"):
+            resolved = resolved[key]
+        # Keys next to the `$ref` take priority over the referenced ones
+        json_schema.update({**resolved, **json_schema})
+        del json_schema["$ref"]
+    return json_schema
+
+
+def strict_json_schema(schema_class: Type[BaseModel]) -> Dict:
+    """
+    Convert the JSON schema of a class to the strict form structured outputs
+    require.
+    """
+    json_schema = schema_class.model_json_schema()
+    return _make_strict(json_schema, json_schema)
+
+
+def response_format_param(schema_class: Type[BaseModel]) -> Dict:
+    """
+    Build the strict `response_format` param of a schema class for structured
+    outputs, as the SDK's `parse` sends it.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "schema": strict_json_schema(schema_class),
+            "name": schema_class.__name__,
+            "strict": True,
+        },
+    }
+
+
+def response_format_for(schema: "Type[BaseModel] | ResponseFormat") -> ResponseFormat:
+    """
+    Return the response format of a schema class, converting it only once.
+
+    The OpenAI SDK rebuilds the strict JSON schema of a Pydantic class on every
+    `parse` call; sending the cached param through `create` skips that work.
+
+    Args:
+        schema (Type[BaseModel] | ResponseFormat): A schema class, or an
+            already built response format which is returned as is.
+
+    Returns:
+        ResponseFormat: The cached response format of the schema.
+    """
+    if isinstance(schema, ResponseFormat):
+        return schema
+
+    with _registry_lock:
+        if schema in _response_formats:
+            return _response_formats[schema]
+
+    response_format = ResponseFormat(schema, response_format_param(schema))
+    with _registry_lock:
+        _response_formats[schema] = response_format
+    return response_format
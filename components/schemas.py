@@ -4,6 +4,7 @@ from typing import List
 import streamlit as st
 from streamlit_ace import st_ace
 
+from components.files import route_pages
 from components.schema_flow import generate_schema
 
 
@@ -80,10 +81,18 @@ def schema_interface_generate():
     # Generate schema
     if "schema_generated" not in st.session_state:
         with st.spinner("Generating schema..."):
-            selected_pages = [
-                st.session_state.pages[i] for i in st.session_state.selected_pages
-            ]
-            st.session_state.schema = generate_schema(selected_pages)
+            # Pages with a usable text layer are sent as markdown, the rest as
+            # images, as in extraction
+            selected_pages, routing = route_pages(
+                st.session_state.pages, st.session_state.selected_pages
+            )
+            st.session_state.schema_routing = routing
+            timings, tokens = {}, {}
+            st.session_state.schema = generate_schema(
+                selected_pages, pipelined=True, timings=timings, tokens=tokens
+            )
+            st.session_state.schema_timings = timings
+            st.session_state.schema_prompt_tokens = tokens
             st.session_state.schema_generated = True
 
 
@@ -119,3 +128,22 @@ def schema_interface():
         schema_interface_generate()
         st.write("### Generated Schema")
         st.code(st.session_state.schema, language="python")
+        if st.session_state.get("schema_timings"):
+            st.caption(
+                "Stage timings: "
+                + ", ".join(
+                    f"{stage} {seconds:.1f}s"
+                    for stage, seconds in st.session_state.schema_timings.items()
+                )
+            )
+        if st.session_state.get("schema_routing"):
+            st.caption(str(st.session_state.schema_routing))
+        tokens = st.session_state.get("schema_prompt_tokens")
+        if tokens:
+            st.caption(
+                "Prompt tokens without page images: "
+                + ", ".join(
+                    f"{stage} ~{after} ({before - after} saved)"
+                    for stage, (before, after) in tokens.items()
+                )
+            )
@@ -0,0 +1,279 @@
+import json
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple, Type
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic import BaseModel
+
+# Results held in memory before they are written as one Parquet part
+BUFFER_SIZE = 1_000
+
+_JSON_TYPES = {
+    "string": pa.string(),
+    "integer": pa.int64(),
+    "number": pa.float64(),
+    "boolean": pa.bool_(),
+}
+
+
+@dataclass
+class _ArrowType:
+    type: pa.DataType
+    # Converts a non-null value to the Arrow type, None if it is stored as is
+    convert: Optional[Callable] = None
+    # The fields of a struct
+    fields: Optional[Dict[str, "_ArrowType"]] = None
+
+
+def _json_text(value) -> str:
+    return json.dumps(value)
+
+
+def _list_converter(item: _ArrowType) -> Optional[Callable]:
+    if item.convert is None:
+        return None
+    return lambda values: [
+        None if value is None else item.convert(value) for value in values
+    ]
+
+
+def _struct_converter(fields: Dict[str, _ArrowType]) -> Optional[Callable]:
+    if all(field.convert is None for field in fields.values()):
+        return None
+    return lambda value: {
+        name: (
+            field.convert(value[name])
+            if field.convert is not None and value.get(name) is not None
+            else value.get(name)
+        )
+        for name, field in fields.items()
+    }
+
+
+def _arrow_type(schema: Dict, definitions: Dict) -> _ArrowType:
+    if "$ref" in schema:
+        return _arrow_type(definitions[schema["$ref"].split("/")[-1]], definitions)
+    if "anyOf" in schema:
+        # Optional[X] is X, nullable; other unions are kept as JSON text
+        variants = [v for v in schema["anyOf"] if v.get("type") != "null"]
+        if len(variants) == 1:
+            return _arrow_type(variants[0], definitions)
+        return _ArrowType(pa.string(), _json_text)
+    if "enum" in schema:
+        if all(isinstance(value, str) for value in schema["enum"]):
+            return _ArrowType(pa.string())
+        return _ArrowType(pa.string(), _json_text)
+
+    json_type = schema.get("type")
+    if json_type == "array":
+        item = _arrow_type(schema.get("items", {}), definitions)
+        return _ArrowType(pa.list_(item.type), _list_converter(item))
+    if json_type == "object" and "properties" in schema:
+        fields = {
+            name: _arrow_type(prop, definitions)
+            for name, prop in schema["properties"].items()
+        }
+        return _ArrowType(
+            pa.struct([(name, field.type) for name, field in fields.items()]),
+            _struct_converter(fields),
+            fields,
+        )
+    if json_type in _JSON_TYPES:
+        return _ArrowType(_JSON_TYPES[json_type])
+    # Free-form objects, e.g. Dict[str, int], and untyped values
+    return _ArrowType(pa.string(), _json_text)
+
+
+def _flatten_columns(
+    path: Tuple[str, ...], arrow_type: _ArrowType
+) -> List[Tuple[Tuple[str, ...], _ArrowType]]:
+    if arrow_type.fields is None:
+        return [(path, arrow_type)]
+    columns = []
+    for name, field in arrow_type.fields.items():
+        columns += _flatten_columns(path + (name,), field)
+    return columns
+
+
+def _columns(
+    schema_class: Type[BaseModel], flatten: bool
+) -> List[Tuple[Tuple[str, ...], _ArrowType]]:
+    # The path of each column in the data and its Arrow type
+    json_schema = schema_class.model_json_schema()
+    definitions = json_schema.get("$defs", {})
+    columns = []
+    for name, prop in json_schema["properties"].items():
+        arrow_type = _arrow_type(prop, definitions)
+        columns += (
+            _flatten_columns((name,), arrow_type)
+            if flatten
+            else [((name,), arrow_type)]
+        )
+    return columns
+
+
+def arrow_schema(schema_class: Type[BaseModel], flatten: bool = True) -> pa.Schema:
+    """
+    Map a Pydantic schema to Arrow columns.
+
+    Nested models become struct types, or with `flatten` one column per leaf
+    field named by its dotted path (e.g. "parsing_rules.subject_regex"). Lists
+    of models stay lists of structs. Unions other than Optional, free-form
+    dicts and untyped fields are stored as JSON text.
+    """
+    return pa.schema(
+        [
+            (".".join(path), arrow_type.type)
+            for path, arrow_type in _columns(schema_class, flatten)
+        ]
+    )
+
+
+class ResultSink:
+    """
+    Buffer extraction results and write them to Parquet in large parts.
+
+    Results are keyed by document id. Writing an id again replaces its previous
+    result: within the buffer right away, and across parts when reading or
+    compacting, where the row of the latest part wins.
+
+    Args:
+        directory (str | Path): Where the `part-NNNNNN.parquet` files are written.
+        schema_class (Type[BaseModel]): The schema of the extracted data.
+        flatten (bool): Whether nested models become dotted columns or structs.
+        buffer_size (int): The number of results per part.
+    """
+
+    def __init__(
+        self,
+        directory: "str | Path",
+        schema_class: Type[BaseModel],
+        flatten: bool = True,
+        buffer_size: int = BUFFER_SIZE,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.flatten = flatten
+        self.buffer_size = buffer_size
+        self._columns = _columns(schema_class, flatten)
+        data_schema = arrow_schema(schema_class, flatten)
+        self.schema = pa.schema(
+            [pa.field("doc_id", pa.string()), pa.field("error", pa.string())]
+            + list(data_schema)
+        )
+        self._buffer: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _row(self, data: Dict) -> Dict:
+        row = {}
+        for path, arrow_type in self._columns:
+            value = data
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value is not None and arrow_type.convert is not None:
+                value = arrow_type.convert(value)
+            row[".".join(path)] = value
+        return row
+
+    def _parts(self) -> List[Path]:
+        return sorted(self.directory.glob("part-*.parquet"))
+
+    def write(
+        self, doc_id, data: Optional[Dict] = None, error: Optional[str] = None
+    ) -> bool:
+        """
+        Buffer the result of a document, a failure if `data` is None.
+
+        Returns:
+            bool: Whether the buffer was written out, this result included.
+        """
+        row = {} if data is None else self._row(data)
+        row["doc_id"], row["error"] = str(doc_id), error
+        with self._lock:
+            self._buffer[row["doc_id"]] = row
+            if len(self._buffer) < self.buffer_size:
+                return False
+            self._flush()
+            return True
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        parts = self._parts()
+        number = int(parts[-1].stem.split("-")[1]) + 1 if parts else 0
+        table = pa.Table.from_pylist(list(self._buffer.values()), schema=self.schema)
+        path = self.directory / f"part-{number:06d}.parquet"
+        # Written under a temporary name so readers never see a partial part
+        tmp = path.with_suffix(".tmp")
+        pq.write_table(table, tmp)
+        tmp.replace(path)
+        self._buffer.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self) -> "ResultSink":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def query(self, con: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        """
+        The written results as a relation, with only the latest row per id.
+        """
+        return con.sql(
+            f"""
+            SELECT * EXCLUDE (filename)
+            FROM read_parquet('{self.directory}/part-*.parquet', filename = true)
+            QUALIFY row_number() OVER (PARTITION BY doc_id ORDER BY filename DESC) = 1
+            """
+        )
+
+    def ids(self) -> Set[str]:
+        """
+        The ids of every document written so far, buffered ones included.
+        """
+        with self._lock:
+            ids = set(self._buffer)
+            if self._parts():
+                con = duckdb.connect(database=":memory:")
+                ids |= {
+                    doc_id
+                    for (doc_id,) in con.execute(
+                        f"SELECT DISTINCT doc_id "
+                        f"FROM read_parquet('{self.directory}/part-*.parquet')"
+                    ).fetchall()
+                }
+            return ids
+
+    def compact(self) -> Optional[Path]:
+        """
+        Merge all parts into one, dropping replaced rows.
+
+        Returns:
+            Optional[Path]: The merged part, or None if nothing was written.
+        """
+        with self._lock:
+            self._flush()
+            parts = self._parts()
+            if len(parts) <= 1:
+                return parts[0] if parts else None
+
+            number = int(parts[-1].stem.split("-")[1]) + 1
+            path = self.directory / f"part-{number:06d}.parquet"
+            tmp = path.with_suffix(".tmp")
+            con = duckdb.connect(database=":memory:")
+            self.query(con).order("doc_id").write_parquet(str(tmp))
+            tmp.replace(path)
+            for part in parts:
+                part.unlink()
+            return path
@@ -0,0 +1,121 @@
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence
+
+import duckdb
+
+# Rows fetched from the Parquet file at a time
+BATCH_SIZE = 1_024
+# Completed rows between two writes of the cursor file
+CURSOR_FLUSH_EVERY = 64
+
+
+class OffsetCursor:
+    """
+    A resumable position in a row stream, persisted as a small JSON file.
+
+    Rows may complete out of order when they are processed concurrently, so the
+    cursor tracks the lowest row that is not done yet: everything before
+    `offset` is complete and a restarted run continues from there. Rows that
+    completed past a gap are processed again after a crash, never skipped.
+
+    With `flush_every=None` the cursor is only saved by `flush`, e.g. once the
+    results of the finished rows have been written out.
+    """
+
+    def __init__(
+        self, path: "str | Path", flush_every: Optional[int] = CURSOR_FLUSH_EVERY
+    ):
+        self.path = Path(path)
+        self.flush_every = flush_every
+        self.offset = 0
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.offset = json.load(f)["offset"]
+        self._done = set()
+        self._unflushed = 0
+        self._lock = threading.Lock()
+
+    def mark_done(self, row: int):
+        with self._lock:
+            if row < self.offset:
+                return
+            self._done.add(row)
+            while self.offset in self._done:
+                self._done.remove(self.offset)
+                self.offset += 1
+            self._unflushed += 1
+            if self.flush_every is not None and self._unflushed >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic replace, so a crash never leaves a truncated cursor behind
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"offset": self.offset}, f)
+        os.replace(tmp, self.path)
+        self._unflushed = 0
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+
+class ParquetSource:
+    """
+    Stream the rows of a Parquet file in bounded memory.
+
+    Rows are read through duckdb as Arrow record batches of `batch_size` rows,
+    projected to `columns`, and numbered by their position in the file. With a
+    `cursor`, iteration starts at the cursor's offset, so a crashed run picks
+    up where it stopped once the finished rows are marked done.
+
+    Args:
+        path (str | Path): The Parquet file.
+        columns (Sequence[str]): The columns to read.
+        batch_size (int): The number of rows held in memory at a time.
+        cursor (Optional[OffsetCursor]): The position to resume from.
+    """
+
+    def __init__(
+        self,
+        path: "str | Path",
+        columns: Sequence[str],
+        batch_size: int = BATCH_SIZE,
+        cursor: Optional[OffsetCursor] = None,
+    ):
+        self.path = Path(path)
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.cursor = cursor
+
+    def __len__(self) -> int:
+        # Read from the file metadata, no rows are scanned
+        con = duckdb.connect(database=":memory:")
+        return con.execute(
+            "SELECT sum(num_rows) FROM parquet_file_metadata(?)", [str(self.path)]
+        ).fetchone()[0]
+
+    def __iter__(self) -> Iterator[Dict]:
+        """
+        Yields:
+            Dict: The projected columns of each row, and its position in the
+                file as "row".
+        """
+        start = self.cursor.offset if self.cursor is not None else 0
+        projection = ", ".join(f'"{column}"' for column in self.columns)
+        con = duckdb.connect(database=":memory:")
+        relation = con.sql(
+            f"""
+            SELECT file_row_number AS row, {projection}
+            FROM read_parquet($path, file_row_number = true)
+            WHERE file_row_number >= $start
+            """,
+            params={"path": str(self.path), "start": start},
+        )
+        for batch in relation.to_arrow_reader(self.batch_size):
+            yield from batch.to_pylist()
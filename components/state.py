@@ -24,6 +24,9 @@ def initialize_state():
     # extracted (JSON) data
     if "extracted_data" not in st.session_state:
         st.session_state.extracted_data = None
+    # time to first streamed row and total extraction time
+    if "extraction_metrics" not in st.session_state:
+        st.session_state.extraction_metrics = None
     # selected pages indices
     if "selected_pages" not in st.session_state:
         st.session_state.selected_pages = []
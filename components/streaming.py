@@ -0,0 +1,202 @@
+import json
+import time
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    get_args,
+    get_origin,
+)
+
+from openai import ContentFilterFinishReasonError, LengthFinishReasonError
+from pydantic import BaseModel, TypeAdapter
+
+from components.schema_flow import (
+    backend_for,
+    build_extraction_messages,
+    scheduler,
+)
+from components.schema_registry import response_format_for
+
+
+@dataclass
+class StreamedItem:
+    field: str
+    item: Any
+
+
+class ListItemScanner:
+    """
+    Incrementally scans a streamed JSON object for the items of its top-level
+    arrays, returning each item's JSON text as soon as the item is complete.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_start: Optional[int] = None
+        self._key: Optional[str] = None
+        self._array_key: Optional[str] = None
+        self._item_start: Optional[int] = None
+
+    def _complete(self, end: int, items: List[Tuple[str, str]]):
+        # Container items are already complete before their separator
+        if self._item_start is not None:
+            items.append((self._array_key, self.text[self._item_start : end].strip()))
+        self._item_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """
+        Consume the next chunk of the stream.
+
+        Returns:
+            List[Tuple[str, str]]: The field name and JSON text of every array
+                item completed by this chunk.
+        """
+        self.text += chunk
+        items = []
+        for i in range(self._pos, len(self.text)):
+            char = self.text[i]
+            in_array = self._array_key is not None and self._depth == 2
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(self.text[self._key_start : i + 1])
+                        self._key_start = None
+                continue
+
+            if in_array and self._item_start is None and char not in " \t\r\n,]":
+                self._item_start = i
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = i
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+                elif self._depth == 2 and char == "[":
+                    self._array_key = self._key
+            elif char in "}]":
+                if in_array:
+                    self._complete(i, items)
+                    self._array_key = None
+                self._depth -= 1
+                if self._depth == 2 and self._array_key is not None:
+                    # A container item of a top-level array just closed
+                    self._complete(i + 1, items)
+            elif char == ":" and self._depth == 1:
+                self._expect_key = False
+            elif char == ",":
+                if self._depth == 1:
+                    self._expect_key = True
+                elif in_array:
+                    self._complete(i, items)
+
+        self._pos = len(self.text)
+        return items
+
+
+def _list_item_adapters(schema) -> Dict[str, TypeAdapter]:
+    adapters = {}
+    for name, field in schema.model_fields.items():
+        annotation = field.annotation
+        # Unwrap Optional[List[...]]
+        if get_origin(annotation) is Union:
+            args = [arg for arg in get_args(annotation) if arg is not type(None)]
+            annotation = args[0] if len(args) == 1 else annotation
+        if get_origin(annotation) is list and get_args(annotation):
+            adapters[name] = TypeAdapter(get_args(annotation)[0])
+    return adapters
+
+
+def stream_extraction(
+    pages,
+    schema,
+    local=False,
+    metrics: Optional[Dict[str, float]] = None,
+    backend: Optional[str] = None,
+) -> Generator[StreamedItem, None, Dict]:
+    """
+    Extract data while it streams in, yielding list items as they complete.
+
+    Items of the schema's top-level list fields (e.g. table rows or survey
+    questions) are validated against their item type and yielded as soon as
+    their closing bracket arrives; the full result is validated at the end.
+
+    Args:
+        pages: The pages of the document, as text or images.
+        schema: A schema class or its `ResponseFormat`.
+        local (bool): Whether to use the local model.
+        metrics (Optional[Dict[str, float]]): If given, filled with the seconds
+            to the first item ("time_to_first_row") and in total ("total").
+        backend (Optional[str]): The name of a registered backend to use instead.
+
+    Raises:
+        LengthFinishReasonError: If the response was cut off.
+        ContentFilterFinishReasonError: If the response was filtered.
+        pydantic.ValidationError: If an item or the result does not match.
+
+    Yields:
+        StreamedItem: Each completed list item and the field it belongs to.
+
+    Returns:
+        Dict: The complete extracted data, as the generator's return value.
+    """
+    start = time.perf_counter()
+    response_format = response_format_for(schema)
+    adapters = _list_item_adapters(response_format.schema_class)
+
+    target = backend_for(local, backend)
+    completion = scheduler.call(
+        target.create,
+        model=target.model,
+        messages=build_extraction_messages(pages),
+        response_format=response_format.param,
+        stream=True,
+    )
+
+    scanner = ListItemScanner()
+    last_chunk, finish_reason = None, None
+    try:
+        for chunk in completion:
+            if not chunk.choices:
+                continue
+            last_chunk = chunk
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            for field, item in scanner.feed(chunk.choices[0].delta.content or ""):
+                if field not in adapters:
+                    continue
+                item = adapters[field].validate_json(item)
+                if isinstance(item, BaseModel):
+                    item = item.model_dump(mode="json")
+                if metrics is not None and "time_to_first_row" not in metrics:
+                    metrics["time_to_first_row"] = time.perf_counter() - start
+                yield StreamedItem(field, item)
+    finally:
+        completion.close()
+
+    if finish_reason == "length":
+        raise LengthFinishReasonError(completion=last_chunk)
+    if finish_reason == "content_filter":
+        raise ContentFilterFinishReasonError()
+    data = response_format.parse_content(scanner.text)
+    if metrics is not None:
+        metrics["total"] = time.perf_counter() - start
+    return data
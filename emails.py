@@ -1,17 +1,20 @@
-import json
+import argparse
+import asyncio
 from typing import List, Optional
 
-import duckdb
 from pydantic import BaseModel
 from tqdm import tqdm
 
-from components.schema_flow import extract_data_with_schema
+from components.batch import BatchRun
+from components.extraction import extract_many
+from components.logs import configure_logging
+from components.rules import REGEX, RuleReplay, header_layout, rules_path
+from components.schema_flow import backend_for, backends
+from components.sink import ResultSink
+from components.sources import BATCH_SIZE, OffsetCursor, ParquetSource
 
-con = duckdb.connect(database=":memory:")
-emails = con.execute(
-    "SELECT message FROM './data/enron_sample_small.parquet';"
-).fetchall()
-emails = [email[0] for email in emails]
+EMAILS_PATH = "./data/enron_sample_small.parquet"
+OUTPUT_DIR = "data/eval_outputs"
 
 
 class ParsingRules(BaseModel):
@@ -32,30 +35,122 @@ class Email(BaseModel):
     parsing_rules: ParsingRules
 
 
-def flow(pages, prebaked_schema):
-    # generated_schema_str = generate_schema(pages)
-    # print(generated_schema_str)
-    # generated_schema, _ = get_schema_class(generated_schema_str)
-    # extracted_data_gen = extract_data_with_schema(pages, generated_schema)
-    extracted_data = extract_data_with_schema(pages, prebaked_schema)
-    extracted_data_local = extract_data_with_schema(pages, prebaked_schema, local=True)
-
-    return None, extracted_data, None, extracted_data_local
-
-
-for i, email in tqdm(enumerate(emails), total=len(emails)):
-    email_data_gen, email_data, email_data_schema, email_data_local = flow(
-        [email], Email
+# Requests in flight against the cloud and local models
+CONCURRENCY = 16
+LOCAL_CONCURRENCY = 2
+
+
+def derive_email_fields(data, text):
+    # The one field the header regexes cannot give
+    def domain(address):
+        return address.rsplit("@", 1)[-1].strip(" <>").lower()
+
+    recipients = (data["to"] or []) + (data["ccs"] or []) + (data["bccs"] or [])
+    sender = domain(data["sender"])
+    return {"has_external_recipients": any(domain(r) != sender for r in recipients)}
+
+
+async def extract_emails(prefix, local, concurrency, batch_size, replay=None):
+    # Each model keeps its own cursor, so either run resumes independently.
+    # The cursor is only saved once the results before it are on disk.
+    cursor = OffsetCursor(f"{OUTPUT_DIR}/{prefix}emails.cursor.json", None)
+    source = ParquetSource(EMAILS_PATH, ["message"], batch_size, cursor=cursor)
+    sink = ResultSink(f"{OUTPUT_DIR}/{prefix}emails", Email)
+    progress = tqdm(total=len(source), initial=cursor.offset, desc=f"{prefix}emails")
+    # Messages sent to the model, kept to learn parsing rules from the answer
+    in_flight = {}
+
+    def record(row, data, error=None):
+        progress.update()
+        flushed = sink.write(f"email_{row}", data, error)
+        cursor.mark_done(row)
+        if flushed:
+            cursor.flush()
+
+    def jobs():
+        for row in source:
+            message = row["message"]
+            if replay is not None:
+                data = replay.replay(header_layout(message), message)
+                if data is not None:
+                    record(row["row"], data)
+                    continue
+                in_flight[row["row"]] = message
+            yield [message], Email, row["row"]
+
+    try:
+        async for result in extract_many(jobs(), concurrency=concurrency, local=local):
+            message = in_flight.pop(result.job_id, None)
+            if not result.ok:
+                tqdm.write(f"{prefix}email_{result.job_id} failed: {result.error!r}")
+                record(result.job_id, None, repr(result.error))
+                continue
+            if message is not None:
+                replay.learn(header_layout(message), message, result.data)
+            record(result.job_id, result.data)
+    finally:
+        sink.flush()
+        cursor.flush()
+        progress.close()
+        if replay is not None:
+            tqdm.write(f"{prefix}emails: {replay.stats}")
+
+
+async def main(batch_size, rules):
+    # With rules, emails whose header layout has known parsing rules are
+    # extracted locally and only the others are sent to the models. Each
+    # model learns and replays its own rules.
+    def replay(local):
+        if not rules:
+            return None
+        backend = backend_for(local)
+        path = rules_path(backend.name, backend.model)
+        return RuleReplay(Email, REGEX, path, derive=derive_email_fields)
+
+    await asyncio.gather(
+        extract_emails("", False, CONCURRENCY, batch_size, replay(False)),
+        extract_emails("local_", True, LOCAL_CONCURRENCY, batch_size, replay(True)),
     )
 
-    with open(f"data/eval_outputs/email_{i}.json", "w") as f:
-        json.dump(email_data, f, indent=2)
-
-    # with open(f"data/eval_outputs/generated_email_{i}.json", "w") as f:
-    #     json.dump(email_data_gen, f, indent=2)
 
-    # with open(f"data/eval_outputs/generated_email_{i}_schema.txt", "w") as f:
-    #     f.write(email_data_schema)
+def main_batch(run_dir, batch_size):
+    # Re-running with the same directory resumes the submitted batches
+    run = BatchRun(run_dir, Email)
+    source = ParquetSource(EMAILS_PATH, ["message"], batch_size)
+    run.submit((f"email_{row['row']}", [row["message"]]) for row in source)
+    print(run.wait())
+
+    with ResultSink(f"{OUTPUT_DIR}/batch_emails", Email) as sink:
+        for result in run.results():
+            if not result.ok:
+                print(f"{result.job_id} failed: {result.error!r}")
+            sink.write(
+                result.job_id, result.data, None if result.ok else repr(result.error)
+            )
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--batch",
+        metavar="RUN_DIR",
+        help="extract through the batch API, keeping resumable state in RUN_DIR",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="emails read from the Parquet file at a time",
+    )
+    parser.add_argument(
+        "--rules",
+        action="store_true",
+        help="replay learned header parsing rules before calling the models",
+    )
+    args = parser.parse_args()
 
-    with open(f"data/eval_outputs/local_email_{i}.json", "w") as f:
-        json.dump(email_data_local, f, indent=True)
+    if args.batch:
+        main_batch(args.batch, args.batch_size)
+    else:
+        backends.run(main(args.batch_size, args.rules))
@@ -1,17 +1,9 @@
-import json
 from typing import List
 
 from pydantic import BaseModel
 
-from components.files import get_images
-from components.schema_flow import (
-    extract_data_with_schema,
-    generate_schema,
-    get_schema_class,
-)
-
-images = get_images("./data/poll.pdf")
-poll = images[4]
+from components.evals import GENERATED, EvalDocument, run_eval
+from components.logs import configure_logging
 
 
 class Poll(BaseModel):
@@ -29,33 +21,11 @@ class Poll(BaseModel):
     questions: List[Question]
 
 
-def flow(pages, prebaked_schema):
-    generated_schema_str = generate_schema(pages)
-    print(generated_schema_str)
-    generated_schema, _ = get_schema_class(generated_schema_str)
-    extracted_data_gen = extract_data_with_schema(pages, generated_schema)
-    extracted_data = extract_data_with_schema(pages, prebaked_schema)
-    extracted_data_local = extract_data_with_schema(pages, prebaked_schema, local=True)
-
-    return (
-        None,
-        None,
-        None,
-        extracted_data_local,
+if __name__ == "__main__":
+    configure_logging()
+    run_eval(
+        [EvalDocument(id="poll", path="./data/poll.pdf", pages=[4])],
+        schemas=[GENERATED, Poll],
+        backends=["openai", "local"],
+        run_dir="data/eval_outputs/poll",
     )
-
-
-gen_data_poll, data_poll, schema_poll, local_data_poll = flow([poll], Poll)
-
-
-# with open("data/eval_outputs/poll.json", "w") as f:
-#     json.dump(data_poll, f, indent=2)
-
-# with open("data/eval_outputs/generated_poll.json", "w") as f:
-#     json.dump(gen_data_poll, f, indent=2)
-
-# with open("data/eval_outputs/generated_poll_schema.txt", "w") as f:
-#     f.write(schema_poll)
-
-with open("data/eval_outputs/local_poll.json", "w") as f:
-    json.dump(local_data_poll, f, indent=2)
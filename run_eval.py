@@ -0,0 +1,52 @@
+import argparse
+
+from components.evals import GENERATED, read_manifest, run_eval
+from components.logs import configure_logging
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluate schemas and backends on a dataset of documents."
+    )
+    parser.add_argument(
+        "manifest", help="JSONL file with one document (id, path or text) per line"
+    )
+    parser.add_argument(
+        "--schemas",
+        nargs="+",
+        default=[GENERATED],
+        help=f"module:Class references, schema files, or {GENERATED!r}",
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["openai", "local"],
+        help="Names of registered backends",
+    )
+    parser.add_argument(
+        "--run-dir",
+        required=True,
+        help="Where results are checkpointed; re-running resumes the run",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--race",
+        action="store_true",
+        help="Also race all backends per document and keep the first valid answer",
+    )
+    args = parser.parse_args()
+    configure_logging()
+
+    path = run_eval(
+        read_manifest(args.manifest),
+        args.schemas,
+        args.backends,
+        args.run_dir,
+        args.concurrency,
+        args.race,
+    )
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
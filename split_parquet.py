@@ -1,16 +1,11 @@
 from pathlib import Path
 
-import duckdb
+from components.sources import ParquetSource
 
 emails_container = Path("./data/emails")
 emails_container.mkdir(exist_ok=True)
 
-con = duckdb.connect(database=":memory:")
-emails = con.execute(
-    "SELECT message FROM './data/enron_sample_small.parquet';"
-).fetchall()
-emails = [email[0] for email in emails]
-
-for i, email in enumerate(emails):
-    with open(emails_container / f"email_{i}.txt", "w") as f:
-        f.write(email)
+# Streamed in batches, so the corpus never has to fit in memory
+for row in ParquetSource("./data/enron_sample_small.parquet", ["message"]):
+    with open(emails_container / f"email_{row['row']}.txt", "w") as f:
+        f.write(row["message"])
@@ -0,0 +1,36 @@
+import asyncio
+
+from bench_backends import MESSAGES, MODEL, start_stand_in
+from components.backends import BackendConfig, BackendRegistry
+
+
+def test_async_clients_are_closed_when_their_run_ends():
+    registry = BackendRegistry(
+        [BackendConfig("stand-in", MODEL, [start_stand_in(0.0)], api_key="x")]
+    )
+    backend = registry.get("stand-in")
+    clients = []
+
+    async def extract():
+        await backend.acreate(model=MODEL, messages=MESSAGES)
+        clients.append(backend.endpoints[0].aclient)
+
+    for _ in range(2):
+        registry.run(extract())
+
+    assert clients[0] is not clients[1]
+    assert all(client.is_closed() for client in clients)
+
+
+def test_aclose_leaves_clients_of_other_loops():
+    registry = BackendRegistry(
+        [BackendConfig("stand-in", MODEL, [start_stand_in(0.0)], api_key="x")]
+    )
+    endpoint = registry.get("stand-in").endpoints[0]
+
+    async def open_client():
+        return endpoint.aclient
+
+    client = asyncio.run(open_client())
+    asyncio.run(registry.aclose())
+    assert endpoint._aclient is client and not client.is_closed()
@@ -0,0 +1,149 @@
+import json
+from types import SimpleNamespace
+
+from openai import LengthFinishReasonError
+from pydantic import BaseModel
+
+from components.batch import BatchRun
+
+
+class Invoice(BaseModel):
+    total: int
+
+
+def _answer(
+    job_id: str,
+    status_code: int = 200,
+    total: int = 1,
+    finish_reason: str = "stop",
+    refusal: str = None,
+) -> str:
+    message = {"role": "assistant", "content": json.dumps({"total": total})}
+    if refusal is not None:
+        message = {"role": "assistant", "content": None, "refusal": refusal}
+    body = {
+        "id": f"chatcmpl-{job_id}",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-2024-08-06",
+        "choices": [{"index": 0, "finish_reason": finish_reason, "message": message}],
+    }
+    return json.dumps(
+        {
+            "custom_id": job_id,
+            "response": {"status_code": status_code, "body": body},
+            "error": None,
+        }
+    )
+
+
+class StubClient:
+    """
+    Stands in for the files and batches endpoints. Each created batch finishes
+    with the next scripted outcome, a status and a function from the request
+    ids of its input file to the lines of its output file.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.uploads = {}
+        self.batches_by_id = {}
+        self.submitted = []
+        self.files = SimpleNamespace(create=self._upload, content=self._content)
+        self.batches = SimpleNamespace(
+            create=self._create_batch, retrieve=self.batches_by_id.get
+        )
+
+    def _upload(self, file, purpose):
+        file_id = f"file-{len(self.uploads)}"
+        self.uploads[file_id] = file.read().decode()
+        return SimpleNamespace(id=file_id)
+
+    def _content(self, file_id):
+        return SimpleNamespace(text=self.uploads[file_id])
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        job_ids = [
+            json.loads(line)["custom_id"]
+            for line in self.uploads[input_file_id].splitlines()
+        ]
+        self.submitted.append(job_ids)
+        status, respond = self.outcomes.pop(0)
+        output_id = f"file-{len(self.uploads)}"
+        self.uploads[output_id] = "\n".join(respond(job_ids)) + "\n"
+        batch_id = f"batch-{len(self.batches_by_id)}"
+        # Retrieved as finished, like a batch that is done by the next poll
+        self.batches_by_id[batch_id] = SimpleNamespace(
+            id=batch_id, status=status, output_file_id=output_id, error_file_id=None
+        )
+        return SimpleNamespace(id=batch_id, status="validating")
+
+
+def test_failed_requests_are_requeued(tmp_path):
+    client = StubClient(
+        [
+            # Expires after answering "a", with "c" rate limited and "b" lost
+            ("expired", lambda ids: [_answer("a"), _answer("c", status_code=429)]),
+            ("completed", lambda ids: [_answer(job_id, total=2) for job_id in ids]),
+        ]
+    )
+    run = BatchRun(tmp_path, Invoice, client=client)
+    run.submit((job_id, [f"invoice {job_id}"]) for job_id in "abc")
+    run.wait(poll_interval=0)
+
+    assert client.submitted == [["a", "b", "c"], ["b", "c"]]
+    results = {result.job_id: result for result in run.results()}
+    assert sorted(results) == ["a", "b", "c"]
+    assert all(result.ok for result in results.values())
+    assert results["b"].data == {"total": 2}
+
+
+def test_requests_are_reported_after_the_last_attempt(tmp_path):
+    client = StubClient([("failed", lambda ids: [])] * 3)
+    run = BatchRun(tmp_path, Invoice, client=client)
+    run.submit([("a", ["invoice a"])])
+    run.wait(poll_interval=0)
+
+    assert len(client.submitted) == 3
+    [result] = run.results()
+    assert result.job_id == "a" and not result.ok
+
+
+def test_resumed_run_keeps_requeued_shards(tmp_path):
+    client = StubClient(
+        [
+            ("failed", lambda ids: []),
+            ("completed", lambda ids: [_answer(job_id) for job_id in ids]),
+        ]
+    )
+    run = BatchRun(tmp_path, Invoice, client=client)
+    run.submit([("a", ["invoice a"])])
+    run.wait(poll_interval=0)
+
+    resumed = BatchRun(tmp_path, Invoice, client=client)
+    resumed.submit([("a", ["invoice a"])])
+    assert len(client.submitted) == 2
+    assert [result.ok for result in resumed.results()] == [True]
+
+
+def test_truncated_and_refused_answers_are_reported_as_such(tmp_path):
+    client = StubClient(
+        [
+            (
+                "completed",
+                lambda ids: [
+                    _answer("a", finish_reason="length"),
+                    _answer("b", refusal="I can't help with that."),
+                    _answer("c"),
+                ],
+            )
+        ]
+    )
+    run = BatchRun(tmp_path, Invoice, client=client)
+    run.submit((job_id, [f"invoice {job_id}"]) for job_id in "abc")
+    run.wait(poll_interval=0)
+
+    results = {result.job_id: result for result in run.results()}
+    assert isinstance(results["a"].error, LengthFinishReasonError)
+    assert "refused" in str(results["b"].error)
+    assert results["c"].data == {"total": 1}
@@ -0,0 +1,26 @@
+import PIL.Image
+
+from components.encoding import encode_image, register_page
+
+
+def test_rerendered_pages_share_their_encoding():
+    first = PIL.Image.new("RGB", (32, 32), "white")
+    second = PIL.Image.new("RGB", (32, 32), "black")
+    register_page(first, ("pdf", 0, 300))
+    register_page(second, ("pdf", 0, 300))
+
+    assert encode_image(second) == encode_image(first)
+
+
+def test_images_derived_from_a_page_are_encoded_anew():
+    page = PIL.Image.new("RGB", (64, 64), "white")
+    register_page(page, ("pdf", 1, 300))
+    encoded = encode_image(page)
+
+    crop = page.crop((0, 0, 32, 32))
+    copy = page.copy()
+    copy.paste((0, 0, 0), (0, 0, 64, 64))
+    gray = page.convert("L")
+
+    for derived in (crop, copy, gray):
+        assert encode_image(derived) != encoded
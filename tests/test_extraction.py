@@ -0,0 +1,46 @@
+from components.extraction import merge_extractions, page_windows
+
+
+def test_repeated_answers_are_kept_without_overlap():
+    parts = [{"x": ["yes", "no"]}, {"x": ["no", "yes", "no"]}]
+    assert merge_extractions(parts) == {"x": ["yes", "no", "no", "yes", "no"]}
+
+
+def test_repeated_answers_are_kept_when_windows_do_not_overlap():
+    parts = [{"x": ["yes", "no"]}, {"x": ["no", "yes", "no"]}]
+    windows = [range(0, 2), range(2, 4)]
+    assert merge_extractions(parts, windows) == {"x": ["yes", "no", "no", "yes", "no"]}
+
+
+def test_overlapping_windows_drop_the_repeated_boundary():
+    # The shared page holds the answers "no", "yes"
+    parts = [{"x": ["yes", "no", "yes"]}, {"x": ["no", "yes", "no"]}]
+    windows = [range(0, 3), range(2, 4)]
+    assert merge_extractions(parts, windows) == {"x": ["yes", "no", "yes", "no"]}
+
+
+def test_overlap_must_be_a_suffix_and_prefix():
+    # "yes" appears in the previous tail but the lists do not line up
+    parts = [{"x": ["yes", "no"]}, {"x": ["yes", "yes"]}]
+    windows = [range(0, 2), range(1, 3)]
+    assert merge_extractions(parts, windows) == {"x": ["yes", "no", "yes", "yes"]}
+
+
+def test_nested_records_and_scalars():
+    parts = [
+        {"name": "", "rows": [{"id": 1}, {"id": 2}]},
+        {"name": "Report", "rows": [{"id": 2}, {"id": 3}]},
+    ]
+    windows = [range(0, 2), range(1, 3)]
+    assert merge_extractions(parts, windows) == {
+        "name": "Report",
+        "rows": [{"id": 1}, {"id": 2}, {"id": 3}],
+    }
+
+
+def test_page_windows_overlap():
+    pages = ["x" * 400] * 5
+    assert page_windows(pages, token_budget=300, overlap=1) == [
+        range(0, 3),
+        range(2, 5),
+    ]
@@ -0,0 +1,26 @@
+import pytest
+
+from components.html import html_main_text
+
+ARTICLE = """<html><head><script>var x = 1;</script></head><body>
+<nav><a href="/">Home</a></nav>
+<article><h1>Headline</h1><p>First paragraph.</p><p>Second paragraph.</p></article>
+<footer>Copyright</footer>
+</body></html>"""
+
+
+def test_boilerplate_is_dropped():
+    text = html_main_text(ARTICLE).text
+    assert text == "Headline\nFirst paragraph.\nSecond paragraph."
+
+
+def test_xml_declaration_is_ignored():
+    html = '<?xml version="1.0" encoding="utf-8"?>\n' + ARTICLE
+    assert html_main_text(html).text == html_main_text(ARTICLE).text
+
+
+@pytest.mark.parametrize("html", ["", "   \n", "<!-- nothing here -->"])
+def test_empty_documents_have_no_text(html):
+    result = html_main_text(html)
+    assert result.text == ""
+    assert result.tokens == 0
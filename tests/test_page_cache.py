@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from components.page_cache import PageCache
+
+
+def test_concurrent_puts_of_the_same_page(tmp_path):
+    cache = PageCache(tmp_path)
+    samples = bytes(range(256)) * 3
+
+    def put(_):
+        cache.put("abc", 0, 72, 16, 16, samples)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(put, range(200)))
+
+    assert cache.get("abc", 0, 72).size == (16, 16)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_evicts_least_recently_used_pages(tmp_path):
+    samples = bytes(16 * 16 * 3)
+    cache = PageCache(tmp_path, max_bytes=10**9)
+    cache.put("abc", 0, 72, 16, 16, samples)
+    entry_size = next(tmp_path.glob("*.pgz")).stat().st_size
+
+    cache = PageCache(tmp_path, max_bytes=2 * entry_size)
+    cache.put("abc", 1, 72, 16, 16, samples)
+    cache.put("abc", 2, 72, 16, 16, samples)
+
+    assert cache.get("abc", 0, 72) is None
+    assert cache.get("abc", 2, 72) is not None
@@ -0,0 +1,11 @@
+import asyncio
+
+import pytest
+
+from components.racing import extract_all_backends, extract_first_valid
+
+
+@pytest.mark.parametrize("dispatch", [extract_first_valid, extract_all_backends])
+def test_no_backends_is_a_value_error(dispatch):
+    with pytest.raises(ValueError):
+        asyncio.run(dispatch(["page"], dict, []))
@@ -0,0 +1,172 @@
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import openai
+import pytest
+from openai import OpenAI
+
+from bench_backends import COMPLETION, MESSAGES, MODEL, StandIn
+from components import scheduler as scheduler_module
+from components.response_cache import ResponseCache
+from components.scheduler import RateLimit, RequestScheduler
+
+
+class ScriptedStandIn(StandIn):
+    """
+    A stand-in server answering the first requests with the scripted
+    `(status, headers)` errors, and every later one with a completion.
+    """
+
+    script: list
+    requests: list
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.requests.append(self.path)
+        if len(self.requests) > len(self.script):
+            return self._reply(COMPLETION)
+
+        status, headers = self.script[len(self.requests) - 1]
+        body = json.dumps({"error": {"message": "Scripted error"}}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stand_in():
+    servers = []
+
+    def start(script=()):
+        handler = type(
+            "Handler", (ScriptedStandIn,), {"script": list(script), "requests": []}
+        )
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(server)
+        client = OpenAI(
+            base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+            api_key="stand-in",
+            max_retries=0,
+        )
+        return client, handler.requests
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+class FakeClock:
+    """Stands in for the `time` module, advancing on `sleep` without waiting."""
+
+    def __init__(self):
+        self.now = 1_000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler_module, "time", clock)
+    return clock
+
+
+@pytest.mark.parametrize(
+    "headers, delay",
+    [({"retry-after-ms": "1500"}, 1.5), ({"Retry-After": "2"}, 2.0)],
+)
+def test_rate_limits_wait_for_retry_after(stand_in, clock, headers, delay):
+    client, requests = stand_in([(429, headers)])
+    scheduler = RequestScheduler(
+        limits={MODEL: RateLimit(requests_per_minute=500, tokens_per_minute=100_000)},
+        base_delay=0.01,
+    )
+
+    response = scheduler.call(
+        client.chat.completions.create, model=MODEL, messages=MESSAGES
+    )
+
+    assert response.choices[0].message.content == '{"subject": "Hello"}'
+    assert len(requests) == 2
+    assert delay <= clock.sleeps[0] <= delay + 0.01
+    # Every other request to the model was held back too
+    assert scheduler._budgets[MODEL].blocked_until >= 1_000.0 + delay
+
+
+def test_server_errors_are_retried_until_max_retries(stand_in, clock):
+    client, requests = stand_in([(500, {})] * 3)
+    scheduler = RequestScheduler(limits={}, max_retries=2, base_delay=0.01)
+
+    with pytest.raises(openai.InternalServerError):
+        scheduler.call(client.chat.completions.create, model=MODEL, messages=MESSAGES)
+    assert len(requests) == 3
+
+
+def test_requests_wait_when_the_token_budget_is_spent(stand_in, clock):
+    client, requests = stand_in()
+    scheduler = RequestScheduler(
+        limits={MODEL: RateLimit(requests_per_minute=500, tokens_per_minute=1_200)}
+    )
+    scheduler._budgets[MODEL].tokens = 0
+
+    scheduler.call(
+        client.chat.completions.create, model=MODEL, messages=MESSAGES, max_tokens=600
+    )
+
+    assert len(requests) == 1
+    # The 603 estimated tokens refill at 1,200 per minute in about 30 seconds
+    assert sum(clock.sleeps) == pytest.approx(603 * 60 / 1_200)
+
+
+def test_estimates_are_corrected_with_the_reported_usage(stand_in, clock):
+    client, requests = stand_in()
+    scheduler = RequestScheduler(
+        limits={MODEL: RateLimit(requests_per_minute=500, tokens_per_minute=1_200)}
+    )
+
+    for _ in range(2):
+        scheduler.call(
+            client.chat.completions.create,
+            model=MODEL,
+            messages=MESSAGES,
+            max_tokens=1_000,
+        )
+
+    # The first request reserved 1,003 tokens but used 15, so the second one
+    # fits in the budget without waiting
+    assert len(requests) == 2
+    assert clock.sleeps == []
+
+
+def test_cache_hits_skip_the_network(stand_in, tmp_path):
+    client, requests = stand_in()
+    cache = ResponseCache(tmp_path / "responses.sqlite", mode="readwrite")
+    scheduler = RequestScheduler(limits={}, cache=cache)
+
+    first = scheduler.call(
+        client.chat.completions.create, model=MODEL, messages=MESSAGES
+    )
+    second = scheduler.call(
+        client.chat.completions.create, model=MODEL, messages=MESSAGES
+    )
+
+    assert len(requests) == 1
+    assert cache.hits == 1
+    assert second.choices[0].message.content == first.choices[0].message.content
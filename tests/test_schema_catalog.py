@@ -0,0 +1,46 @@
+import PIL.Image
+
+from components import schema_flow
+from components.fingerprints import FingerprintIndex
+from components.schema_catalog import SchemaCatalog
+
+
+def test_rank_prefers_shared_words():
+    catalog = SchemaCatalog("./schemas")
+    ranked = catalog.rank("Survey question 3: response count and percentage", k=1)
+    assert [entry.name for entry in ranked] == ["survey"]
+
+
+def test_rank_returns_nothing_without_text():
+    # Scanned pages have no text layer to rank against
+    assert SchemaCatalog("./schemas").rank("") == []
+
+
+def test_rank_skips_schemas_without_shared_words():
+    assert SchemaCatalog("./schemas").rank("zebra xylophone quokka") == []
+
+
+def test_neighbours_match_scans_by_layout(tmp_path):
+    index = FingerprintIndex(tmp_path / "fingerprints.jsonl")
+    striped = PIL.Image.new("RGB", (64, 64), "white")
+    for y in range(0, 64, 8):
+        striped.paste((0, 0, 0), (0, y, 64, y + 2))
+    blank = PIL.Image.new("RGB", (64, 64), "white")
+    blank.paste((0, 0, 0), (0, 0, 32, 64))
+    index.add([striped], "striped schema")
+    index.add([blank], "half schema")
+
+    neighbours = index.neighbours([striped.copy()], k=2)
+    assert [schema for schema, _ in neighbours] == ["striped schema", "half schema"]
+
+
+def test_scans_without_neighbours_are_offered_the_catalog(tmp_path, monkeypatch):
+    # No text layer and no fingerprinted documents: nothing to rank on
+    monkeypatch.setattr(schema_flow, "schema_catalog", SchemaCatalog("./schemas"))
+    monkeypatch.setattr(
+        schema_flow, "fingerprint_index", FingerprintIndex(tmp_path / "index.jsonl")
+    )
+    scan = PIL.Image.new("RGB", (64, 64), "white")
+
+    candidates = schema_flow.candidate_schemas([scan])
+    assert [entry.name for entry in candidates] == ["survey", "table"]
@@ -0,0 +1,211 @@
+from pathlib import Path
+
+import pytest
+
+from components.schema_registry import (
+    UnsafeSchemaError,
+    _schema_namespace,
+    compile_schema,
+    response_format_param,
+    strict_json_schema,
+)
+
+SCHEMAS_DIR = Path(__file__).parent.parent / "schemas"
+
+
+@pytest.mark.parametrize("path", sorted(SCHEMAS_DIR.glob("*.py")), ids=str)
+def test_seed_schemas_compile(path):
+    compiled = compile_schema(path.read_text())
+    assert compiled.json_schema["type"] == "object"
+
+
+def test_enums_dates_and_config_compile():
+    compiled = compile_schema(
+        """
+from datetime import date
+from enum import Enum
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class Status(str, Enum):
+    open = "open"
+    closed = "closed"
+
+
+class Filing(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    filed_on: Optional[date] = Field(None, description="Filing date")
+    status: Status
+    kind: Literal["annual", "amendment"]
+    amounts: List[float] = Field(default_factory=list)
+"""
+    )
+    assert compiled.name == "Filing"
+
+
+def test_rebinding_an_allowed_call_is_rejected(tmp_path):
+    target = tmp_path / "pwned_by_schema"
+    source = f"""
+from pydantic import BaseModel, Field
+
+Field = exec
+Field("open({str(target)!r}, 'w').write('x')")
+
+
+class Model(BaseModel):
+    x: int
+"""
+    with pytest.raises(UnsafeSchemaError):
+        compile_schema(source)
+    assert not target.exists()
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "from pydantic import BaseModel\nBaseModel = object\n",
+        "from pydantic import BaseModel\nclass Field(BaseModel):\n    x: int\n",
+        "from pydantic import BaseModel\n\nclass M(BaseModel):\n    Field: int = 1\n",
+        "from pydantic import BaseModel\n\nclass M(BaseModel):\n    x: int = open\n",
+        "from pydantic import BaseModel\nrun = eval\n",
+    ],
+)
+def test_rebinding_and_builtins_are_rejected(source):
+    with pytest.raises(UnsafeSchemaError):
+        compile_schema(source)
+
+
+def test_callable_settings_reaching_a_module_are_rejected(capfd):
+    source = """
+import typing
+
+from pydantic import BaseModel, ConfigDict
+
+
+class Model(BaseModel):
+    model_config = ConfigDict(alias_generator=typing.sys.modules["os"].system)
+
+    id: int
+"""
+    with pytest.raises(UnsafeSchemaError):
+        compile_schema(source)
+    assert "uid=" not in capfd.readouterr().out
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        # Attribute and subscript access on imported names
+        "from typing import List\nfrom pydantic import BaseModel\n\n"
+        "class M(BaseModel):\n    x: List.__mro__\n",
+        "from pydantic import BaseModel\n\n"
+        "class M(BaseModel):\n    x: BaseModel.model_config\n",
+        "from pydantic import BaseModel, Field\n\n"
+        "class M(BaseModel):\n    x: int = Field.__globals__['os']\n",
+        # Settings pydantic calls
+        "from pydantic import BaseModel, Field\n\n"
+        "class M(BaseModel):\n    x: list = Field(default_factory=BaseModel)\n",
+        "from pydantic import BaseModel, ConfigDict\n\n"
+        "class M(BaseModel):\n    model_config = ConfigDict(json_schema_extra=M)\n",
+        "from pydantic import BaseModel\n\n"
+        "class M(BaseModel):\n    model_config = {'alias_generator': M}\n",
+        "from pydantic import BaseModel\n\n"
+        "class M(BaseModel, alias_generator=BaseModel):\n    x: int\n",
+        "from pydantic import BaseModel\n\n"
+        "class M(BaseModel):\n    class Config:\n        alias_generator = M\n",
+        # Forward references are evaluated by pydantic
+        "from pydantic import BaseModel, Field\n\n"
+        "class M(BaseModel):\n    x: \"Field.__globals__['os']\"\n",
+        "from typing import List\nfrom pydantic import BaseModel\n\n"
+        "class M(BaseModel):\n    x: List[\"open('/etc/passwd')\"]\n",
+        # Only listed names, without aliases
+        "import typing\n",
+        "from typing import cast\n",
+        "from typing import List as L\n",
+    ],
+)
+def test_module_access_and_callable_settings_are_rejected(source):
+    with pytest.raises(UnsafeSchemaError):
+        compile_schema(source)
+
+
+def test_references_to_own_classes_compile():
+    compiled = compile_schema(
+        """
+from enum import Enum
+from typing import Annotated, List, Literal
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class Status(str, Enum):
+    open = "open"
+
+
+class Report(BaseModel):
+    class Row(BaseModel):
+        label: Annotated[str, "a row label"]
+
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+    status: Status = Field(Status.open, description="Status")
+    kind: Literal["a b", "c"] = "c"
+    rows: List["Report.Row"] = Field(default_factory=list)
+"""
+    )
+    assert compiled.name == "Report"
+
+
+def test_schemas_run_without_default_builtins():
+    # A name the validation missed still can't reach the builtins at runtime
+    namespace = _schema_namespace("M")
+    with pytest.raises(NameError):
+        exec("open('/dev/null')", namespace)
+    with pytest.raises(ImportError):
+        exec("import os", namespace)
+    with pytest.raises(ImportError):
+        exec("from typing import cast", namespace)
+
+
+def test_response_format_param_is_strict():
+    compiled = compile_schema((SCHEMAS_DIR / "survey.py").read_text())
+    param = response_format_param(compiled.schema_class)
+    assert param["type"] == "json_schema"
+    assert param["json_schema"]["name"] == "Survey"
+    assert param["json_schema"]["strict"] is True
+    assert param["json_schema"]["schema"]["additionalProperties"] is False
+
+
+@pytest.mark.parametrize(
+    "source",
+    [path.read_text() for path in sorted(SCHEMAS_DIR.glob("*.py"))]
+    + [
+        """
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class Kind(str, Enum):
+    a = "a"
+
+
+class Item(BaseModel):
+    name: str
+
+
+class Model(BaseModel):
+    kind: Kind = Field(description="The kind")
+    item: Optional[Item] = None
+    items: List[Item] = Field(default_factory=list)
+"""
+    ],
+)
+def test_strict_json_schema_matches_the_sdk(source):
+    sdk = pytest.importorskip("openai.lib._pydantic")
+    schema_class = compile_schema(source).schema_class
+    assert strict_json_schema(schema_class) == sdk.to_strict_json_schema(schema_class)
@@ -0,0 +1,69 @@
+import json
+from typing import Dict, List, Optional, Union
+
+import duckdb
+import pytest
+from pydantic import BaseModel
+
+from components.sink import ResultSink, arrow_schema
+
+
+class Rules(BaseModel):
+    subject_regex: Optional[str] = None
+
+
+class Line(BaseModel):
+    label: str
+    counts: Dict[str, int]
+
+
+class Record(BaseModel):
+    code: Union[int, str]
+    counts: Dict[str, int]
+    rules: Rules
+    lines: List[Line]
+
+
+def _record(code) -> Dict:
+    return {
+        "code": code,
+        "counts": {"yes": 3, "no": 1},
+        "rules": {"subject_regex": "^Subject: (.*)$"},
+        "lines": [{"label": "total", "counts": {"a": 1}}],
+    }
+
+
+def test_unions_and_dicts_are_json_text():
+    schema = arrow_schema(Record)
+    assert str(schema.field("code").type) == "string"
+    assert str(schema.field("counts").type) == "string"
+    assert str(schema.field("rules.subject_regex").type) == "string"
+
+
+@pytest.mark.parametrize("flatten", [True, False])
+def test_json_columns_round_trip(tmp_path, flatten):
+    with ResultSink(tmp_path, Record, flatten=flatten, buffer_size=2) as sink:
+        sink.write("a", _record(7))
+        sink.write("b", _record("X-7"))
+        sink.write("c", error="failed")
+
+    rows = {
+        row[0]: row[1:]
+        for row in ResultSink(tmp_path, Record, flatten=flatten)
+        .query(duckdb.connect())
+        .select("doc_id, code, counts, lines")
+        .fetchall()
+    }
+    assert json.loads(rows["a"][0]) == 7
+    assert json.loads(rows["b"][0]) == "X-7"
+    assert json.loads(rows["a"][1]) == {"yes": 3, "no": 1}
+    assert json.loads(rows["a"][2][0]["counts"]) == {"a": 1}
+    assert rows["c"] == (None, None, None)
+
+
+def test_flattened_columns_keep_free_form_dicts_whole(tmp_path):
+    with ResultSink(tmp_path, Record) as sink:
+        sink.write("a", _record(1))
+    columns = ResultSink(tmp_path, Record).query(duckdb.connect()).columns
+    assert "rules.subject_regex" in columns
+    assert not any(column.startswith("counts.") for column in columns)
@@ -2,13 +2,14 @@ import streamlit as st
 
 from components.data import download_data, extract_data
 from components.files import file_uploader, page_selector
+from components.logs import configure_logging
 from components.schemas import schema_interface
 from components.state import initialize_state
 
 WELCOME_MESSAGE = """
 This app uses AI to help you extract structured data from documents. Here's how it works:
 
-1. **Upload a document** - Supports PDF files (max 10 pages)
+1. **Upload a document** - Supports PDF files of any length
 2. **Select pages** - Choose which pages you want to process
 3. **Define your schema** - You have three options:
    - **Interface**: Build your schema using a user-friendly form
@@ -22,6 +23,8 @@ The schema defines what data to extract and how to structure it. It uses Python'
 📚 Want to learn more? Check out the [detailed blog post](https://medium.com/p/c3b6b2baed36) about the technology behind this app.
 """
 
+configure_logging()
+
 # Initialize session state variables
 initialize_state()
 